@@ -0,0 +1,195 @@
+'''
+Microbenchmarks for domain object construction and result mapping.
+
+Measures, for each domain class, the time to build a list of instances and the memory each instance takes (via
+tracemalloc), comparing the (slotted) class against an otherwise identical class with a per-instance __dict__. Result
+mapping is measured against a generated database: positional tuple unpacking (as the services do) against
+sqlite3.Row with keyed lookups, and the TaskService read paths end to end:
+
+    python -m benchmarks.domain_objects --output before.json
+    python -m benchmarks.domain_objects --output after.json --compare before.json
+'''
+
+# Imports
+# Standard
+import os
+import json
+import time
+import random
+import sqlite3
+import tempfile
+import tracemalloc
+
+from argparse import ArgumentParser
+from datetime import datetime
+
+# User
+from taskwebapp.controller import Field
+from taskwebapp.domain.attachment import AttachmentReference
+from taskwebapp.domain.task import TaskReference, Task, TaskNote, TaskStatus
+from taskwebapp.service.sqlite import TaskService, get_connection, statuses_by_id, from_epoch
+from taskwebapp.tools.datagen import Generator, Distribution, parse_weights
+from benchmarks.http_load import git_revision
+
+
+# Definitions
+def unslotted(cls):
+    '''
+    returns type: Class with the same constructor as cls, but instances with a __dict__ instead of slots.
+    '''
+
+    return type(f'Unslotted{cls.__name__}', (), {'__init__': cls.__init__})
+
+
+now = datetime.now()
+
+object_factories = {
+    'TaskReference': (TaskReference, lambda cls, i: cls(i, f'task {i}', TaskStatus.READY, now, now)),
+    'Task': (Task, lambda cls, i: cls(i, f'task {i}', TaskStatus.READY, now, [], [], [], now)),
+    'TaskNote': (TaskNote, lambda cls, i: cls(i, f'note {i}', [], now)),
+    'AttachmentReference': (AttachmentReference, lambda cls, i: cls(i, f'file{i}.pdf', 'application/pdf', now)),
+    'Field': (Field, lambda cls, i: cls(f'field{i}', 'Label', 'text', 'value'))
+}
+
+
+def measure(fn, count, repeat):
+    best_s = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed_s = time.perf_counter() - start
+        best_s = elapsed_s if best_s is None else min(best_s, elapsed_s)
+
+    # Allocations are measured in a separate run, as tracing slows allocation-heavy code considerably. The result is
+    # kept alive so that what remains allocated is what it holds.
+    tracemalloc.start()
+    try:
+        result = fn()
+        current, peak = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'count': count,
+        'best_s': best_s,
+        'us_per_item': best_s / count * 1e6 if best_s else None,
+        'bytes_per_item': current / count
+    }
+
+
+# Objects
+def run_objects(count, repeat):
+    results = {}
+    for name, (cls, factory) in object_factories.items():
+        for variant, variant_cls in (('slots', cls), ('dict', unslotted(cls))):
+            results[f'objects/{name}/{variant}'] = measure(lambda: [factory(variant_cls, i) for i in range(count)],
+                    count, repeat)
+    return results
+
+
+# Row Mapping
+reference_sql = '''
+SELECT
+    TASK_ID
+    , TASK_NM
+    , STATUS_ID
+    , DUE_TS
+    , MOD_TS
+  FROM TASK
+  ORDER BY TASK_ID
+  LIMIT ?
+'''
+
+def map_keyed(db_fname, count):
+    connection = get_connection(db_fname)
+    connection.row_factory = sqlite3.Row
+    try:
+        c = connection.execute(reference_sql, (count,))
+        return [TaskReference(r['TASK_ID'], r['TASK_NM'], TaskStatus(r['STATUS_ID']), from_epoch(r['DUE_TS']),
+                from_epoch(r['MOD_TS'])) for r in c]
+    finally:
+        connection.close()
+
+def map_positional(db_fname, count):
+    connection = get_connection(db_fname)
+    try:
+        c = connection.execute(reference_sql, (count,))
+        return [TaskReference(task_id, name, statuses_by_id[status_id], from_epoch(due_ts), from_epoch(mod_ts))
+                for task_id, name, status_id, due_ts, mod_ts in c]
+    finally:
+        connection.close()
+
+
+def run_rows(db_fname, count, repeat):
+    task_service = TaskService(db_fname)
+    ids = [r.task_id for r in task_service.list_tasks(limit=count)]
+
+    return {
+        'rows/references/keyed': measure(lambda: map_keyed(db_fname, count), count, repeat),
+        'rows/references/positional': measure(lambda: map_positional(db_fname, count), count, repeat),
+        'service/list_tasks': measure(lambda: task_service.list_tasks(limit=count), count, repeat),
+        'service/get_tasks': measure(lambda: task_service.get_tasks(ids), len(ids), repeat)
+    }
+
+
+def seed(db_fname, task_count, seed):
+    connection = get_connection(db_fname)
+    try:
+        Generator(connection, random.Random(seed), parse_weights('READY=4,PENDING=2,IN_PROGRESS=2,COMPLETE=10,CANCELED=1'),
+                200, 1.0, Distribution('poisson:2'), Distribution('poisson:1.5'), Distribution('poisson:0.3'),
+                Distribution('const:64'), 64, 0.3, 60, 120, 730, 10000).run(task_count, progress=lambda message: None)
+    finally:
+        connection.close()
+
+
+def print_report(results, baseline=None):
+    header = f'{"benchmark":40} {"count":>8} {"µs/item":>9} {"bytes/item":>11}'
+    if baseline:
+        header += f' {"Δ µs":>8}'
+    print(header)
+
+    for key, r in results.items():
+        line = f'{key:40} {r["count"]:8} {r["us_per_item"]:9.3f} {r["bytes_per_item"]:11.1f}'
+        b = baseline.get(key) if baseline else None
+        if b and b['us_per_item']:
+            line += f' {(r["us_per_item"] / b["us_per_item"] - 1) * 100:+7.1f}%'
+        print(line)
+
+
+def main(argv=None):
+    arg_parser = ArgumentParser(description='Microbenchmarks for domain object construction and result mapping.')
+    arg_parser.add_argument('--objects', type=int, default=100000, help='Instances built per object benchmark.')
+    arg_parser.add_argument('--tasks', type=int, default=20000, help='Tasks in the generated database.')
+    arg_parser.add_argument('--rows', type=int, default=10000, help='Rows mapped per row/service benchmark.')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='Timed runs per benchmark; the best is reported.')
+    arg_parser.add_argument('--seed', type=int, default=1838)
+    arg_parser.add_argument('--output', default=None, help='File to save JSON results to.')
+    arg_parser.add_argument('--compare', default=None, help='JSON results of a previous run to compare against.')
+    args = arg_parser.parse_args(argv)
+
+    results = run_objects(args.objects, args.repeat)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_fname = os.path.join(tmp_dir, 'domain_objects.sqlite')
+        seed(db_fname, args.tasks, args.seed)
+        results.update(run_rows(db_fname, min(args.rows, args.tasks), args.repeat))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'timestamp': datetime.now().isoformat(),
+                'config': dict((k, v) for k, v in vars(args).items() if k not in ('output', 'compare')),
+                'results': results
+            }, f, indent=2)
+        print('Results saved to', args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+'''
+HTTP load test for the task webapp.
+
+Seeds a SQLite database, starts the server on a local port and drives a weighted mix of requests against it from a
+pool of client threads. Reports throughput and latency percentiles per operation, and saves results as JSON so runs
+can be compared across commits:
+
+    python -m benchmarks.http_load --tasks 2000 --duration 30 --output before.json
+    python -m benchmarks.http_load --tasks 2000 --duration 30 --output after.json --compare before.json
+'''
+
+# Imports
+# Standard
+import os
+import sys
+import json
+import time
+import random
+import socket
+import tempfile
+import subprocess
+import http.client
+
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from threading import Thread, Lock
+from urllib.parse import quote
+
+# User
+from taskwebapp.domain.task import Task, TaskStatus, TaskNote
+from taskwebapp.service.sqlite import TaskService, NoteService, AttachmentService
+
+
+# Definitions
+words = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet', 'kilo', 'lima',
+         'mike', 'november', 'oscar', 'papa', 'quebec', 'romeo', 'sierra', 'tango', 'uniform', 'victor', 'whiskey']
+
+default_mix = 'home=2,search=3,detail=4,tags=3,update=1'
+
+
+class SeedAttachment:
+    def __init__(self, filename, mime_type, value):
+        self.filename = filename
+        self.mime_type = mime_type
+        self.value = value
+
+
+class SeededTask:
+    def __init__(self, task):
+        self.task_id = task.task_id
+        self.name = task.name
+        self.tags = list(task.tags)
+        self.notes = [(n.note_id, n.text, [a.attachment_id for a in n.attachment_references]) for n in task.notes]
+
+
+def seed(db_fname, rnd, task_count, tag_count, notes_per_task, attachments_per_task, attachment_size):
+    '''
+    Creates tasks through the regular services, so the database is shaped exactly as it would be by the webapp.
+
+    returns list[SeededTask]
+    '''
+
+    task_service = TaskService(db_fname)
+    note_service = NoteService(db_fname)
+    attachment_service = AttachmentService(db_fname)
+
+    tags = [f'{rnd.choice(words)}-{i}' for i in range(tag_count)]
+    now = datetime.now()
+
+    fd, attachment_fname = tempfile.mkstemp()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(rnd.randbytes(attachment_size) if hasattr(rnd, 'randbytes') else os.urandom(attachment_size))
+
+    result = []
+    try:
+        for i in range(task_count):
+            attachments = attachment_service.create_attachments({
+                0: [SeedAttachment(f'file-{i}-{k}.bin', 'application/octet-stream', attachment_fname) for k in range(attachments_per_task)]
+            })
+
+            notes = {}
+            for k in range(notes_per_task):
+                notes[k] = TaskNote(None, ' '.join(rnd.choices(words, k=20)), attachments.get(0, []) if k == 0 else [])
+            note_service.create_notes(notes)
+
+            due_ts = now + timedelta(hours=rnd.randint(-24 * 14, 24 * 60)) if rnd.random() < 0.8 else None
+            task = Task(None, f'{rnd.choice(words)} {rnd.choice(words)} {i}', rnd.choice(list(TaskStatus)), due_ts,
+                        rnd.sample(tags, min(len(tags), rnd.randint(0, 4))), [], list(notes.values()))
+            task_service.create_task(task)
+            result.append(SeededTask(task))
+    finally:
+        os.unlink(attachment_fname)
+
+    return result
+
+
+
+# Server
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(db_fname, port, server_args, log=None):
+    process = subprocess.Popen([sys.executable, '-m', 'taskwebapp', '--port', str(port), '--sqlite-db', db_fname] + server_args,
+                               stdout=log or subprocess.DEVNULL, stderr=subprocess.STDOUT if log else subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f'Server exited with code {process.returncode}')
+            time.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError('Server did not start')
+
+
+
+# Client
+def multipart_body(fields):
+    boundary = f'----taskwebappbench{random.getrandbits(64):x}'
+    parts = []
+    for name, value in fields:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n')
+    parts.append(f'--{boundary}--\r\n')
+    return ''.join(parts).encode('utf-8'), f'multipart/form-data; boundary={boundary}'
+
+
+class Operations:
+    def __init__(self, tasks, rnd):
+        self.tasks = tasks
+        self.rnd = rnd
+
+    def home(self):
+        return 'GET', '/', None, None
+
+    def search(self):
+        rnd = self.rnd
+        task = rnd.choice(self.tasks)
+        if task.tags and rnd.random() < 0.5:
+            return 'GET', f'/tasks?tags={quote(rnd.choice(task.tags))}&status=READY&status=IN_PROGRESS', None, None
+        return 'GET', f'/tasks?name={quote(task.name.split(" ")[0])}&name_operator=STARTS_WITH', None, None
+
+    def detail(self):
+        return 'GET', f'/tasks/{self.rnd.choice(self.tasks).task_id}', None, None
+
+    def tags(self):
+        return 'GET', f'/tags?q={self.rnd.choice(words)[0:2]}', None, None
+
+    def update(self):
+        rnd = self.rnd
+        task = rnd.choice(self.tasks)
+        fields = [('name', task.name), ('status', rnd.choice(list(TaskStatus)).name), ('due', ''), ('due_time', '')]
+        fields.extend(('tags', t) for t in task.tags)
+        for note_id, text, attachment_ids in task.notes:
+            fields.append((f'note_{note_id}', text))
+            fields.extend((f'note_{note_id}_attachments', str(a)) for a in attachment_ids)
+        body, content_type = multipart_body(fields)
+        return 'POST', f'/tasks/{task.task_id}', body, content_type
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, op, latency_s, ok):
+        with self.lock:
+            if ok:
+                self.latencies.setdefault(op, []).append(latency_s)
+            else:
+                self.errors[op] = self.errors.get(op, 0) + 1
+
+
+def client(port, operations, mix, deadline, recorder):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    names, weights = zip(*mix)
+    rnd = operations.rnd
+
+    while time.monotonic() < deadline:
+        op = rnd.choices(names, weights)[0]
+        method, path, body, content_type = getattr(operations, op)()
+        headers = {'Content-Type': content_type} if content_type else {}
+
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body, headers)
+            resp = connection.getresponse()
+            resp.read()
+            ok = resp.status < 400
+        except (OSError, http.client.HTTPException):
+            ok = False
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        recorder.record(op, time.perf_counter() - start, ok)
+
+    connection.close()
+
+
+
+# Reporting
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarize(recorder, elapsed_s):
+    result = {}
+    total = 0
+    for op in sorted(set(recorder.latencies) | set(recorder.errors)):
+        values = sorted(recorder.latencies.get(op, []))
+        total += len(values)
+        result[op] = {
+            'requests': len(values),
+            'errors': recorder.errors.get(op, 0),
+            'throughput_rps': len(values) / elapsed_s,
+            'p50_ms': percentile(values, 50) * 1000 if values else None,
+            'p95_ms': percentile(values, 95) * 1000 if values else None,
+            'p99_ms': percentile(values, 99) * 1000 if values else None
+        }
+    result['total'] = {
+        'requests': total,
+        'errors': sum(recorder.errors.values()),
+        'throughput_rps': total / elapsed_s
+    }
+    return result
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_report(results, baseline=None):
+    print(f'{"operation":<10} {"requests":>9} {"errors":>7} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+    for op, r in results.items():
+        cells = [f'{op:<10}', f'{r["requests"]:>9}', f'{r["errors"]:>7}', f'{r["throughput_rps"]:>9.1f}']
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            cells.append(f'{r[key]:>9.2f}' if r.get(key) is not None else f'{"":>9}')
+        print(' '.join(cells))
+
+        if baseline and op in baseline:
+            b = baseline[op]
+            deltas = []
+            for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+                if r.get(key) and b.get(key):
+                    deltas.append(f'{key} {(r[key] - b[key]) / b[key] * 100:+.1f}%')
+            if deltas:
+                print(f'{"":<10} vs baseline: {", ".join(deltas)}')
+
+
+
+# Program
+def parse_mix(value):
+    result = []
+    for item in value.split(','):
+        name, weight = item.split('=')
+        if not hasattr(Operations, name):
+            raise ValueError(f'Unknown operation: {name}')
+        result.append((name, float(weight)))
+    return result
+
+def main(argv=None):
+    arg_parser = ArgumentParser(description='HTTP load test for the task webapp.')
+    arg_parser.add_argument('--tasks', type=int, default=500)
+    arg_parser.add_argument('--tags', type=int, default=50)
+    arg_parser.add_argument('--notes-per-task', type=int, default=3)
+    arg_parser.add_argument('--attachments-per-task', type=int, default=1)
+    arg_parser.add_argument('--attachment-size', type=int, default=16 * 1024)
+    arg_parser.add_argument('--mix', default=default_mix, help=f'Weighted operation mix (default: {default_mix}).')
+    arg_parser.add_argument('--concurrency', type=int, default=8)
+    arg_parser.add_argument('--duration', type=float, default=20.0, help='Seconds to drive load for.')
+    arg_parser.add_argument('--warmup', type=float, default=2.0, help='Seconds of unrecorded load before measuring.')
+    arg_parser.add_argument('--seed', type=int, default=1838)
+    arg_parser.add_argument('--db', default=None, help='Database file; seeded into a temporary file if not given.')
+    arg_parser.add_argument('--port', type=int, default=None)
+    arg_parser.add_argument('--server-log', default=None, help='File to write server output to.')
+    arg_parser.add_argument('--output', default=None, help='File to save JSON results to.')
+    arg_parser.add_argument('--compare', default=None, help='JSON results of a previous run to compare against.')
+    arg_parser.add_argument('server_args', nargs='*', help='Additional server arguments (after --).')
+    args = arg_parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    rnd = random.Random(args.seed)
+
+    temp_dir = None
+    db_fname = args.db
+    if not db_fname:
+        temp_dir = tempfile.TemporaryDirectory()
+        db_fname = os.path.join(temp_dir.name, 'bench.sqlite')
+
+    print(f'Seeding {args.tasks} tasks into {db_fname}...')
+    start = time.perf_counter()
+    tasks = seed(db_fname, rnd, args.tasks, args.tags, args.notes_per_task, args.attachments_per_task, args.attachment_size)
+    print(f'Seeded in {time.perf_counter() - start:.1f}s.')
+
+    port = args.port or free_port()
+    server_log = open(args.server_log, 'w') if args.server_log else None
+    process = start_server(db_fname, port, args.server_args, server_log)
+    try:
+        if args.warmup > 0:
+            run_load(port, tasks, mix, args.concurrency, args.warmup, args.seed + 1)
+
+        recorder, elapsed_s = run_load(port, tasks, mix, args.concurrency, args.duration, args.seed + 2)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        if server_log:
+            server_log.close()
+        if temp_dir:
+            temp_dir.cleanup()
+
+    results = summarize(recorder, elapsed_s)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'timestamp': datetime.now().isoformat(),
+                'config': dict((k, v) for k, v in vars(args).items() if k not in ('output', 'compare')),
+                'results': results
+            }, f, indent=2)
+        print('Results saved to', args.output)
+
+def run_load(port, tasks, mix, concurrency, duration_s, seed):
+    recorder = Recorder()
+    start = time.monotonic()
+    deadline = start + duration_s
+    threads = [Thread(target=client, args=(port, Operations(tasks, random.Random(seed + i)), mix, deadline, recorder))
+               for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return recorder, time.monotonic() - start
+
+
+if __name__ == '__main__':
+    main()
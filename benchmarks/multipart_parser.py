@@ -0,0 +1,402 @@
+'''
+Microbenchmarks for the multipart/form-data parser (taskwebapp.multipart).
+
+Generates request bodies of several shapes and measures throughput (MB/s) and peak allocations (via tracemalloc) of
+each stage in isolation: the byte stream, the multipart lexer, the full parser, and the parameterized header lexer and
+parser used for Content-Disposition/Content-Type values.
+
+Every generated case records the parts it encodes, so the corpus doubles as a correctness check for any replacement
+parser (see check_parser):
+
+    python -m benchmarks.multipart_parser --output before.json
+    python -m benchmarks.multipart_parser --output after.json --compare before.json
+    python -m benchmarks.multipart_parser --check-only
+'''
+
+# Imports
+# Standard
+import io
+import json
+import time
+import random
+import tracemalloc
+
+from argparse import ArgumentParser
+from datetime import datetime
+
+# User
+from taskwebapp.multipart import (MultipartStream, MultipartLexer, MultipartParser, TokenType, ParameterizedHeaderStream,
+        ParameterizedHeaderLexer, ParameterizedHeaderParser, HeaderTokenType)
+from benchmarks.http_load import git_revision
+
+
+# Definitions
+class Case:
+    '''
+    A generated multipart body, along with the (name, filename, value) triples of the parts it encodes and the raw
+    values of its parameterized headers.
+    '''
+
+    def __init__(self, name, boundary, body, expected, header_values):
+        self.name = name
+        self.boundary = boundary
+        self.body = body
+        self.expected = expected
+        self.header_values = header_values
+
+
+class BodyBuilder:
+    def __init__(self, boundary):
+        self.boundary = boundary
+        self.buf = bytearray()
+        self.expected = []
+        self.header_values = []
+
+    def add_field(self, name, value, filename=None, content_type=None, disposition=None):
+        if disposition is None:
+            disposition = f'form-data; name="{quote_param(name)}"'
+            if filename is not None:
+                disposition += f'; filename="{quote_param(filename)}"'
+        disposition = disposition.encode('utf-8')
+
+        self.buf += f'--{self.boundary}\r\n'.encode('ascii')
+        self.buf += b'Content-Disposition: ' + disposition + b'\r\n'
+        self.header_values.append(disposition)
+        if content_type:
+            content_type = content_type.encode('ascii')
+            self.buf += b'Content-Type: ' + content_type + b'\r\n'
+            self.header_values.append(content_type)
+        self.buf += b'\r\n' + value + b'\r\n'
+
+        self.expected.append((name, filename, value))
+
+    def finish(self, case_name, epilogue=b''):
+        self.buf += f'--{self.boundary}--\r\n'.encode('ascii') + epilogue
+        return Case(case_name, self.boundary, bytes(self.buf), self.expected, self.header_values)
+
+
+def quote_param(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+def random_boundary(rnd):
+    alphabet = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+    return '----WebKitFormBoundary' + ''.join(rnd.choice(alphabet) for i in range(16))
+
+def random_text(rnd, size):
+    words = ('task', 'note', 'due', 'review', 'deploy', 'fix', 'the', 'and', 'with', 'für', 'naïve', '日本')
+    text = []
+    length = 0
+    while length < size:
+        word = rnd.choice(words)
+        text.append(word)
+        length += len(word) + 1
+    return ' '.join(text).encode('utf-8')[:size].decode('utf-8', 'ignore').encode('utf-8')
+
+
+# Corpus
+def many_small_fields(rnd, scale):
+    builder = BodyBuilder(random_boundary(rnd))
+    for i in range(int(2000 * scale)):
+        builder.add_field(f'note_{i}', random_text(rnd, rnd.randint(0, 64)))
+    return builder.finish('many_small_fields')
+
+def few_huge_files(rnd, scale):
+    builder = BodyBuilder(random_boundary(rnd))
+    builder.add_field('name', b'Quarterly report')
+    for i in range(2):
+        value = rnd.randbytes(int(2 * 1024 * 1024 * scale))
+        builder.add_field(f'attachment_{i}', value, f'report-{i}.bin', 'application/octet-stream')
+    return builder.finish('few_huge_files')
+
+def boundary_like_payloads(rnd, scale):
+    '''
+    Payloads full of near-misses: the delimiter without its leading CRLF, truncated or altered by one byte, bare CR/LF
+    and dashes, and the delimiter prefix at the very end of a value.
+    '''
+
+    boundary = random_boundary(rnd)
+    delimiter = f'--{boundary}'.encode('ascii')
+    near_misses = [
+        delimiter,
+        b'\r' + delimiter,
+        b'\n' + delimiter,
+        b'\r\n' + delimiter[:-1],
+        b'\r\n' + delimiter[:-1] + bytes([delimiter[-1] ^ 1]),
+        b'\r\n--',
+        b'\r\n-',
+        b'\r\r\n\n--',
+        b'--' + delimiter + b'--',
+    ]
+
+    builder = BodyBuilder(boundary)
+    for i in range(int(200 * scale)):
+        chunks = []
+        for k in range(rnd.randint(1, 8)):
+            chunks.append(rnd.randbytes(rnd.randint(0, 32)))
+            chunks.append(rnd.choice(near_misses))
+        value = b''.join(chunks)
+        # Values must not contain the actual delimiter.
+        value = value.replace(b'\r\n' + delimiter, b'\r\n-' + delimiter[1:-1])
+        if i % 2:
+            builder.add_field(f'file_{i}', value, f'near-miss-{i}.bin', 'application/octet-stream')
+        else:
+            builder.add_field(f'field_{i}', value)
+
+    builder.add_field('trailing_prefix', b'value ending in\r\n' + delimiter[:-1])
+    return builder.finish('boundary_like_payloads')
+
+def header_variety(rnd, scale):
+    '''
+    Parameterized headers exercising quoted strings with escapes, comments, whitespace and non-ASCII filenames.
+    '''
+
+    builder = BodyBuilder(random_boundary(rnd))
+    for i in range(int(500 * scale)):
+        shape = i % 5
+        if shape == 0:
+            builder.add_field(f'tag_{i}', b'x', content_type='text/plain; charset=utf-8')
+        elif shape == 1:
+            builder.add_field(f'file_{i}', b'contents', f'quoted "name" \\ {i}.txt', 'text/plain')
+        elif shape == 2:
+            builder.add_field(f'file_{i}', b'contents', f'Übersicht-日本-{i}.txt', 'text/plain; charset="utf-8"')
+        elif shape == 3:
+            disposition = f'form-data (a comment) ;\tname="field_{i}" ; size={i}'
+            builder.add_field(f'field_{i}', b'y', disposition=disposition)
+        else:
+            builder.add_field(f'field_{i}', b'', content_type='application/x-www-form-urlencoded')
+    return builder.finish('header_variety')
+
+def binary_values(rnd, scale):
+    builder = BodyBuilder(random_boundary(rnd))
+    for i in range(int(100 * scale)):
+        builder.add_field(f'blob_{i}', bytes(range(256)) * rnd.randint(1, 32), f'blob-{i}.bin', 'application/octet-stream')
+    return builder.finish('binary_values', epilogue=b'epilogue bytes after the close delimiter\r\n')
+
+case_generators = (many_small_fields, few_huge_files, boundary_like_payloads, header_variety, binary_values)
+
+def corpus(seed=1838, scale=1.0):
+    '''
+    returns list[Case]
+    '''
+    rnd = random.Random(seed)
+    return [generator(rnd, scale) for generator in case_generators]
+
+
+# Stages
+def parse_multipart(body, boundary):
+    '''
+    Reference parse function: parses body with MultipartParser, returning [(name, filename, value)].
+    '''
+
+    stream = MultipartStream(io.BytesIO(body), len(body))
+    parser = MultipartParser(MultipartLexer(stream, boundary), 'utf-8')
+    try:
+        result = []
+        for part in parser.multipart():
+            value = part.value
+            if part.is_file:
+                with open(value, 'rb') as f:
+                    value = f.read()
+            result.append((part.name, part.filename, value))
+        return result
+    finally:
+        parser.dispose()
+
+def read_stream(case):
+    stream = MultipartStream(io.BytesIO(case.body), len(case.body))
+    next_cp = stream.next_cp
+    while next_cp() is not None:
+        pass
+
+def lex_multipart(case):
+    '''
+    Tokenizes the body, switching the lexer in and out of body mode the way the parser does (a header section ends
+    with an empty line, a body with a delimiter).
+    '''
+
+    lexer = MultipartLexer(MultipartStream(io.BytesIO(case.body), len(case.body)), case.boundary)
+    next_token = lexer.next_token
+    last_type = None
+    while True:
+        t = next_token()
+        if t.type in (TokenType.EOF, TokenType.END_OF_MESSAGE):
+            return
+        if t.type == TokenType.BOUNDARY:
+            lexer.body_end()
+            t = next_token()
+        elif t.type == TokenType.CRLF and last_type == TokenType.CRLF:
+            lexer.body_start()
+        last_type = t.type
+
+def parse_case(case):
+    return parse_multipart(case.body, case.boundary)
+
+def lex_headers(case):
+    for value in case.header_values:
+        lexer = ParameterizedHeaderLexer(ParameterizedHeaderStream(value), 'utf-8')
+        while lexer.next_token().type != HeaderTokenType.EOF:
+            pass
+
+def parse_headers(case):
+    for value in case.header_values:
+        ParameterizedHeaderParser(ParameterizedHeaderLexer(ParameterizedHeaderStream(value), 'utf-8')).media_type()
+
+def body_size(case):
+    return len(case.body)
+
+def header_size(case):
+    return sum(len(v) for v in case.header_values)
+
+stages = {
+    'stream': (read_stream, body_size),
+    'lexer': (lex_multipart, body_size),
+    'parser': (parse_case, body_size),
+    'header_lexer': (lex_headers, header_size),
+    'header_parser': (parse_headers, header_size),
+}
+
+
+# Correctness
+def check_parser(parse_fn=parse_multipart, cases=None):
+    '''
+    parse_fn (callable): Function (body, boundary) returning [(name, filename, value)]
+    cases (list[Case]): Cases to check; defaults to the standard corpus
+
+    Runs parse_fn over the corpus. returns list[str]: Descriptions of mismatches (empty if all cases pass).
+    '''
+
+    failures = []
+    for case in cases if cases is not None else corpus():
+        try:
+            actual = parse_fn(case.body, case.boundary)
+        except Exception as e:
+            failures.append(f'{case.name}: raised {e!r}')
+            continue
+
+        if len(actual) != len(case.expected):
+            failures.append(f'{case.name}: expected {len(case.expected)} parts, got {len(actual)}')
+            continue
+
+        for i, (expected, part) in enumerate(zip(case.expected, actual)):
+            if tuple(part) != expected:
+                failures.append(f'{case.name}: part {i} ({expected[0]}) differs')
+    return failures
+
+def check_read_sizes(read_sizes=(64, 127, 4096)):
+    '''
+    Runs the correctness check with small stream buffers, so lookahead and delimiters straddle buffer refills.
+    '''
+
+    failures = []
+    cases = corpus(scale=0.05)
+    default_read_size = MultipartStream.read_size
+    try:
+        for read_size in read_sizes:
+            MultipartStream.read_size = read_size
+            failures.extend(f'read_size={read_size}: {f}' for f in check_parser(cases=cases))
+    finally:
+        MultipartStream.read_size = default_read_size
+    return failures
+
+
+# Measurement
+def measure(fn, case, size, repeat):
+    best_s = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(case)
+        elapsed_s = time.perf_counter() - start
+        best_s = elapsed_s if best_s is None else min(best_s, elapsed_s)
+
+    # Allocations are measured in a separate run, as tracing slows allocation-heavy code considerably.
+    tracemalloc.start()
+    try:
+        fn(case)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'bytes': size,
+        'best_s': best_s,
+        'mb_per_s': size / best_s / 1e6 if best_s else None,
+        'peak_alloc_bytes': peak,
+    }
+
+def run(cases, stage_names, repeat):
+    results = {}
+    for case in cases:
+        for stage_name in stage_names:
+            fn, size_fn = stages[stage_name]
+            size = size_fn(case)
+            if not size:
+                continue
+            results[f'{case.name}/{stage_name}'] = measure(fn, case, size, repeat)
+    return results
+
+def print_report(results, baseline=None):
+    header = f'{"case/stage":40} {"MB":>8} {"MB/s":>9} {"peak KiB":>10}'
+    if baseline:
+        header += f' {"Δ MB/s":>9}'
+    print(header)
+
+    for key, r in results.items():
+        line = f'{key:40} {r["bytes"] / 1e6:8.2f} {r["mb_per_s"]:9.2f} {r["peak_alloc_bytes"] / 1024:10.1f}'
+        b = baseline.get(key) if baseline else None
+        if b and b['mb_per_s']:
+            line += f' {(r["mb_per_s"] / b["mb_per_s"] - 1) * 100:+8.1f}%'
+        print(line)
+
+
+def main(argv=None):
+    arg_parser = ArgumentParser(description='Microbenchmarks for the multipart/form-data parser.')
+    arg_parser.add_argument('--scale', type=float, default=1.0, help='Multiplier for generated body sizes.')
+    arg_parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage; the best is reported.')
+    arg_parser.add_argument('--stages', default=','.join(stages), help='Comma-separated stages to run.')
+    arg_parser.add_argument('--cases', default=None, help='Comma-separated cases to run (default: all).')
+    arg_parser.add_argument('--seed', type=int, default=1838)
+    arg_parser.add_argument('--check-only', action='store_true', help='Only run the correctness checks.')
+    arg_parser.add_argument('--output', default=None, help='File to save JSON results to.')
+    arg_parser.add_argument('--compare', default=None, help='JSON results of a previous run to compare against.')
+    args = arg_parser.parse_args(argv)
+
+    stage_names = [s for s in args.stages.split(',') if s]
+    for stage_name in stage_names:
+        if stage_name not in stages:
+            arg_parser.error(f'Unknown stage: {stage_name}')
+
+    cases = corpus(args.seed, args.scale)
+    if args.cases:
+        case_names = args.cases.split(',')
+        cases = [c for c in cases if c.name in case_names]
+
+    failures = check_parser(cases=cases) + check_read_sizes()
+    for failure in failures:
+        print('FAILED', failure)
+    if not failures:
+        print(f'Correctness: {len(cases)} cases passed.')
+    if args.check_only:
+        return 1 if failures else 0
+
+    results = run(cases, stage_names, args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'timestamp': datetime.now().isoformat(),
+                'config': dict((k, v) for k, v in vars(args).items() if k not in ('output', 'compare')),
+                'results': results
+            }, f, indent=2)
+        print('Results saved to', args.output)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
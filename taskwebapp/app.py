@@ -0,0 +1,423 @@
+'''
+Application factory for the task webapp: create_arg_parser defines the command line, create_app builds the services,
+controllers, handlers and server for parsed arguments, and App.serve runs it. Only the standard library modules needed to
+parse arguments are imported up front; everything else is imported by create_app, so e.g. --help returns immediately.
+'''
+
+# Imports
+# Standard
+import os.path
+import re
+import time
+
+from argparse import ArgumentParser, BooleanOptionalAction
+
+
+
+
+# Definitions
+def jinja_finalize(expr):
+    return expr if expr is not None else ''
+
+def jinja_seq(val):
+    return isinstance(val, list) or isinstance(val, set) or isinstance(val, tuple)
+
+
+# Config
+base_package_name = 'taskwebapp'
+static_content_patterns = {
+    'content': [
+        re.compile('.+')
+    ],
+    'node_modules': [
+        re.compile('@mschlege1838/autocomplete-input/include/.+')
+    ]
+}
+
+
+
+class StartupTimer:
+    '''
+    Records the duration of successive startup phases, each ending where mark is called.
+    '''
+    
+    def __init__(self, start=None):
+        self.start = self.last = start if start is not None else time.perf_counter()
+        self.phases = []
+    
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+    
+    def report(self):
+        phases = ', '.join(f'{name} {elapsed_s * 1000:.1f}' for name, elapsed_s in self.phases)
+        return f'Started in {(self.last - self.start) * 1000:.1f} ms ({phases})'
+
+
+
+def create_arg_parser():
+    arg_parser = ArgumentParser(description='A task management webapp.')
+    arg_parser.add_argument('--port', type=int, default=8092)
+    arg_parser.add_argument('--shutdown-timeout', type=float, default=5.0)
+    arg_parser.add_argument('--encoding', default='utf-8')
+    arg_parser.add_argument('--sqlite-db', default=os.path.join(os.path.expanduser('~'), '.taskwebapp.sqlite'))
+    arg_parser.add_argument('--preload', action='store_true', help='Compile templates, cache static content, import request parsing modules and open/warm database connections before listening.')
+    arg_parser.add_argument('--fragment-cache-budget', type=int, default=4 * 1024 * 1024, help='Maximum size (bytes) of cached template fragments; 0 disables.')
+    arg_parser.add_argument('--db-pool-size', type=int, default=8, help='Maximum number of idle database connections kept open.')
+    arg_parser.add_argument('--db-statement-cache', type=int, default=256, help='Compiled statements cached per pooled connection.')
+    arg_parser.add_argument('--task-cache-size', type=int, default=256, help='Maximum number of cached tasks; 0 disables.')
+    arg_parser.add_argument('--event-queue-size', type=int, default=64, help='Events queued per event stream client; clients falling further behind are told to reload.')
+    arg_parser.add_argument('--event-heartbeat', type=float, default=15.0, help='Seconds between keep-alive comments on idle event streams.')
+    arg_parser.add_argument('--job-workers', type=int, default=2, help='Background job threads (attachment processing); 0 processes attachments within the upload request.')
+    arg_parser.add_argument('--job-max-attempts', type=int, default=5, help='Attempts at a background job before it is given up on.')
+    arg_parser.add_argument('--preview-max-pixels', type=int, default=4000000, help='Largest image (width x height) previews are generated for.')
+    arg_parser.add_argument('--spool-dir', default=None, help='Directory uploads are written to until processed (default: the database file name + .spool).')
+    arg_parser.add_argument('--task-cache-ttl', type=float, default=300.0, help='Seconds a cached task remains valid.')
+    arg_parser.add_argument('--orphan-sweep-interval', type=float, default=3600.0, help='Seconds between sweeps for orphaned notes/attachments; 0 disables.')
+    arg_parser.add_argument('--optimize-interval', type=float, default=3600.0, help='Seconds between runs of PRAGMA optimize; 0 disables.')
+    arg_parser.add_argument('--analyze-interval', type=float, default=86400.0, help='Seconds between runs of ANALYZE; 0 disables.')
+    arg_parser.add_argument('--checkpoint-interval', type=float, default=300.0, help='Seconds between WAL checkpoints; 0 disables.')
+    arg_parser.add_argument('--vacuum-interval', type=float, default=3600.0, help='Seconds between incremental vacuums; 0 disables.')
+    arg_parser.add_argument('--vacuum-pages', type=int, default=1000, help='Maximum pages reclaimed per incremental vacuum.')
+    arg_parser.add_argument('--maintenance-budget', type=float, default=0.5, help='Maximum seconds a single maintenance run may take.')
+    arg_parser.add_argument('--maintenance-idle', type=float, default=2.0, help='Seconds without requests before idle-time maintenance runs.')
+    arg_parser.add_argument('--sql-trace', action=BooleanOptionalAction, default=True, help='Collect per-statement SQL statistics and log slow queries.')
+    arg_parser.add_argument('--sql-slow-threshold', type=float, default=0.1, help='Seconds after which a statement is written to the slow query log.')
+    arg_parser.add_argument('--sql-slow-log', default=None, help='Slow query log file (default: stdout).')
+    arg_parser.add_argument('--admin-token', default=None, help='Token (X-Admin-Token header) enabling /admin endpoints and per-request profiling (X-Profile header).')
+    arg_parser.add_argument('--profile-dir', default=None, help='Directory profiles are written to (default: taskwebapp-profiles in the temporary directory).')
+    arg_parser.add_argument('--profile-signal-duration', type=float, default=10.0, help='Seconds sampled when SIGUSR1 is received.')
+    arg_parser.add_argument('--enable-incremental-vacuum', action='store_true', help='Convert the database to auto_vacuum=INCREMENTAL (full VACUUM) before starting.')
+    return arg_parser
+
+
+
+class App:
+    '''
+    A configured, not yet listening, instance of the webapp; see create_app.
+    '''
+    
+    def __init__(self, args, jinja_env, static_handler, connection_pool, task_service, maintenance_service,
+            maintenance_scheduler, event_dispatcher, job_runner, request_handler_class):
+        self.args = args
+        self.jinja_env = jinja_env
+        self.static_handler = static_handler
+        self.connection_pool = connection_pool
+        self.task_service = task_service
+        self.maintenance_service = maintenance_service
+        self.maintenance_scheduler = maintenance_scheduler
+        self.event_dispatcher = event_dispatcher
+        self.job_runner = job_runner
+        self.request_handler_class = request_handler_class
+    
+    def preload(self):
+        '''
+        Does ahead of time what the first requests would otherwise do: compiles all templates, reads static content into
+        memory, imports the multipart parser, fills the connection pool and runs the dashboard queries once (compiling
+        their statements and reading the pages they touch into the page cache).
+        '''
+        
+        import taskwebapp.multipart
+        
+        jinja_env = self.jinja_env
+        for name in jinja_env.list_templates():
+            jinja_env.get_template(name)
+        
+        self.static_handler.preload()
+        
+        self.connection_pool.fill()
+        self.task_service.get_dashboard_data()
+    
+    def serve(self):
+        '''
+        Listens on the configured port until interrupted (Control-C), then shuts down.
+        '''
+        
+        from taskwebapp.util import DetachableHTTPServer, ServerThread
+        
+        args = self.args
+        
+        if args.enable_incremental_vacuum:
+            print('Converting database to incremental vacuum...')
+            self.maintenance_service.enable_incremental_vacuum()
+        
+        print('Starting server on', args.port)
+        print('Control-C to stop.')
+        
+        server = DetachableHTTPServer(('', args.port), self.request_handler_class)
+        t = ServerThread(server)
+        t.start()
+        self.event_dispatcher.start()
+        self.maintenance_scheduler.start()
+        if self.job_runner:
+            self.job_runner.start()
+        
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            print('Keyboard Interrupt: shutting down server.')
+            self.maintenance_scheduler.stop()
+            self.event_dispatcher.stop()
+            if self.job_runner:
+                self.job_runner.stop(args.shutdown_timeout)
+            server.shutdown()
+            t.join(timeout=args.shutdown_timeout)
+            if t.is_alive():
+                print('Server is not shut down after timeout period.')
+            else:
+                print('Server shut down.')
+            self.connection_pool.close()
+
+
+
+def create_app(args, timer=None):
+    '''
+    args (Namespace): Arguments parsed with the parser of create_arg_parser
+    timer (StartupTimer): Timer to record the phases of the setup in (optional)
+    
+    returns App: Application for the given arguments. The database schema is checked (and migrated if needed) once here;
+    connections opened afterwards skip the check.
+    '''
+    
+    # Imports; deferred to here so that merely importing this module (e.g. for --help) stays cheap.
+    import json
+    import signal
+    import importlib.util
+    
+    from pathlib import Path
+    
+    from jinja2 import Environment, PackageLoader, ChainableUndefined
+    
+    from taskwebapp.util import JinjaRenderer
+    from taskwebapp.cache import LRUCache, TaskCache, FragmentCacheExtension
+    from taskwebapp.maintenance import MaintenanceScheduler, ActivityMonitor
+    from taskwebapp.events import EventBus, EventStreamDispatcher
+    from taskwebapp.jobs import JobRunner
+    from taskwebapp.metrics import MetricsRegistry, RequestMetrics, StageTimedProxy, add_cache_collector, \
+            add_pool_collector, add_event_collector, add_job_collector
+    from taskwebapp.handlers import StaticResourceHandler, HomePageHandler, EventsHandler, TaskHandler, TaskApiHandler, \
+            TagHandler, AttachmentHandler, MetricsHandler, AdminHandler, ProfileHandler
+    from taskwebapp.preview import PreviewGenerator
+    from taskwebapp.profiling import SamplingProfiler
+    from taskwebapp.service.sqlite import TaskService, TagService, AttachmentService, NoteService, MaintenanceService, \
+            JobService, ConnectionPool, migrate, store_attachment_job, generate_previews_job
+    from taskwebapp.service.tracing import SqlTracer, set_tracer, add_sql_collector
+    from taskwebapp.controller.task import TaskController
+    from taskwebapp.controller.api import TaskApiController
+    
+    timer = timer or StartupTimer()
+    timer.mark('imports')
+    
+    encoding = args.encoding
+    db_fname = args.sqlite_db
+    
+    # Jinja
+    jinja_env = Environment(loader=PackageLoader(base_package_name, encoding=encoding), finalize=jinja_finalize, undefined=ChainableUndefined, extensions=[FragmentCacheExtension])
+    if args.fragment_cache_budget > 0:
+        jinja_env.fragment_cache = LRUCache(max_cost=args.fragment_cache_budget)
+    jinja_env.filters['sn'] = jinja_finalize
+    jinja_env.filters['json'] = json.dumps
+    jinja_env.tests['seq'] = jinja_seq
+    preview_generator = PreviewGenerator(max_pixels=args.preview_max_pixels)
+    jinja_env.tests['previewable'] = preview_generator.supports
+    renderer = JinjaRenderer(jinja_env, encoding)
+    
+    # Resolve static content directories.
+    base_dir = Path(importlib.util.find_spec(base_package_name).submodule_search_locations[0])
+    static_content_dirs = dict((base_dir.joinpath(d), ps) for d, ps in static_content_patterns.items())
+    
+    
+    # Metrics
+    metrics_registry = MetricsRegistry()
+    request_metrics = RequestMetrics(metrics_registry)
+    
+    if args.sql_trace:
+        sql_tracer = SqlTracer(args.sql_slow_threshold, args.sql_slow_log)
+        set_tracer(sql_tracer)
+        add_sql_collector(metrics_registry, sql_tracer)
+    timer.mark('setup')
+    
+    
+    # Database
+    migrate(db_fname)
+    timer.mark('database')
+    
+    
+    # Services
+    task_cache = TaskCache(args.task_cache_size, args.task_cache_ttl) if args.task_cache_size > 0 else None
+    connection_pool = ConnectionPool(db_fname, args.db_pool_size, args.db_statement_cache)
+    event_bus = EventBus(args.event_queue_size)
+    event_dispatcher = EventStreamDispatcher(event_bus, args.event_heartbeat)
+    task_service = StageTimedProxy(TaskService(db_fname, task_cache, connection_pool, event_bus), 'service')
+    note_service = StageTimedProxy(NoteService(db_fname, task_cache, connection_pool, event_bus), 'service')
+    if args.job_workers > 0:
+        job_service = JobService(db_fname, connection_pool, args.job_max_attempts)
+        job_runner = JobRunner(job_service, args.job_workers)
+        upload_dir = args.spool_dir or db_fname + '.spool'
+        attachment_service_impl = AttachmentService(db_fname, connection_pool, task_cache, job_runner, upload_dir,
+                preview_generator)
+        job_runner.add_handler(store_attachment_job, attachment_service_impl.process_upload)
+        job_runner.add_handler(generate_previews_job, attachment_service_impl.process_previews)
+    else:
+        job_service = job_runner = upload_dir = None
+        attachment_service_impl = AttachmentService(db_fname, connection_pool, task_cache,
+                preview_generator=preview_generator)
+    attachment_service = StageTimedProxy(attachment_service_impl, 'service')
+    tag_service = StageTimedProxy(TagService(db_fname, connection_pool), 'service')
+    maintenance_service = MaintenanceService(db_fname)
+    
+    caches = {}
+    if jinja_env.fragment_cache is not None:
+        caches['fragment'] = jinja_env.fragment_cache
+    if task_cache is not None:
+        caches['task'] = task_cache
+    add_cache_collector(metrics_registry, caches)
+    add_pool_collector(metrics_registry, connection_pool)
+    add_event_collector(metrics_registry, event_bus, event_dispatcher)
+    if job_runner:
+        add_job_collector(metrics_registry, job_service, job_runner)
+    
+    
+    # Maintenance
+    activity_monitor = ActivityMonitor()
+    maintenance_scheduler = MaintenanceScheduler(activity_monitor, args.maintenance_idle)
+    maintenance_budget_s = args.maintenance_budget
+    if args.orphan_sweep_interval > 0:
+        maintenance_scheduler.add_job('Orphan Sweep', lambda: maintenance_service.sweep_orphans(maintenance_budget_s), args.orphan_sweep_interval, idle_only=True)
+    if args.checkpoint_interval > 0:
+        maintenance_scheduler.add_job('WAL Checkpoint', lambda: maintenance_service.checkpoint(maintenance_budget_s), args.checkpoint_interval)
+    if args.optimize_interval > 0:
+        maintenance_scheduler.add_job('Optimize', lambda: maintenance_service.optimize(maintenance_budget_s), args.optimize_interval, idle_only=True)
+    if args.analyze_interval > 0:
+        maintenance_scheduler.add_job('Analyze', lambda: maintenance_service.analyze(maintenance_budget_s), args.analyze_interval, idle_only=True)
+    if args.vacuum_interval > 0:
+        maintenance_scheduler.add_job('Incremental Vacuum', lambda: maintenance_service.incremental_vacuum(args.vacuum_pages, maintenance_budget_s), args.vacuum_interval, idle_only=True)
+    
+    
+    # Controllers
+    task_controller = TaskController(task_service, note_service, attachment_service)
+    task_api_controller = TaskApiController(task_service)
+    
+    
+    # Handlers
+    static_handler = StaticResourceHandler(encoding, static_content_dirs)
+    handlers = [
+        (re.compile('^/$'), HomePageHandler(task_service))
+        , (re.compile('/content/(.+)'), static_handler)
+        , (re.compile('^/events$'), EventsHandler(event_dispatcher))
+        , (re.compile('^/api/tasks(/?.*)$'), TaskApiHandler(task_api_controller))
+        , (re.compile('/tasks(/?.*)'), TaskHandler(task_controller))
+        , (re.compile('/tags(/?.*)'), TagHandler(tag_service))
+        , (re.compile('/attachments(/?.*)'), AttachmentHandler(attachment_service))
+        , (re.compile('^/metrics$'), MetricsHandler(metrics_registry))
+    ]
+    
+    # Profiling
+    profile_dir = args.profile_dir
+    if not profile_dir:
+        import tempfile
+        profile_dir = os.path.join(tempfile.gettempdir(), 'taskwebapp-profiles')
+    profiler = SamplingProfiler(profile_dir)
+    if args.admin_token:
+        handlers.append((re.compile('^/admin/profile$'), AdminHandler(ProfileHandler(profiler), args.admin_token)))
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.profile_async(args.profile_signal_duration))
+    
+    request_handler_class = create_request_handler_class(handlers, renderer, encoding, request_metrics,
+            activity_monitor, profiler, args.admin_token, upload_dir)
+    timer.mark('services')
+    
+    return App(args, jinja_env, static_handler, connection_pool, task_service, maintenance_service,
+            maintenance_scheduler, event_dispatcher, job_runner, request_handler_class)
+
+
+def create_request_handler_class(handlers, renderer, encoding, request_metrics, activity_monitor, profiler, admin_token,
+        upload_dir=None):
+    '''
+    upload_dir (str): Directory uploaded files are written to (default: the system's temporary directory)
+    
+    returns type: BaseHTTPRequestHandler subclass dispatching requests to the given (pattern, handler) pairs
+    '''
+    
+    import traceback
+    
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import urlparse
+    
+    from taskwebapp.util import RequestContext
+    from taskwebapp.metrics import MeteredWriter
+    from taskwebapp.requestutils import RequestProcessor
+    from taskwebapp.handlers import is_admin_request
+    
+    class RequestHandler(BaseHTTPRequestHandler):
+        
+        protocol_version = 'HTTP/1.1'
+        # Headers and body are written separately; with Nagle's algorithm the body waits on the client's delayed ACK.
+        disable_nagle_algorithm = True
+        
+        def setup(self):
+            super().setup()
+            self.wfile = MeteredWriter(self.wfile)
+        
+        def send_response(self, code, message=None):
+            self.status = code
+            super().send_response(code, message)
+        
+        def _handle(self, target_name):
+            timer = request_metrics.begin()
+            self.status = None
+            self.route = 'unmatched'
+            try:
+                self._dispatch(target_name)
+            finally:
+                request_metrics.end(timer, self.route, self.command, self.status, int(self.headers.get('Content-Length') or 0))
+        
+        def _dispatch(self, target_name):
+            path = urlparse(self.path).path
+            
+            for expr, handler in handlers:
+                match = expr.match(path)
+                if match:
+                    break
+            else:
+                self.send_error(404)
+                return
+            
+            self.route = type(handler).__name__
+            
+            if not hasattr(handler, target_name):
+                self.send_error(405)
+                return
+            
+            
+            attributes = {}
+            
+            with activity_monitor, RequestProcessor(self, upload_dir) as p:
+                try:
+                    context = RequestContext(self, p.parameters, p.parts, match, renderer, encoding, attributes)
+                    if self.headers.get('X-Profile') and is_admin_request(self, admin_token):
+                        profiler.profile_call(self.route, getattr(handler, target_name), context)
+                    else:
+                        getattr(handler, target_name)(context)
+                except:
+                    traceback.print_exc()
+                    print()
+                    if self.status is None:
+                        self.send_error(500)
+                    else:
+                        # Response already (partially) written, e.g. a failed chunked stream; abort the connection.
+                        self.close_connection = True
+        
+        
+        def do_GET(self):
+            self._handle('do_get')
+        
+        def do_POST(self):
+            self._handle('do_post')
+        
+        def do_PATCH(self):
+            self._handle('do_patch')
+    
+    return RequestHandler
@@ -0,0 +1,188 @@
+# Imports
+# Standard
+import copy
+import sys
+import time
+
+from collections import OrderedDict
+from threading import Lock
+
+# Third Party
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+
+# Definitions
+class LRUCache:
+    '''
+    Thread-safe least-recently-used cache. Entries are evicted oldest-first whenever the cache holds more
+    than max_entries entries or the total cost of all entries exceeds max_cost (either limit can be None).
+    Entry cost is computed with the given cost function (sys.getsizeof by default). If ttl (seconds) is given,
+    entries older than ttl are treated as misses, as are entries rejected by the validate function passed to get
+    (removed and counted as stale).
+    '''
+
+    def __init__(self, max_entries=None, max_cost=None, ttl=None, cost=sys.getsizeof):
+        self.max_entries = max_entries
+        self.max_cost = max_cost
+        self.ttl = ttl
+        self.cost = cost
+
+        self.entries = OrderedDict()
+        self.total_cost = 0
+        self.lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def get(self, key, default=None, validate=None):
+        '''
+        validate (callable): Called (under the cache's lock) with the cached value; returns whether it is still valid
+        '''
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, cost, expires = entry
+            if expires is not None and expires < time.monotonic():
+                self.__remove(key)
+                self.misses += 1
+                return default
+
+            if validate is not None and not validate(value):
+                self.__remove(key)
+                self.misses += 1
+                self.stale += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        cost = self.cost(value) if self.max_cost is not None else 0
+        if self.max_cost is not None and cost > self.max_cost:
+            return value
+
+        ttl = self.ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+
+        with self.lock:
+            entries = self.entries
+            if key in entries:
+                self.__remove(key)
+
+            entries[key] = (value, cost, expires)
+            self.total_cost += cost
+
+            max_entries = self.max_entries
+            max_cost = self.max_cost
+            while (max_entries is not None and len(entries) > max_entries) or (max_cost is not None and self.total_cost > max_cost):
+                self.__remove(next(iter(entries)))
+                self.evictions += 1
+
+        return value
+
+    def invalidate(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.__remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_cost = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'cost': self.total_cost,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'stale': self.stale
+            }
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __remove(self, key):
+        value, cost, expires = self.entries.pop(key)
+        self.total_cost -= cost
+
+
+
+class FragmentCacheExtension(Extension):
+    '''
+    Adds a {% cache key[, key...] %}...{% endcache %} tag. Rendered output of the enclosed block is stored in
+    the environment's fragment_cache (an LRUCache), keyed by the template name, the tag's line number and the
+    given key expressions. Key expressions must therefore capture everything the block depends on (e.g. an ID
+    and a modification timestamp). If fragment_cache is None, blocks are always rendered.
+    '''
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+        environment.filters['cache_key'] = cache_key
+
+    def parse(self, parser):
+        token = next(parser.stream)
+
+        key = [nodes.Const(parser.name), nodes.Const(token.lineno)]
+        key.append(parser.parse_expression())
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache_support', [nodes.Tuple(key, 'load')]), [], [], body).set_lineno(token.lineno)
+
+    def _cache_support(self, key, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+
+        result = cache.get(key)
+        if result is None:
+            result = cache.put(key, caller())
+        return result
+
+
+def cache_key(seq, *attributes):
+    '''
+    Jinja filter; reduces a sequence of objects to a hashable tuple of the given attributes of each object,
+    for use as a fragment cache key.
+    '''
+    return tuple(tuple(getattr(o, a) for a in attributes) for o in seq)
+
+
+
+class TaskCache:
+    '''
+    Read-through cache of fully populated Task objects, keyed by task ID. Entries are only valid for the
+    modification timestamp they were loaded with; callers pass the current timestamp on lookup. Tasks are copied
+    on the way in and out, so callers may freely modify what they receive.
+    '''
+
+    def __init__(self, max_entries, ttl=None):
+        self.cache = LRUCache(max_entries=max_entries, ttl=ttl)
+
+    def get(self, task_id, mod_ts):
+        task = self.cache.get(task_id, validate=lambda task: task.mod_ts == mod_ts)
+        return copy.deepcopy(task) if task is not None else None
+
+    def put(self, task):
+        self.cache.put(task.task_id, copy.deepcopy(task))
+
+    def invalidate(self, task_id):
+        self.cache.invalidate(task_id)
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,123 @@
+
+
+function DashboardUpdater(root, url) {
+    'use strict';
+    
+    this.root = root;
+    this.url = url || '/events';
+    this.source = null;
+}
+
+DashboardUpdater.MAX_ROWS = 20;
+
+DashboardUpdater.prototype.init = function () {
+    'use strict';
+    
+    if (!window.EventSource) {
+        return;
+    }
+    
+    const source = this.source = new EventSource(this.url);
+    source.addEventListener('task', this, false);
+    source.addEventListener('reload', this, false);
+};
+
+DashboardUpdater.prototype.handleEvent = function (event) {
+    'use strict';
+    
+    switch (event.type) {
+        case 'task':
+            this.update(JSON.parse(event.data));
+            break;
+        case 'reload':
+            this.reload();
+            break;
+    }
+};
+
+DashboardUpdater.prototype.reload = function () {
+    'use strict';
+    
+    this.source.close();
+    window.location.reload();
+};
+
+DashboardUpdater.prototype.update = function (task) {
+    'use strict';
+    
+    const existing = this.root.querySelector('tr[data-task-id="' + task.task_id + '"]');
+    const section = task.category ? this.root.querySelector('section[data-category="' + task.category + '"]') : null;
+    
+    if (task.category && !section) {
+        // Category not rendered (e.g. no late tasks when the page was loaded).
+        this.reload();
+        return;
+    }
+    
+    // Moved rather than replaced in place, as the change may affect the task's position.
+    if (existing) {
+        existing.parentNode.removeChild(existing);
+    }
+    if (section) {
+        DashboardUpdater.insertRow(section, task);
+    }
+};
+
+DashboardUpdater.insertRow = function (section, task) {
+    'use strict';
+    
+    const tbody = section.querySelector('tbody');
+    const rows = tbody.rows;
+    
+    // Sections are ordered by due timestamp (undue first), the backlog by last action (latest first).
+    let before = null;
+    if (section.getAttribute('data-category') === 'backlog') {
+        before = rows.length ? rows[0] : null;
+    } else {
+        const due = DashboardUpdater.formatTimestamp(task.due_ts);
+        for (const row of rows) {
+            if (row.cells[2].textContent > due) {
+                before = row;
+                break;
+            }
+        }
+        if (!before && rows.length >= DashboardUpdater.MAX_ROWS) {
+            // Past the last task shown.
+            return;
+        }
+    }
+    
+    tbody.insertBefore(DashboardUpdater.createRow(task), before);
+    while (rows.length > DashboardUpdater.MAX_ROWS) {
+        tbody.removeChild(rows[rows.length - 1]);
+    }
+};
+
+DashboardUpdater.createRow = function (task) {
+    'use strict';
+    
+    const row = document.createElement('tr');
+    row.setAttribute('data-task-id', task.task_id);
+    
+    const link = document.createElement('a');
+    link.href = '/tasks/' + task.task_id;
+    link.textContent = task.name;
+    row.insertCell().appendChild(link);
+    
+    row.insertCell().textContent = task.status;
+    
+    for (const ts of [task.due_ts, task.mod_ts]) {
+        const cell = row.insertCell();
+        cell.setAttribute('data-type', 'timestamp');
+        cell.textContent = DashboardUpdater.formatTimestamp(ts);
+    }
+    
+    return row;
+};
+
+DashboardUpdater.formatTimestamp = function (value) {
+    'use strict';
+    
+    // Values are ISO formatted (YYYY-MM-DD HH:MM:SS...); shown to the minute, as rendered by the server.
+    return value ? value.substring(0, 16) : '';
+};
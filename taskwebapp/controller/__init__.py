@@ -27,6 +27,8 @@ class ValidationException(Exception):
 
 
 class Field:
+    __slots__ = ('name', 'label', 'type', 'value', 'options', 'error', 'multiple', 'readonly')
+    
     def __init__(self, name, label=None, type=None, value=None, options=None, error=None, multiple=False, readonly=False):
         self.name = name
         self.label = label
@@ -73,6 +75,8 @@ class DateTimeField:
         return DateTimeField(timestamp.strftime('%Y-%m-%d'), timestamp.strftime('%H:%M'), timestamp) if timestamp else None
     
     
+    __slots__ = ('date_val', 'time_val', 'timestamp')
+    
     def __init__(self, date_val, time_val, timestamp=None):
         self.date_val = date_val
         self.time_val = time_val
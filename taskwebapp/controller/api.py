@@ -0,0 +1,249 @@
+# Imports
+
+# Standard
+import json
+
+from datetime import datetime
+from urllib.parse import urlencode
+
+# User
+import taskwebapp.domain.task.codec as codec
+
+from taskwebapp.controller.task import TaskSearchCriteria
+from taskwebapp.domain.task import TaskStatus, TaskChangeSet, TaskModifiedException
+from taskwebapp.domain.task.search import TaskSearchStrOp, TaskSearchNumOp, TaskSearchSimpleExpr, TaskSearchIsAnyExpr, \
+        TaskSearchField
+
+
+
+
+# Definitions
+class ApiException(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+task_fields = ('task_id', 'name', 'status', 'due_ts', 'mod_ts', 'tags', 'notes')
+reference_fields = frozenset(('task_id', 'name', 'status', 'due_ts', 'mod_ts'))
+patch_fields = frozenset(('name', 'status', 'due_ts', 'tags', 'add_tags', 'remove_tags'))
+
+
+# Controller
+class TaskApiController:
+    '''
+    JSON interface to tasks:
+        
+        GET /api/tasks              Lists tasks in ID order. Filters (combined with AND): name (with name_op: STARTS_WITH,
+                                    CONTAINS or EQUALS), due (ISO format, with due_op: EQ, NE, LT, LTE, GT or GTE),
+                                    status and tag (repeatable or comma-separated; any of). Paged with limit and after
+                                    (the last task ID of the previous page, given as next_after in the response).
+        GET /api/tasks/<id>         Single task; honors If-None-Match.
+        PATCH /api/tasks/<id>       Changes only the fields given in a JSON object: name, status, due_ts (null clears),
+                                    tags (replaces all), add_tags, remove_tags. Honors If-Match.
+    
+    Both GET forms accept fields, a comma-separated subset of the task fields to include. Single task responses carry
+    an ETag derived from the task's modification timestamp.
+    '''
+    
+    default_limit = 50
+    max_limit = 500
+    
+    def __init__(self, task_service):
+        self.task_service = task_service
+    
+    def do_list(self, context):
+        fields = self.__get_fields(context)
+        criteria = self.__get_criteria(context)
+        
+        try:
+            limit = min(int(context.get_parameter('limit') or TaskApiController.default_limit), TaskApiController.max_limit)
+            after_id = int(context.get_parameter('after')) if context.get_parameter('after') else None
+        except ValueError:
+            raise ApiException(400, 'limit and after must be integers.')
+        if limit < 1:
+            raise ApiException(400, 'limit must be positive.')
+        
+        references = self.task_service.list_tasks(criteria.expr, after_id, limit)
+        
+        if fields <= reference_fields:
+            values = [codec.reference_to_dict(r) for r in references]
+        else:
+            tasks = self.task_service.get_tasks([r.task_id for r in references])
+            values = [codec.task_to_dict(tasks[r.task_id]) for r in references if r.task_id in tasks]
+        
+        next_after = references[-1].task_id if len(references) == limit else None
+        if next_after is not None:
+            query = [(name, value) for name, values in context.parameters for value in values if name != 'after']
+            next_url = f'/api/tasks?{urlencode(query + [("after", next_after)])}'
+        else:
+            next_url = None
+        
+        context.write_json({
+            'tasks': [select_fields(v, fields) for v in values],
+            'next_after': next_after,
+            'next': next_url
+        })
+    
+    def do_get(self, context, task_id):
+        fields = self.__get_fields(context)
+        
+        task = self.task_service.get_task(task_id)
+        if not task:
+            raise ApiException(404, f'Task not found: {task_id}')
+        
+        etag = codec.task_etag(task.task_id, task.mod_ts)
+        if none_match(context.handler.headers.get('If-None-Match'), etag):
+            handler = context.handler
+            handler.send_response(304)
+            handler.send_header('ETag', etag)
+            handler.send_header('Content-Length', 0)
+            handler.end_headers()
+            return
+        
+        context.write_json(select_fields(codec.task_to_dict(task), fields), headers={'ETag': etag})
+    
+    def do_patch(self, context, task_id):
+        handler = context.handler
+        
+        if handler.headers.get_content_type() not in ('application/json', 'application/merge-patch+json'):
+            # The body is left unread (form bodies have already been consumed), so the connection cannot be reused.
+            handler.close_connection = True
+            raise ApiException(415, 'Expected application/json.')
+        body = handler.rfile.read(int(handler.headers.get('Content-Length') or 0))
+        try:
+            value = json.loads(body.decode(handler.headers.get_content_charset() or context.encoding))
+        except (UnicodeError, LookupError, ValueError):
+            raise ApiException(400, 'Malformed JSON.')
+        
+        # Preconditions; only a single entity tag (or *) is meaningful for a single task.
+        if_match = handler.headers.get('If-Match')
+        expected_mod_ts = None
+        if if_match and if_match.strip() != '*':
+            expected_mod_ts = codec.parse_etag(task_id, if_match.split(',')[0])
+            if expected_mod_ts is None:
+                raise ApiException(412, 'Precondition failed.')
+        
+        changes = self.__get_changes(value, task_id)
+        try:
+            mod_ts = self.task_service.patch_task(task_id, changes, expected_mod_ts)
+        except TaskModifiedException:
+            raise ApiException(412, 'Task has been modified.')
+        
+        if mod_ts is None:
+            raise ApiException(404, f'Task not found: {task_id}')
+        
+        task = self.task_service.get_task(task_id)
+        context.write_json(codec.task_to_dict(task), headers={'ETag': codec.task_etag(task.task_id, task.mod_ts)})
+    
+
+    def __get_fields(self, context):
+        fields = context.get_parameter('fields')
+        if not fields:
+            return frozenset(task_fields)
+        
+        fields = frozenset(f.strip() for f in fields.split(',') if f.strip())
+        unknown = fields.difference(task_fields)
+        if unknown:
+            raise ApiException(400, f'Unknown fields: {", ".join(sorted(unknown))}')
+        return fields
+    
+    def __get_criteria(self, context):
+        criteria = TaskSearchCriteria()
+        
+        try:
+            name = context.get_parameter('name')
+            if name:
+                op = TaskSearchStrOp[context.get_parameter('name_op') or 'CONTAINS']
+                criteria.i_and(TaskSearchSimpleExpr(TaskSearchField.NAME, op, name))
+            
+            due = context.get_parameter('due')
+            if due:
+                op = TaskSearchNumOp[context.get_parameter('due_op') or 'LTE']
+                criteria.i_and(TaskSearchSimpleExpr(TaskSearchField.DUE, op, datetime.fromisoformat(due)))
+            
+            statuses = split_values(context.get_parameter_values('status'))
+            if statuses:
+                criteria.i_and(TaskSearchIsAnyExpr(TaskSearchField.STATUS, [TaskStatus[s.upper()] for s in statuses]))
+        except (KeyError, ValueError) as e:
+            raise ApiException(400, f'Invalid filter: {e}')
+        
+        tags = split_values(context.get_parameter_values('tag'))
+        if tags:
+            criteria.i_and(TaskSearchIsAnyExpr(TaskSearchField.TAGS, tags))
+        
+        return criteria
+    
+    def __get_changes(self, value, task_id):
+        if not isinstance(value, dict):
+            raise ApiException(400, 'Expected an object.')
+        
+        unknown = set(value).difference(patch_fields)
+        if unknown:
+            raise ApiException(400, f'Unknown fields: {", ".join(sorted(unknown))}')
+        
+        changes = TaskChangeSet()
+        try:
+            if 'name' in value:
+                if not value['name'] or not isinstance(value['name'], str):
+                    raise ValueError('Task name is required.')
+                changes.name = value['name']
+            if 'status' in value:
+                # parse_status defaults a missing status (for imports); a patch must name one.
+                if not value['status']:
+                    raise ValueError('Task status is required.')
+                changes.status = codec.parse_status(value['status'])
+            if 'due_ts' in value:
+                changes.due_ts = codec.parse_ts(value['due_ts'])
+            
+            add_tags = get_tags(value, 'add_tags')
+            remove_tags = get_tags(value, 'remove_tags')
+        except ValueError as e:
+            raise ApiException(400, str(e))
+        
+        if 'tags' in value:
+            try:
+                tags = get_tags(value, 'tags')
+            except ValueError as e:
+                raise ApiException(400, str(e))
+            
+            # Replacement; only the difference from the current tags is written.
+            task = self.task_service.get_task(task_id)
+            if not task:
+                raise ApiException(404, f'Task not found: {task_id}')
+            add_tags.extend(t for t in tags if t not in task.tags)
+            remove_tags.extend(t for t in task.tags if t not in tags)
+        
+        changes.add_tags = add_tags
+        changes.remove_tags = [t for t in remove_tags if t not in add_tags]
+        return changes
+
+
+
+# Util
+def select_fields(value, fields):
+    return dict((name, value[name]) for name in task_fields if name in fields)
+
+def split_values(values):
+    result = []
+    for value in values:
+        result.extend(v.strip() for v in value.split(',') if v.strip())
+    return result
+
+def get_tags(value, name):
+    tags = value.get(name) or []
+    if not isinstance(tags, list) or not all(isinstance(t, str) and t for t in tags):
+        raise ValueError(f'{name} must be a list of strings.')
+    return list(tags)
+
+def none_match(header, etag):
+    '''
+    returns bool: Whether the If-None-Match header value given matches etag (weak comparison).
+    '''
+    
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return any(t.strip().removeprefix('W/') == etag for t in header.split(','))
@@ -1,18 +1,21 @@
 # Imports
 
 # Standard
+import io
 import re
 import os.path
 
 from abc import ABC
-from datetime import datetime
+from datetime import datetime, timedelta
+from urllib.parse import urlparse, parse_qsl, urlencode
 
 # User
 import taskwebapp.requestutils as requestutils
+import taskwebapp.domain.task.codec as codec
 
 from taskwebapp.controller import Field, DateTimeField, ValidationException, BadRequestException, NotFoundException
 from taskwebapp.domain import MultipartWrapper
-from taskwebapp.domain.task import Task, TaskStatus, TaskNote
+from taskwebapp.domain.task import Task, TaskStatus, TaskNote, TaskChangeSet
 from taskwebapp.domain.task.search import TaskSearchLogicalOp, TaskSearchStrOp, TaskSearchNumOp, TaskSearchSimpleExpr, \
         TaskSearchIsAnyExpr, TaskSearchExpr, TaskSearchField
 
@@ -21,6 +24,18 @@ from taskwebapp.domain.task.search import TaskSearchLogicalOp, TaskSearchStrOp,
 
 # Definitions
 
+export_content_types = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json'
+}
+
+import_formats = {
+    'application/x-ndjson': 'ndjson',
+    'application/json': 'json',
+    'text/csv': 'csv'
+}
+
+
 # Controller
 class TaskController:
     
@@ -54,9 +69,137 @@ class TaskController:
         context.set_attribute('fields', fields)
         context.set_attribute('results', results)
         context.set_attribute('none_found', none_found)
+        context.set_attribute('query', search_query(context))
+        context.set_attribute('batch_status', Field(
+            name='batch_status',
+            type='select',
+            options=[('', '(No Change)')] + [(item.name, item.name) for item in list(TaskStatus)]
+        ))
         context.render_template('task-inq.html')
+    
+    
+    def do_batch(self, context):
+        '''
+        Applies a batch edit (batch_status, batch_add_tags, batch_remove_tags, batch_due_shift) to the selected tasks
+        (task_id parameters) or, if scope is "matching", to all tasks matching the search criteria given in the query
+        string. Redirects back to the search results.
+        '''
+        
+        scope = context.get_parameter('scope') or 'selected'
+        if scope == 'selected':
+            try:
+                ids = [int(v) for v in context.get_parameter_values('task_id')]
+            except ValueError:
+                raise BadRequestException()
+            criteria = None
+        elif scope == 'matching':
+            ids = None
+            criteria = TaskSearchCriteria()
+            fields = {}
+            for processor in field_processors:
+                processor.define_field(context, fields)
+                processor.process_search(context, fields, criteria)
+            
+            if not criteria.expr or any(field.error for field in fields.values()):
+                raise BadRequestException()
+            criteria = criteria.expr
+        else:
+            raise BadRequestException()
+        
+        status = context.get_parameter('batch_status')
+        try:
+            status = TaskStatus[status] if status else None
+            due_shift_days = context.get_parameter('batch_due_shift')
+            due_shift = timedelta(days=float(due_shift_days)) if due_shift_days else None
+        except (KeyError, ValueError, OverflowError):
+            raise BadRequestException()
+        
+        add_tags = split_tags(context.get_parameter_values('batch_add_tags'))
+        remove_tags = split_tags(context.get_parameter_values('batch_remove_tags'))
+        
+        if (ids or criteria) and (status or add_tags or remove_tags or due_shift):
+            self.task_service.batch_update(ids, criteria, status, add_tags, remove_tags, due_shift)
+        
+        query = search_query(context)
+        context.redirect(f'/tasks?{query}' if query else '/tasks')
  
     
+    def do_export(self, context):
+        export_format = context.get_parameter('format') or 'ndjson'
+        if export_format not in export_content_types:
+            raise BadRequestException()
+        
+        criteria = TaskSearchCriteria()
+        fields = {}
+        for processor in field_processors:
+            processor.define_field(context, fields)
+            processor.process_search(context, fields, criteria)
+        
+        for field in fields.values():
+            if field.error:
+                raise BadRequestException()
+        
+        tasks = self.task_service.export_tasks(criteria.expr)
+        context.write_chunked(export_content_types[export_format], codec.export_parts(tasks, export_format),
+                {'Content-Disposition': f'attachment;filename="tasks.{export_format}"'})
+    
+    
+    def do_import(self, context):
+        '''
+        Imports the tasks in the request body, or, from an upload form (multipart/form-data), in its file part. The
+        format is given by the format parameter or else the content type of the body or file.
+        '''
+        
+        handler = context.handler
+        headers = handler.headers
+        
+        # Form bodies have already been consumed by request processing.
+        content_type = headers.get_content_type()
+        if content_type == 'multipart/form-data':
+            part = context.get_part('file')
+            if not part:
+                raise BadRequestException()
+            if part.is_file:
+                with open(part.value, 'rb') as f:
+                    body = f.read()
+            else:
+                body = part.value
+            file_type = MultipartWrapper(part).mime_type.split(';', 1)[0].strip().lower()
+            if file_type not in import_formats and part.filename:
+                # Clients commonly send application/octet-stream for files of a type they do not know.
+                file_type = requestutils.get_content_type(os.path.splitext(part.filename)[1]).split(';', 1)[0]
+            charset = None
+        elif content_type == 'application/x-www-form-urlencoded':
+            handler.send_error(415)
+            return
+        else:
+            body = handler.rfile.read(int(headers.get('Content-Length') or 0))
+            file_type = content_type
+            charset = headers.get_content_charset()
+        
+        import_format = context.get_parameter('format') or import_formats.get(file_type)
+        if import_format not in codec.readers:
+            handler.send_error(415)
+            return
+        
+        try:
+            text = body.decode(charset or context.encoding)
+        except (UnicodeError, LookupError):
+            raise BadRequestException()
+        
+        imported = 0
+        def progress(count):
+            nonlocal imported
+            imported = count
+        
+        try:
+            self.task_service.import_tasks(codec.readers[import_format](io.StringIO(text, newline='')), progress=progress)
+        except codec.TaskDecodeException as e:
+            context.write_json({'error': str(e), 'imported': imported}, 400)
+        else:
+            context.write_json({'imported': imported})
+    
+    
     def do_initial(self, context):
         fields = {}
         for processor in field_processors:
@@ -132,6 +275,8 @@ class TaskController:
         task = task_service.get_task(task_id)
         if not task:
             raise NotFoundException()
+        original = Task(task.task_id, task.name, task.status, task.due_ts, list(task.tags), list(task.pinned_notes),
+                list(task.notes), task.mod_ts)
 
         # ---Processing---
         # Simple Fields
@@ -141,7 +286,7 @@ class TaskController:
             processor.process_field(context, fields, task)
         
         # Notes/Attachments
-        self.__handle_notes(context, task)
+        self.__handle_notes(context, task, original)
         
         # ---Post-Processing---
         # Determine whether request should be rejected.
@@ -156,12 +301,18 @@ class TaskController:
             context.set_attribute('task', task)
             context.render_template('task.html')
         else:
-            task_service.update_task(task)
+            task_service.patch_task(task.task_id, get_changes(original, task))
             context.redirect(f'/tasks/{task.task_id}')
     
     
     
-    def __handle_notes(self, context, task):
+    def __handle_notes(self, context, task, original=None):
+        '''
+        Creates new notes and attachments from the request and sets them, with the existing notes submitted, on task.
+        If the task's original state is given, existing notes must belong to it, and only those actually edited are
+        updated.
+        '''
+        
         note_service = self.note_service
         attachment_service = self.attachment_service
         
@@ -199,6 +350,22 @@ class TaskController:
                 cache.new_attachment_files_by_note_id[id] = [MultipartWrapper(p) for p in new_attachment_files]
         
         
+        # Skip existing notes that were not edited.
+        unchanged = {}
+        if original is not None:
+            original_notes = dict((n.note_id, n) for n in original.pinned_notes + original.notes)
+            for id, text in existing_notes.note_text_by_note_id.items():
+                note = original_notes.get(id)
+                if not note:
+                    raise BadRequestException()
+                
+                if text == note.text and not existing_notes.new_attachment_files_by_note_id[id] \
+                        and existing_notes.attachment_ids_by_note_id[id] == set(a.attachment_id for a in note.attachment_references):
+                    unchanged[id] = note
+                    del existing_notes.attachment_ids_by_note_id[id]
+                    del existing_notes.new_attachment_files_by_note_id[id]
+        
+        
         # Common Operations
         for cache in (new_notes, existing_notes):
             # Resolve/Create attachments.
@@ -213,10 +380,13 @@ class TaskController:
             for id, text in cache.note_text_by_note_id.items():
                 cache.notes[id] = TaskNote(id, text, cache.get_attachment_references(id))
         
+        for id, note in unchanged.items():
+            existing_notes.notes[id] = note
+        
         
         # Create/Update notes.
         note_service.create_notes(new_notes.notes)
-        note_service.update_notes(existing_notes.notes.values())
+        note_service.update_notes([note for id, note in existing_notes.notes.items() if id not in unchanged])
         
         
         # Map back to task
@@ -249,6 +419,54 @@ class NoteCache:
         return result
         
 
+def get_changes(original, task):
+    '''
+    original (Task): Task as loaded
+    task (Task): Same task after processing a request; notes are expected to be already stored
+    
+    returns TaskChangeSet: Changes that turn original into task.
+    '''
+    changes = TaskChangeSet()
+    
+    if task.name != original.name:
+        changes.name = task.name
+    if task.status != original.status:
+        changes.status = task.status
+    if task.due_ts != original.due_ts:
+        changes.due_ts = task.due_ts
+    
+    changes.add_tags = [t for t in task.tags if t not in original.tags]
+    changes.remove_tags = [t for t in original.tags if t not in task.tags]
+    
+    original_pins = dict([(n.note_id, True) for n in original.pinned_notes] + [(n.note_id, False) for n in original.notes])
+    pins = dict([(n.note_id, True) for n in task.pinned_notes] + [(n.note_id, False) for n in task.notes])
+    changes.add_notes = dict((id, pinned) for id, pinned in pins.items() if id not in original_pins)
+    changes.pin_notes = dict((id, pinned) for id, pinned in pins.items() if id in original_pins and original_pins[id] != pinned)
+    changes.remove_notes = [id for id in original_pins if id not in pins]
+    
+    return changes
+
+
+def split_tags(values):
+    '''
+    Splits comma-separated tag values, dropping blanks and duplicates (order preserved).
+    '''
+    result = {}
+    for value in values:
+        for tag in value.split(','):
+            tag = tag.strip()
+            if tag:
+                result[tag] = None
+    return list(result)
+
+
+def search_query(context):
+    '''
+    returns str: Query string of the request, re-encoded from its parsed parameters (so it is safe to reuse in URLs).
+    '''
+    return urlencode(parse_qsl(urlparse(context.handler.path).query, keep_blank_values=True))
+
+
 class TaskSearchCriteria:
     def __init__(self, expr=None):
         self.expr = expr
@@ -1,6 +1,8 @@
 
 
 class AttachmentReference:
+    __slots__ = ('attachment_id', 'name', 'mime_type', 'creation_ts')
+    
     def __init__(self, attachment_id, name, mime_type, creation_ts):
         self.attachment_id = attachment_id
         self.name = name
@@ -9,7 +11,17 @@ class AttachmentReference:
 
 
 class Attachment:
+    __slots__ = ('name', 'content', 'mime_type')
+    
     def __init__(self, name, content, mime_type):
         self.name = name
         self.content = content
-        self.mime_type = mime_type
\ No newline at end of file
+        self.mime_type = mime_type
+
+
+class AttachmentPreview:
+    __slots__ = ('mime_type', 'content')
+    
+    def __init__(self, mime_type, content):
+        self.mime_type = mime_type
+        self.content = content
\ No newline at end of file
@@ -0,0 +1,19 @@
+
+from enum import Enum
+
+class JobState(Enum):
+    READY = 1
+    RUNNING = 2
+    FAILED = 3
+    
+    def __str__(self):
+        return self.name
+
+class Job:
+    __slots__ = ('job_id', 'job_type', 'payload', 'attempts')
+    
+    def __init__(self, job_id, job_type, payload, attempts):
+        self.job_id = job_id
+        self.job_type = job_type
+        self.payload = payload
+        self.attempts = attempts
\ No newline at end of file
@@ -12,6 +12,8 @@ class TaskStatus(Enum):
         return self.name
     
 class TaskReference:
+    __slots__ = ('task_id', 'name', 'status', 'due_ts', 'last_action_ts')
+    
     def __init__(self, task_id, name, status, due_ts, last_action_ts):
         self.task_id = task_id
         self.name = name
@@ -20,7 +22,9 @@ class TaskReference:
         self.last_action_ts = last_action_ts
 
 class Task:
-    def __init__(self, task_id=None, name=None, status=None, due_ts=None, tags=None, pinned_notes=None, notes=None):
+    __slots__ = ('task_id', 'name', 'status', 'due_ts', 'tags', 'pinned_notes', 'notes', 'mod_ts')
+    
+    def __init__(self, task_id=None, name=None, status=None, due_ts=None, tags=None, pinned_notes=None, notes=None, mod_ts=None):
         self.task_id = task_id
         self.name = name
         self.status = status
@@ -28,9 +32,49 @@ class Task:
         self.tags = tags
         self.pinned_notes = pinned_notes
         self.notes = notes
+        self.mod_ts = mod_ts
+
+
+UNCHANGED = object()
+
+class TaskChangeSet:
+    '''
+    Changes to apply to an existing task. Fields left UNCHANGED are not written. Notes are referenced by ID and
+    expected to exist already; add_notes and pin_notes map note IDs to whether they are (to be) pinned.
+    '''
+    
+    __slots__ = ('name', 'status', 'due_ts', 'add_tags', 'remove_tags', 'add_notes', 'remove_notes', 'pin_notes')
+    
+    def __init__(self, name=UNCHANGED, status=UNCHANGED, due_ts=UNCHANGED, add_tags=None, remove_tags=None,
+            add_notes=None, remove_notes=None, pin_notes=None):
+        self.name = name
+        self.status = status
+        self.due_ts = due_ts
+        self.add_tags = add_tags or []
+        self.remove_tags = remove_tags or []
+        self.add_notes = add_notes or {}
+        self.remove_notes = remove_notes or []
+        self.pin_notes = pin_notes or {}
+    
+    def is_empty(self):
+        return self.name is UNCHANGED and self.status is UNCHANGED and self.due_ts is UNCHANGED and not self.add_tags \
+                and not self.remove_tags and not self.add_notes and not self.remove_notes and not self.pin_notes
+
+
+class TaskModifiedException(Exception):
+    '''
+    Raised when a change is conditioned on a modification timestamp that is no longer current.
+    '''
+    
+    def __init__(self, task_id, mod_ts):
+        super().__init__(task_id, mod_ts)
+        self.task_id = task_id
+        self.mod_ts = mod_ts
 
 
 class TaskNote:
+    __slots__ = ('note_id', 'text', 'attachment_references', 'mod_ts')
+    
     def __init__(self, note_id=None, text=None, attachment_references=None, mod_ts=None):
         self.note_id = note_id
         self.text = text
@@ -38,6 +82,8 @@ class TaskNote:
         self.mod_ts = mod_ts
 
 class TaskDashboardData:
+    __slots__ = ('late', 'due_today', 'due_this_week', 'pending', 'due_later', 'backlog', 'in_progress')
+    
     def __init__(self, late, due_today, due_this_week, pending, due_later, backlog, in_progress):
         self.late = late
         self.due_today = due_today
@@ -0,0 +1,254 @@
+# Imports
+# Standard
+import csv
+import json
+
+from datetime import datetime
+
+# User
+from taskwebapp.domain.task import Task, TaskNote, TaskStatus
+
+
+# Definitions
+class TaskDecodeException(ValueError):
+    def __init__(self, line_no, message):
+        super().__init__(f'Line {line_no}: {message}')
+        self.line_no = line_no
+        self.message = message
+
+
+def format_ts(value):
+    return value.isoformat(' ') if value is not None else None
+
+def parse_ts(value):
+    if value is None or value == '':
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f'Invalid timestamp: {value!r}')
+    value = datetime.fromisoformat(value)
+    # Timestamps are kept in local time, without offset.
+    return value.astimezone().replace(tzinfo=None) if value.tzinfo else value
+
+def parse_status(value):
+    if value is None or value == '':
+        return TaskStatus.READY
+    try:
+        return TaskStatus[value.upper()]
+    except (KeyError, AttributeError):
+        raise ValueError(f'Invalid status: {value!r}')
+
+
+def task_to_dict(task):
+    '''
+    task (Task): Fully populated task
+
+    returns dict: JSON-compatible representation of task, including its tags, notes (pinned notes first, flagged) and
+    attachment references (without content).
+    '''
+
+    notes = []
+    for pinned, task_notes in ((True, task.pinned_notes), (False, task.notes)):
+        for note in task_notes:
+            notes.append({
+                'note_id': note.note_id,
+                'text': note.text,
+                'pinned': pinned,
+                'mod_ts': format_ts(note.mod_ts),
+                'attachments': [{
+                    'attachment_id': a.attachment_id,
+                    'name': a.name,
+                    'mime_type': a.mime_type,
+                    'creation_ts': format_ts(a.creation_ts)
+                } for a in note.attachment_references]
+            })
+
+    return {
+        'task_id': task.task_id,
+        'name': task.name,
+        'status': task.status.name,
+        'due_ts': format_ts(task.due_ts),
+        'mod_ts': format_ts(task.mod_ts),
+        'tags': task.tags,
+        'notes': notes
+    }
+
+
+def reference_to_dict(reference):
+    '''
+    reference (TaskReference): Task reference, as returned by searches
+
+    returns dict: JSON-compatible representation of the base fields of the task, keyed as in task_to_dict.
+    '''
+
+    return {
+        'task_id': reference.task_id,
+        'name': reference.name,
+        'status': reference.status.name,
+        'due_ts': format_ts(reference.due_ts),
+        'mod_ts': format_ts(reference.last_action_ts)
+    }
+
+
+def task_etag(task_id, mod_ts):
+    '''
+    returns str: Entity tag identifying the version of a task; changes whenever its modification timestamp does.
+    '''
+
+    return f'"{task_id}-{mod_ts:%Y%m%d%H%M%S%f}"'
+
+def parse_etag(task_id, value):
+    '''
+    returns datetime: Modification timestamp encoded in the given entity tag (as produced by task_etag), or None if
+    value is not a (strong) entity tag of the given task.
+    '''
+
+    value = value.strip()
+    prefix = f'"{task_id}-'
+    if not value.startswith(prefix) or not value.endswith('"'):
+        return None
+    try:
+        return datetime.strptime(value[len(prefix):-1], '%Y%m%d%H%M%S%f')
+    except ValueError:
+        return None
+
+
+def encode_task(task):
+    return json.dumps(task_to_dict(task), ensure_ascii=False, separators=(',', ':'))
+
+
+def export_parts(tasks, format='ndjson', chunk_size=64 * 1024):
+    '''
+    tasks (iter[Task]): Tasks to export
+    format (str): 'ndjson' (one task per line) or 'json' (a single array)
+    chunk_size (int): Approximate size (characters) of the parts generated
+
+    Generates the export document in parts of roughly chunk_size, suitable for chunked transfer encoding.
+    '''
+
+    if format not in ('ndjson', 'json'):
+        raise ValueError(format)
+    is_json = format == 'json'
+
+    buf = []
+    size = 0
+    if is_json:
+        buf.append('[')
+
+    first = True
+    for task in tasks:
+        line = encode_task(task)
+        if is_json:
+            if not first:
+                buf.append(',')
+            buf.append('\n')
+        buf.append(line)
+        if not is_json:
+            buf.append('\n')
+        first = False
+
+        size += len(line) + 2
+        if size >= chunk_size:
+            yield ''.join(buf)
+            buf.clear()
+            size = 0
+
+    if is_json:
+        buf.append('\n]\n')
+    if buf:
+        yield ''.join(buf)
+
+
+# Import
+def task_from_dict(value):
+    '''
+    value (dict): Task in the representation produced by task_to_dict; only name is required, IDs are ignored
+
+    returns Task: New (unsaved) task. Raises ValueError if value is malformed.
+    '''
+
+    if not isinstance(value, dict):
+        raise ValueError('Expected an object.')
+
+    name = value.get('name')
+    if not name or not isinstance(name, str):
+        raise ValueError('Task name is required.')
+
+    tags = value.get('tags') or []
+    if not isinstance(tags, list) or not all(isinstance(t, str) and t for t in tags):
+        raise ValueError('Tags must be a list of strings.')
+
+    notes = []
+    pinned_notes = []
+    for note in value.get('notes') or []:
+        if not isinstance(note, dict) or not isinstance(note.get('text'), str):
+            raise ValueError('Notes must be objects with a text.')
+        (pinned_notes if note.get('pinned') else notes).append(TaskNote(None, note['text'], [], parse_ts(note.get('mod_ts'))))
+
+    return Task(None, name, parse_status(value.get('status')), parse_ts(value.get('due_ts')), tags, pinned_notes, notes,
+            parse_ts(value.get('mod_ts')))
+
+
+def read_ndjson(lines):
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield task_from_dict(json.loads(line))
+        except ValueError as e:
+            raise TaskDecodeException(line_no, str(e))
+
+def read_json(lines):
+    try:
+        values = json.loads(''.join(lines))
+    except ValueError as e:
+        raise TaskDecodeException(getattr(e, 'lineno', 1), str(e))
+    if not isinstance(values, list):
+        raise TaskDecodeException(1, 'Expected an array.')
+
+    for i, value in enumerate(values):
+        try:
+            yield task_from_dict(value)
+        except ValueError as e:
+            raise TaskDecodeException(i + 1, f'Task {i + 1}: {e}')
+
+def read_csv(lines):
+    '''
+    Reads tasks from CSV with a header row. Recognized columns: name (required), status, due_ts, tags
+    (comma-separated), and any number of note and pinned_note columns (one note each; empty cells are skipped).
+    '''
+
+    reader = csv.reader(lines)
+    try:
+        header = [h.strip().casefold() for h in next(reader)]
+    except StopIteration:
+        return
+    if 'name' not in header:
+        raise TaskDecodeException(1, 'Missing name column.')
+
+    columns = dict((h, i) for i, h in reversed(list(enumerate(header))))
+    note_columns = [(i, h == 'pinned_note') for i, h in enumerate(header) if h in ('note', 'pinned_note')]
+
+    def cell(row, name):
+        i = columns.get(name)
+        return row[i].strip() if i is not None and i < len(row) else ''
+
+    for row in reader:
+        if not any(row):
+            continue
+        try:
+            notes = [{'text': row[i], 'pinned': pinned} for i, pinned in note_columns if i < len(row) and row[i].strip()]
+            yield task_from_dict({
+                'name': cell(row, 'name'),
+                'status': cell(row, 'status'),
+                'due_ts': cell(row, 'due_ts'),
+                'tags': [t.strip() for t in cell(row, 'tags').split(',') if t.strip()],
+                'notes': notes
+            })
+        except ValueError as e:
+            raise TaskDecodeException(reader.line_num, str(e))
+
+readers = {
+    'ndjson': read_ndjson,
+    'json': read_json,
+    'csv': read_csv
+}
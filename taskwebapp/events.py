@@ -0,0 +1,318 @@
+# Imports
+# Standard
+import json
+import time
+import socket
+import selectors
+import traceback
+
+from collections import deque
+from threading import Thread, Lock
+
+
+
+
+# Definitions
+def format_event(event, data, event_id=None):
+    '''
+    returns bytes: Server-sent event (text/event-stream) of the given type, with data encoded as JSON on a single line.
+    '''
+    
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data)}')
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+reload_event = format_event('reload', {})
+
+
+
+class Subscription:
+    '''
+    Bounded queue of formatted events for a single subscriber. A subscriber that falls more than max_queued events
+    behind loses the queued events and is flagged as overflowed instead; it should then reload its state as a whole.
+    '''
+    
+    __slots__ = ('max_queued', 'wake', 'queue', 'overflowed', 'lock')
+    
+    def __init__(self, max_queued, wake=None):
+        self.max_queued = max_queued
+        self.wake = wake
+        self.queue = deque()
+        self.overflowed = False
+        self.lock = Lock()
+    
+    def put(self, message):
+        '''
+        returns bool: Whether the message was queued (False if the subscriber overflowed).
+        '''
+        
+        with self.lock:
+            if self.overflowed:
+                return False
+            if len(self.queue) >= self.max_queued:
+                self.queue.clear()
+                self.overflowed = True
+                queued = False
+            else:
+                self.queue.append(message)
+                queued = True
+        
+        if self.wake:
+            self.wake()
+        return queued
+    
+    def drain(self):
+        '''
+        returns (list[bytes], bool): Messages queued since the last call, and whether the subscriber overflowed since.
+        '''
+        
+        with self.lock:
+            messages = list(self.queue)
+            self.queue.clear()
+            overflowed, self.overflowed = self.overflowed, False
+        return messages, overflowed
+
+
+
+class EventBus:
+    '''
+    In-process publish/subscribe of server-sent events. Events are formatted once on publishing and numbered; each
+    subscriber gets its own bounded queue, so a slow subscriber never holds up publishers or other subscribers.
+    '''
+    
+    def __init__(self, max_queued=64):
+        self.max_queued = max_queued
+        self.subscriptions = set()
+        self.lock = Lock()
+        self.last_id = 0
+        self.published = 0
+        self.dropped = 0
+    
+    def has_subscribers(self):
+        return bool(self.subscriptions)
+    
+    def subscribe(self, wake=None):
+        '''
+        wake (callable): Called (without arguments) whenever an event is queued for the subscriber
+        
+        returns Subscription
+        '''
+        
+        subscription = Subscription(self.max_queued, wake)
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+    
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+    
+    def publish(self, event, data):
+        '''
+        event (str): Event type
+        data: JSON-compatible event data
+        '''
+        
+        with self.lock:
+            self.last_id += 1
+            message = format_event(event, data, self.last_id)
+            self.published += 1
+            subscriptions = list(self.subscriptions)
+        
+        dropped = 0
+        for subscription in subscriptions:
+            if not subscription.put(message):
+                dropped += 1
+        
+        if dropped:
+            with self.lock:
+                self.dropped += dropped
+    
+    def stats(self):
+        with self.lock:
+            return {'subscribers': len(self.subscriptions), 'published': self.published, 'dropped': self.dropped}
+
+
+
+class EventStreamClient:
+    __slots__ = ('sock', 'subscription', 'pending', 'writing')
+    
+    def __init__(self, sock, subscription, pending):
+        self.sock = sock
+        self.subscription = subscription
+        self.pending = bytearray(pending)
+        self.writing = False
+
+
+class EventStreamDispatcher(Thread):
+    '''
+    Serves event streams from a single thread. Request handlers write the response headers, then hand the socket over
+    with attach and return, so idle subscribers do not occupy a server thread. The dispatcher waits on all attached
+    sockets with a selector, writes queued events as sockets become writable, sends a comment line every heartbeat_s
+    seconds (keeping intermediaries from timing the stream out), and closes sockets the client has closed. A client's
+    events are only taken from its subscription once everything before them is written, so a slow client's backlog is
+    bounded by its subscription queue and surfaces as a reload event rather than as unbounded buffering.
+    '''
+    
+    def __init__(self, event_bus, heartbeat_s=15.0):
+        super().__init__(name='EventStreamDispatcher', daemon=True)
+        self.event_bus = event_bus
+        self.heartbeat_s = heartbeat_s
+        self.selector = selectors.DefaultSelector()
+        self.clients = set()
+        self.attaching = []
+        self.lock = Lock()
+        self.stopping = False
+        self.woken = False
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+    
+    def attach(self, sock, last_event_id=None):
+        '''
+        sock (socket): Connected socket, with the response headers already sent
+        last_event_id (str): Last-Event-ID header of the request, if any
+        
+        Takes over sock, which the caller must no longer use or close. A reconnecting client that may have missed events
+        (its last event is not the latest one) is sent a reload event first.
+        '''
+        
+        initial = b'retry: 5000\n\n'
+        if last_event_id is not None and last_event_id != str(self.event_bus.last_id):
+            initial += reload_event
+        
+        with self.lock:
+            if self.stopping:
+                sock.close()
+                return
+            self.attaching.append((sock, initial))
+        self.wake()
+    
+    def wake(self):
+        # Coalesces wake-ups until the dispatcher has run; publishing to many subscribers costs a single write.
+        if self.woken:
+            return
+        self.woken = True
+        try:
+            self.wake_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+    
+    def stop(self):
+        with self.lock:
+            self.stopping = True
+        self.wake()
+        if self.is_alive():
+            self.join(timeout=5.0)
+    
+    def stats(self):
+        return {'clients': len(self.clients)}
+    
+    def run(self):
+        next_heartbeat = time.monotonic() + self.heartbeat_s
+        try:
+            while True:
+                for key, mask in self.selector.select(max(0.0, next_heartbeat - time.monotonic())):
+                    if key.fileobj is self.wake_r:
+                        self.__clear_wake()
+                        continue
+                    
+                    client = key.data
+                    if mask & selectors.EVENT_READ and not self.__read(client):
+                        continue
+                    if mask & selectors.EVENT_WRITE:
+                        self.__flush(client)
+                
+                with self.lock:
+                    if self.stopping:
+                        break
+                    attaching, self.attaching = self.attaching, []
+                for sock, initial in attaching:
+                    self.__add(sock, initial)
+                
+                heartbeat = time.monotonic() >= next_heartbeat
+                if heartbeat:
+                    next_heartbeat = time.monotonic() + self.heartbeat_s
+                
+                for client in list(self.clients):
+                    if client.pending:
+                        continue
+                    messages, overflowed = client.subscription.drain()
+                    if overflowed:
+                        client.pending += reload_event
+                    for message in messages:
+                        client.pending += message
+                    if heartbeat and not client.pending:
+                        client.pending += b':\n\n'
+                    self.__flush(client)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            for client in list(self.clients):
+                self.__remove(client)
+            self.selector.close()
+            self.wake_r.close()
+            self.wake_w.close()
+    
+    
+    def __clear_wake(self):
+        self.woken = False
+        try:
+            while self.wake_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+    
+    def __add(self, sock, initial):
+        sock.setblocking(False)
+        client = EventStreamClient(sock, self.event_bus.subscribe(self.wake), initial)
+        self.clients.add(client)
+        self.selector.register(sock, selectors.EVENT_READ, client)
+        self.__flush(client)
+    
+    def __remove(self, client):
+        self.event_bus.unsubscribe(client.subscription)
+        self.clients.discard(client)
+        try:
+            self.selector.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            client.sock.close()
+        except OSError:
+            pass
+    
+    def __read(self, client):
+        # Clients send nothing after the request; readable means closed (or data to discard).
+        try:
+            if client.sock.recv(4096):
+                return True
+        except BlockingIOError:
+            return True
+        except OSError:
+            pass
+        self.__remove(client)
+        return False
+    
+    def __flush(self, client):
+        pending = client.pending
+        try:
+            while pending:
+                sent = client.sock.send(pending)
+                del pending[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.__remove(client)
+            return
+        
+        writing = bool(pending)
+        if writing != client.writing:
+            client.writing = writing
+            self.selector.modify(client.sock, selectors.EVENT_READ | selectors.EVENT_WRITE if writing else
+                    selectors.EVENT_READ, client)
@@ -1,6 +1,7 @@
 # Imports
 
 # Standard
+import hmac
 import json
 
 from enum import Enum, auto
@@ -11,6 +12,8 @@ import taskwebapp.requestutils as requestutils
 
 from taskwebapp.domain.task import TaskStatus
 from taskwebapp.controller import RequestException
+from taskwebapp.controller.api import ApiException
+from taskwebapp.profiling import ProfilerBusyException
 
 # Definitions
 class ValidationException(Exception):
@@ -23,11 +26,37 @@ class StaticResourceHandler:
     def __init__(self, encoding, static_content_dirs):
         self.encoding = encoding
         self.static_content_dirs = static_content_dirs
+        self.cache = {}
+    
+    def preload(self):
+        '''
+        Reads all allowed files under the static content directories into memory; they are served from there afterwards.
+        '''
+        
+        cache = {}
+        for static_content_dir, allowed_patterns in self.static_content_dirs.items():
+            for target_path in static_content_dir.rglob('*'):
+                req_path = target_path.relative_to(static_content_dir).as_posix()
+                if req_path in cache or not target_path.is_file() \
+                        or not any(p.match(req_path) for p in allowed_patterns):
+                    continue
+                cache[req_path] = (requestutils.get_content_type(target_path.suffix, self.encoding), target_path.read_bytes())
+        self.cache = cache
     
     def do_get(self, context):
         handler = context.handler
         
         req_path = context.match[1]
+        cached = self.cache.get(req_path)
+        if cached:
+            content_type, data = cached
+            handler.send_response(200)
+            handler.send_header('Content-Type', content_type)
+            handler.send_header('Content-Length', len(data))
+            handler.end_headers()
+            handler.wfile.write(data)
+            return
+        
         res_path = Path(*req_path.split('/'))
         for static_content_dir, allowed_patterns in self.static_content_dirs.items():
             target_path = static_content_dir.joinpath(res_path)
@@ -56,6 +85,31 @@ class StaticResourceHandler:
 
 
 
+# Events
+class EventsHandler:
+    '''
+    GET /events: stream (text/event-stream) of task change events. Once the response headers are sent, the connection is
+    handed to the event stream dispatcher and the request thread is released.
+    '''
+    
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+    
+    def do_get(self, context):
+        handler = context.handler
+        
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/event-stream')
+        handler.send_header('Cache-Control', 'no-cache')
+        # The stream ends when either side closes the connection.
+        handler.send_header('Connection', 'close')
+        handler.end_headers()
+        
+        handler.server.detach_request(handler.request)
+        self.dispatcher.attach(handler.request, handler.headers.get('Last-Event-ID'))
+
+
+
 # Home Page
 class HomePageHandler:
     def __init__(self, task_service):
@@ -74,6 +128,9 @@ class TaskRequestType(Enum):
     INQUIRY_OR_UPDATE = auto()
     CREATE = auto()
     SEARCH = auto()
+    EXPORT = auto()
+    IMPORT = auto()
+    BATCH = auto()
     
     def get_request_type(context):
         sub_path = context.match[1]
@@ -81,7 +138,13 @@ class TaskRequestType(Enum):
         is_create = context.bool_param('_create_')
         is_default_path = not sub_path or sub_path == '/'
         
-        if is_create:
+        if sub_path == '/export':
+            return TaskRequestType.EXPORT if not is_create else None
+        elif sub_path == '/import':
+            return TaskRequestType.IMPORT if not is_create else None
+        elif sub_path == '/batch':
+            return TaskRequestType.BATCH if not is_create else None
+        elif is_create:
             return TaskRequestType.CREATE if is_default_path else None
         elif is_default_path:
             return TaskRequestType.SEARCH
@@ -106,6 +169,13 @@ class TaskHandler:
                 handler.send_error(e.code)
         elif request_type == TaskRequestType.SEARCH:
             controller.do_search(context)
+        elif request_type == TaskRequestType.EXPORT:
+            try:
+                controller.do_export(context)
+            except RequestException as e:
+                handler.send_error(e.code)
+        elif request_type in (TaskRequestType.IMPORT, TaskRequestType.BATCH):
+            handler.send_error(405)
         else:
             handler.send_error(400)
     
@@ -116,16 +186,67 @@ class TaskHandler:
         controller = self.controller
         
         if request_type == TaskRequestType.INQUIRY_OR_UPDATE:
-            controller.do_update(context)
+            try:
+                controller.do_update(context)
+            except RequestException as e:
+                handler.send_error(e.code)
         elif request_type == TaskRequestType.CREATE:
-            controller.do_create(context)
-        elif request_type == TaskRequestType.SEARCH:
+            try:
+                controller.do_create(context)
+            except RequestException as e:
+                handler.send_error(e.code)
+        elif request_type == TaskRequestType.IMPORT:
+            try:
+                controller.do_import(context)
+            except RequestException as e:
+                handler.send_error(e.code)
+        elif request_type == TaskRequestType.BATCH:
+            try:
+                controller.do_batch(context)
+            except RequestException as e:
+                handler.send_error(e.code)
+        elif request_type in (TaskRequestType.SEARCH, TaskRequestType.EXPORT):
             handler.send_error(501)
         else:
             handler.send_error(400)
 
 
 
+# Task API
+class TaskApiHandler:
+    def __init__(self, controller):
+        self.controller = controller
+    
+    def do_get(self, context):
+        sub_path = context.match[1]
+        if not sub_path or sub_path == '/':
+            self.__call(context, self.controller.do_list)
+        else:
+            self.__call(context, self.controller.do_get, sub_path)
+    
+    def do_patch(self, context):
+        sub_path = context.match[1]
+        if not sub_path or sub_path == '/':
+            context.write_json({'error': 'Method not allowed.'}, 405, {'Allow': 'GET'})
+        else:
+            self.__call(context, self.controller.do_patch, sub_path)
+    
+    def __call(self, context, target, sub_path=None):
+        try:
+            if sub_path is None:
+                target(context)
+                return
+            
+            try:
+                task_id = int(sub_path[1:])
+            except ValueError:
+                raise ApiException(404, f'Not found: {sub_path[1:]}')
+            target(context, task_id)
+        except ApiException as e:
+            context.write_json({'error': e.message}, e.code)
+
+
+
 # Tag Management
 class TagHandler:
     def __init__(self, tag_service):
@@ -152,9 +273,14 @@ class AttachmentHandler:
     
     def do_get(self, context):
         handler = context.handler
+        
+        sub_path = context.match[1]
+        if sub_path.endswith('/preview'):
+            self.__do_get_preview(context, sub_path[:-len('/preview')])
+            return
     
         try:
-            attachment_id = int(context.match[1][1:])
+            attachment_id = int(sub_path[1:])
         except ValueError:
             handler.send_error(400)
             return
@@ -171,4 +297,105 @@ class AttachmentHandler:
         handler.send_header('Content-Disposition', f'inline;filename="{attachment.name}"')
         handler.end_headers()
         
-        handler.wfile.write(attachment.content)
\ No newline at end of file
+        handler.wfile.write(attachment.content)
+    
+    def __do_get_preview(self, context, sub_path):
+        handler = context.handler
+        
+        try:
+            attachment_id = int(sub_path[1:])
+            size = int(context.get_parameter('size') or 128)
+        except ValueError:
+            handler.send_error(400)
+            return
+        
+        preview = self.attachment_service.fetch_preview(attachment_id, size)
+        if not preview:
+            handler.send_error(404)
+            return
+        
+        # Only stored previews are served, and those never change for an attachment; the page's URLs carry a version (v)
+        # parameter in case an ID is reused.
+        handler.send_response(200)
+        handler.send_header('Content-Type', preview.mime_type)
+        handler.send_header('Content-Length', len(preview.content))
+        handler.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+        handler.end_headers()
+        
+        handler.wfile.write(preview.content)
+
+
+# Metrics
+class MetricsHandler:
+    def __init__(self, registry):
+        self.registry = registry
+    
+    def do_get(self, context):
+        resp = self.registry.render().encode('utf-8')
+        
+        handler = context.handler
+        handler.send_response(200)
+        handler.send_header('Content-Type', self.registry.content_type)
+        handler.send_header('Content-Length', len(resp))
+        handler.end_headers()
+        
+        handler.wfile.write(resp)
+
+
+
+# Administration
+def is_admin_request(handler, admin_token):
+    supplied = handler.headers.get('X-Admin-Token')
+    return bool(admin_token) and supplied is not None and hmac.compare_digest(supplied, admin_token)
+
+class AdminHandler:
+    '''
+    Restricts the wrapped handler to requests bearing the admin token in an X-Admin-Token header.
+    '''
+    
+    def __init__(self, handler, admin_token):
+        self.handler = handler
+        self.admin_token = admin_token
+    
+    def __getattr__(self, name):
+        target = getattr(self.handler, name)
+        if not name.startswith('do_'):
+            return target
+        
+        def checked(context):
+            if not is_admin_request(context.handler, self.admin_token):
+                context.handler.send_error(403)
+                return
+            target(context)
+        return checked
+
+
+class ProfileHandler:
+    def __init__(self, profiler):
+        self.profiler = profiler
+    
+    def do_get(self, context):
+        handler = context.handler
+        
+        try:
+            seconds = float(context.get_parameter('seconds') or 10)
+            interval = float(context.get_parameter('interval')) if context.get_parameter('interval') else None
+        except ValueError:
+            handler.send_error(400)
+            return
+        
+        try:
+            text, path = self.profiler.profile(seconds, interval)
+        except ProfilerBusyException:
+            handler.send_error(409, 'Profiler already running.')
+            return
+        
+        resp = text.encode('utf-8')
+        
+        handler.send_response(200)
+        handler.send_header('Content-Type', requestutils.content_type_value('text/plain', 'utf-8'))
+        handler.send_header('Content-Length', len(resp))
+        handler.send_header('X-Profile-Path', path)
+        handler.end_headers()
+        
+        handler.wfile.write(resp)
@@ -0,0 +1,126 @@
+# Imports
+# Standard
+import traceback
+
+from threading import Thread, Condition, Lock
+
+# User
+from taskwebapp.domain.job import JobState
+
+
+# Definitions
+class JobRunner:
+    '''
+    Runs jobs queued with a JobService on worker_count daemon threads, dispatching on job type to the handlers registered
+    with add_handler (called with the job's payload). Idle workers poll the queue every poll_interval_s seconds, which
+    picks up retries as they fall due, and immediately when woken, e.g. by a service that has just queued jobs. A handler
+    that raises fails the job, leaving the retry schedule to the JobService.
+    '''
+
+    def __init__(self, job_service, worker_count=2, poll_interval_s=5.0):
+        self.job_service = job_service
+        self.worker_count = worker_count
+        self.poll_interval_s = poll_interval_s
+        self.handlers = {}
+        self.workers = []
+        self.condition = Condition()
+        self.generation = 0
+        self.stopping = False
+        self.lock = Lock()
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+
+    def add_handler(self, job_type, fn):
+        self.handlers[job_type] = fn
+
+    def wake(self):
+        with self.condition:
+            self.generation += 1
+            self.condition.notify_all()
+
+    def start(self):
+        # Jobs left RUNNING were interrupted by the previous shutdown.
+        recovered = self.job_service.recover()
+        if recovered:
+            print(f'Jobs: {recovered} interrupted job(s) queued again')
+
+        for i in range(self.worker_count):
+            worker = Thread(target=self.__work, name=f'JobRunner-{i}', daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self, timeout_s=5.0):
+        '''
+        Stops the workers once their current jobs are done, waiting for up to timeout_s seconds. Jobs still running
+        afterwards are run again after the next start.
+        '''
+
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join(timeout=timeout_s)
+
+    def stats(self):
+        with self.lock:
+            return {'completed': self.completed, 'retried': self.retried, 'failed': self.failed}
+
+    def __work(self):
+        condition = self.condition
+        while True:
+            with condition:
+                if self.stopping:
+                    return
+                generation = self.generation
+
+            try:
+                job = self.job_service.claim()
+            except:
+                traceback.print_exc()
+                print()
+                job = None
+
+            if job:
+                self.__run(job)
+                continue
+
+            # Waits unless woken since the claim was attempted.
+            with condition:
+                if not self.stopping and generation == self.generation:
+                    condition.wait(self.poll_interval_s)
+
+    def __run(self, job):
+        try:
+            handler = self.handlers.get(job.job_type)
+            if not handler:
+                raise LookupError(f'No handler for job type {job.job_type}')
+            handler(job.payload)
+        except Exception as e:
+            traceback.print_exc()
+            print()
+            try:
+                state = self.job_service.fail(job, ''.join(traceback.format_exception_only(type(e), e)).strip())
+            except:
+                # Left RUNNING; queued again after the next start.
+                traceback.print_exc()
+                print()
+                return
+
+            with self.lock:
+                if state == JobState.FAILED:
+                    self.failed += 1
+                else:
+                    self.retried += 1
+            print(f'Jobs: {job.job_type} job {job.job_id} failed (attempt {job.attempts}); ' +
+                    ('giving up' if state == JobState.FAILED else 'will retry'))
+        else:
+            try:
+                self.job_service.complete(job)
+            except:
+                traceback.print_exc()
+                print()
+                return
+
+            with self.lock:
+                self.completed += 1
@@ -0,0 +1,91 @@
+# Imports
+# Standard
+import time
+import traceback
+
+from threading import Thread, Event, Lock
+
+
+# Definitions
+class ActivityMonitor:
+    '''
+    Tracks in-flight requests so background work can be deferred while the server is busy. Used as a context manager
+    around request handling.
+    '''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.active = 0
+        self.last_activity = time.monotonic()
+
+    def idle_for(self):
+        with self.lock:
+            return 0.0 if self.active else time.monotonic() - self.last_activity
+
+    def __enter__(self):
+        with self.lock:
+            self.active += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self.lock:
+            self.active -= 1
+            self.last_activity = time.monotonic()
+
+
+class MaintenanceJob:
+    def __init__(self, name, fn, interval_s, idle_only=False):
+        self.name = name
+        self.fn = fn
+        self.interval_s = interval_s
+        self.idle_only = idle_only
+        self.next_run = time.monotonic() + interval_s
+
+    def is_due(self, now, idle_s, min_idle_s):
+        if self.next_run > now:
+            return False
+        # Idle-only jobs wait for a quiet period, but no longer than one additional interval.
+        return not self.idle_only or idle_s >= min_idle_s or now >= self.next_run + self.interval_s
+
+    def run(self):
+        start = time.monotonic()
+        try:
+            result = self.fn()
+        except:
+            traceback.print_exc()
+            print()
+        else:
+            print(f'Maintenance: {self.name} completed in {time.monotonic() - start:.3f}s: {result}')
+        finally:
+            self.next_run = time.monotonic() + self.interval_s
+
+
+class MaintenanceScheduler(Thread):
+    '''
+    Runs registered MaintenanceJobs in a background daemon thread, each at its own interval. Jobs registered as
+    idle_only are deferred until the given ActivityMonitor reports min_idle_s seconds without requests.
+    '''
+
+    def __init__(self, activity_monitor=None, min_idle_s=2.0, poll_interval_s=1.0):
+        super().__init__(daemon=True)
+        self.activity_monitor = activity_monitor
+        self.min_idle_s = min_idle_s
+        self.poll_interval_s = poll_interval_s
+        self.jobs = []
+        self.stopped = Event()
+
+    def add_job(self, name, fn, interval_s, idle_only=False):
+        self.jobs.append(MaintenanceJob(name, fn, interval_s, idle_only))
+
+    def run(self):
+        activity_monitor = self.activity_monitor
+        while not self.stopped.wait(self.poll_interval_s):
+            for job in self.jobs:
+                if self.stopped.is_set():
+                    return
+                idle_s = activity_monitor.idle_for() if activity_monitor else float('inf')
+                if job.is_due(time.monotonic(), idle_s, self.min_idle_s):
+                    job.run()
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,354 @@
+# Imports
+# Standard
+import time
+
+from threading import Lock, local
+
+
+# Definitions
+default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = local()
+
+
+def format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{n}="{escape_label(str(v))}"' for n, v in pairs) + '}'
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+
+# Metric Types
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = Lock()
+
+    def inc(self, label_values=(), amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = list(self.values.items())
+        for label_values, value in values:
+            yield self.name, format_labels(self.label_names, label_values), value
+
+
+class CollectedCounter(Counter):
+    '''
+    Counter set by a collector to a cumulative value kept elsewhere (e.g. a component's statistics), instead of being
+    incremented.
+    '''
+
+    def set(self, label_values=(), value=0):
+        with self.lock:
+            self.values[label_values] = value
+
+
+class Gauge(CollectedCounter):
+    type = 'gauge'
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, label_names=(), buckets=default_buckets):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = Lock()
+
+    def observe(self, label_values, value):
+        buckets = self.buckets
+        with self.lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = [[0] * len(buckets), 0.0, 0]
+
+            counts = entry[0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self.lock:
+            values = [(k, list(v[0]), v[1], v[2]) for k, v in self.values.items()]
+
+        name = self.name
+        label_names = self.label_names
+        for label_values, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f'{name}_bucket', format_labels(label_names, label_values, ('le', format_value(bound))), cumulative
+            yield f'{name}_bucket', format_labels(label_names, label_values, ('le', '+Inf')), count
+            yield f'{name}_sum', format_labels(label_names, label_values), total
+            yield f'{name}_count', format_labels(label_names, label_values), count
+
+
+
+class MetricsRegistry:
+    '''
+    Collection of metrics, rendered in the Prometheus text exposition format. Collectors (callables invoked at render
+    time) can be added to refresh metrics derived from other components, e.g. cache statistics.
+    '''
+
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, label_names=()):
+        return self.register(Counter(name, help, label_names))
+
+    def collected_counter(self, name, help, label_names=()):
+        return self.register(CollectedCounter(name, help, label_names))
+
+    def gauge(self, name, help, label_names=()):
+        return self.register(Gauge(name, help, label_names))
+
+    def histogram(self, name, help, label_names=(), buckets=default_buckets):
+        return self.register(Histogram(name, help, label_names, buckets))
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        for collector in self.collectors:
+            collector()
+
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {format_value(value)}')
+        lines.append('')
+        return '\n'.join(lines)
+
+
+
+# Request Instrumentation
+class RequestTimer:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.bytes_out = 0
+
+    def add(self, stage_name, elapsed):
+        stages = self.stages
+        stages[stage_name] = stages.get(stage_name, 0.0) + elapsed
+
+
+class StageTimer:
+    '''
+    Context manager adding the time spent in its block to the given stage of the current request (if any).
+    '''
+
+    def __init__(self, stage_name):
+        self.stage_name = stage_name
+
+    def __enter__(self):
+        self.timer = getattr(_local, 'timer', None)
+        if self.timer:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        timer = self.timer
+        if timer:
+            timer.add(self.stage_name, time.perf_counter() - self.start)
+
+
+def stage(stage_name):
+    return StageTimer(stage_name)
+
+def current_timer():
+    return getattr(_local, 'timer', None)
+
+
+class RequestMetrics:
+    '''
+    Per-route request metrics: total latency, time per stage (parse, service, render, write), status codes and bytes
+    transferred.
+    '''
+
+    def __init__(self, registry):
+        self.duration = registry.histogram('taskwebapp_request_duration_seconds', 'Total request handling time.', ('route', 'method'))
+        self.stage_duration = registry.histogram('taskwebapp_request_stage_seconds', 'Time spent per request stage.', ('route', 'stage'))
+        self.requests = registry.counter('taskwebapp_requests_total', 'Requests handled.', ('route', 'method', 'status'))
+        self.bytes_in = registry.counter('taskwebapp_request_bytes_received_total', 'Request body bytes received.', ('route',))
+        self.bytes_out = registry.counter('taskwebapp_response_bytes_sent_total', 'Response bytes sent (including headers).', ('route',))
+
+    def begin(self):
+        timer = _local.timer = RequestTimer()
+        return timer
+
+    def end(self, timer, route, method, status, bytes_in):
+        _local.timer = None
+        elapsed = time.perf_counter() - timer.start
+
+        self.duration.observe((route, method), elapsed)
+        for stage_name, stage_elapsed in timer.stages.items():
+            self.stage_duration.observe((route, stage_name), stage_elapsed)
+        self.requests.inc((route, method, str(status)))
+        if bytes_in:
+            self.bytes_in.inc((route,), bytes_in)
+        self.bytes_out.inc((route,), timer.bytes_out)
+
+
+class MeteredWriter:
+    '''
+    Wraps a response stream, attributing write time and bytes written to the current request.
+    '''
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, data):
+        timer = getattr(_local, 'timer', None)
+        if not timer:
+            return self.wfile.write(data)
+
+        start = time.perf_counter()
+        result = self.wfile.write(data)
+        timer.add('write', time.perf_counter() - start)
+        timer.bytes_out += len(data)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.wfile, name)
+
+
+class StageTimedProxy:
+    '''
+    Wraps an object (e.g. a service), attributing time spent in its methods to the given stage of the current request.
+    '''
+
+    def __init__(self, target, stage_name):
+        self._target = target
+        self._stage_name = stage_name
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not callable(value):
+            return value
+
+        stage_name = self._stage_name
+        def timed(*args, **kwargs):
+            with StageTimer(stage_name):
+                return value(*args, **kwargs)
+        return timed
+
+
+def add_cache_collector(registry, caches):
+    '''
+    caches (dict[str] = LRUCache|TaskCache): Caches to report, by name.
+
+    Exports statistics of the given caches as gauges labelled by cache name.
+    '''
+
+    metrics = {}
+    for stat in ('entries', 'cost'):
+        metrics[stat] = registry.gauge(f'taskwebapp_cache_{stat}', f'Cache statistic: {stat}.', ('cache',))
+    for stat in ('hits', 'misses', 'evictions', 'stale'):
+        metrics[stat] = registry.collected_counter(f'taskwebapp_cache_{stat}_total', f'Cache statistic: {stat}.', ('cache',))
+
+    def collect():
+        for cache_name, cache in caches.items():
+            for stat, value in cache.stats().items():
+                metrics[stat].set((cache_name,), value)
+
+    registry.add_collector(collect)
+
+
+def add_pool_collector(registry, pool):
+    '''
+    pool (ConnectionPool): Connection pool to report
+
+    Exports the number of idle connections and the number of connections created and reused.
+    '''
+
+    metrics = {'idle': registry.gauge('taskwebapp_db_pool_idle', 'Connection pool statistic: idle.')}
+    for stat in ('created', 'reused'):
+        metrics[stat] = registry.collected_counter(f'taskwebapp_db_pool_{stat}_total', f'Connection pool statistic: {stat}.')
+
+    def collect():
+        for stat, value in pool.stats().items():
+            metrics[stat].set((), value)
+
+    registry.add_collector(collect)
+
+
+def add_event_collector(registry, event_bus, dispatcher):
+    '''
+    event_bus (EventBus): Event bus to report
+    dispatcher (EventStreamDispatcher): Dispatcher serving the bus's subscribers
+
+    Exports the number of subscribers and attached event stream clients, and the number of events published and
+    dropped (queued events discarded for subscribers that fell behind).
+    '''
+
+    subscribers = registry.gauge('taskwebapp_event_subscribers', 'Current event bus subscribers.')
+    clients = registry.gauge('taskwebapp_event_stream_clients', 'Event stream connections held by the dispatcher.')
+    published = registry.collected_counter('taskwebapp_events_published_total', 'Events published since start.')
+    dropped = registry.collected_counter('taskwebapp_events_dropped_total', 'Events dropped for subscribers that fell behind.')
+
+    def collect():
+        stats = event_bus.stats()
+        subscribers.set((), stats['subscribers'])
+        published.set((), stats['published'])
+        dropped.set((), stats['dropped'])
+        clients.set((), dispatcher.stats()['clients'])
+
+    registry.add_collector(collect)
+
+
+def add_job_collector(registry, job_service, job_runner):
+    '''
+    job_service (JobService): Job queue to report
+    job_runner (JobRunner): Runner working off the queue
+
+    Exports the number of queued jobs by state, and the number of jobs the runner completed, scheduled for retry and
+    gave up on.
+    '''
+
+    jobs = registry.gauge('taskwebapp_jobs', 'Queued background jobs.', ('state',))
+    counters = {}
+    for stat in ('completed', 'retried', 'failed'):
+        counters[stat] = registry.collected_counter(f'taskwebapp_jobs_{stat}_total', f'Background jobs {stat} since start.')
+
+    def collect():
+        for state, count in job_service.stats().items():
+            jobs.set((state,), count)
+        for stat, value in job_runner.stats().items():
+            counters[stat].set((), value)
+
+    registry.add_collector(collect)
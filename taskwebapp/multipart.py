@@ -426,6 +426,8 @@ class MultipartLexer:
                                         else:
                                             self.la_token = self.boundary_token
                                             return self.boundary_token
+                                else:
+                                    state = 1
                             except UnicodeError:
                                 state = 1
                     else:
@@ -540,10 +542,12 @@ class MultipartBody:
 
 class MultipartParser:
 
-    def __init__(self, lexer, form_charset):
+    def __init__(self, lexer, form_charset, temp_dir=None):
         self.lexer = lexer
         
         self.form_charset = form_charset
+        # Directory uploaded files are written to (default: the system's temporary directory).
+        self.temp_dir = temp_dir
         self.file_registry = set()
         
     
@@ -597,7 +601,7 @@ class MultipartParser:
         
         # Read Body
         if headers['Content-Disposition'].filename:
-            tf = tempfile.mkstemp()
+            tf = tempfile.mkstemp(dir=self.temp_dir)
             self.file_registry.add(tf)
             f = tf[1]
             
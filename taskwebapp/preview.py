@@ -0,0 +1,535 @@
+'''
+Preview (thumbnail) generation for image attachments.
+
+PNG (non-interlaced) and GIF (first frame) images are decoded in pure Python, up to max_pixels; decoding takes one to
+three seconds per megapixel (Paeth-filtered RGBA PNGs being the slowest), so previews are normally generated by a
+background job (see AttachmentService.process_previews).
+If Pillow is installed, it is used instead, for all of the formats in pillow_content_types and without the size limit
+(beyond Pillow's own decompression bomb check). Previews fit within a size x size box, keeping the aspect ratio; images
+are never enlarged.
+'''
+
+# Imports
+# Standard
+import io
+import zlib
+import struct
+import importlib.util
+
+
+# Definitions
+# Preview sizes (pixels) offered; each is generated for every previewable attachment.
+preview_sizes = (128, 256)
+
+native_content_types = {'image/png', 'image/gif'}
+pillow_content_types = {'image/png', 'image/gif', 'image/jpeg', 'image/webp', 'image/bmp', 'image/tiff'}
+
+png_signature = b'\x89PNG\r\n\x1a\n'
+
+# Source pixels averaged per preview pixel along each axis; larger boxes are sampled at this many evenly spaced points.
+max_samples = 4
+
+
+
+class PreviewGenerator:
+
+    def __init__(self, sizes=preview_sizes, max_pixels=4000000, use_pillow=True):
+        '''
+        sizes (seq[int]): Preview sizes to generate
+        max_pixels (int): Largest image (width x height) previewed without Pillow
+        use_pillow (bool): Whether to use Pillow if installed
+        '''
+
+        self.sizes = tuple(sorted(sizes))
+        self.max_pixels = max_pixels
+        # Only looked up here; Pillow itself is imported on first use.
+        self.use_pillow = use_pillow and importlib.util.find_spec('PIL') is not None
+        self.content_types = pillow_content_types if self.use_pillow else native_content_types
+
+    def supports(self, mime_type):
+        return bool(mime_type) and mime_type.split(';', 1)[0].strip().lower() in self.content_types
+
+    def generate(self, content, mime_type):
+        '''
+        content (bytes): Image
+        mime_type (str): Content type of the image
+
+        returns dict[int] = (str, bytes): Content type and content of the preview, by size; None if the image is not
+        supported or cannot be decoded.
+        '''
+
+        if not self.supports(mime_type):
+            return None
+
+        if self.use_pillow:
+            return pillow_previews(content, self.sizes)
+
+        try:
+            if content.startswith(png_signature):
+                image = decode_png(content, self.max_pixels)
+            elif content[:6] in (b'GIF87a', b'GIF89a'):
+                image = decode_gif(content, self.max_pixels)
+            else:
+                return None
+        except (ValueError, IndexError, struct.error, zlib.error):
+            return None
+        if not image:
+            return None
+
+        result = {}
+        for size in reversed(self.sizes):
+            # Smaller previews are scaled from the next larger one.
+            image = scale(image, size)
+            result[size] = ('image/png', encode_png(image))
+        return result
+
+
+
+class Image:
+    '''
+    Decoded image: rows is an iterable of width x height rows, consumed once, and pixel(row, x) returns the
+    (r, g, b, a) values of a row's pixel.
+    '''
+
+    __slots__ = ('width', 'height', 'rows', 'pixel')
+
+    def __init__(self, width, height, rows, pixel):
+        self.width = width
+        self.height = height
+        self.rows = rows
+        self.pixel = pixel
+
+
+def rgba_pixel(row, x):
+    return row[4 * x:4 * x + 4]
+
+
+def sample_positions(source_length, length):
+    '''
+    returns list[(int, int)]: (target index, source index) pairs; up to max_samples source indices per target index,
+    evenly spaced across the source range the target index covers.
+    '''
+
+    result = []
+    for i in range(length):
+        start = i * source_length / length
+        box = source_length / length
+        count = min(max_samples, max(1, int(box)))
+        seen = set()
+        for j in range(count):
+            s = min(source_length - 1, int(start + (j + 0.5) * box / count))
+            if s not in seen:
+                seen.add(s)
+                result.append((i, s))
+    return result
+
+
+def scale(image, size):
+    '''
+    returns Image: image scaled to fit within size x size pixels (if larger), as RGBA rows. Each pixel is the average of
+    the source pixels sampled for it, weighted by alpha.
+    '''
+
+    scale_factor = min(1.0, size / max(image.width, image.height))
+    width = max(1, round(image.width * scale_factor))
+    height = max(1, round(image.height * scale_factor))
+
+    columns = sample_positions(image.width, width)
+    rows_by_y = {}
+    for i, y in sample_positions(image.height, height):
+        rows_by_y[y] = i
+
+    # Per target pixel: alpha-weighted sums of r, g and b, the sum of alpha and the number of samples.
+    sums = [[0] * (5 * width) for i in range(height)]
+    pixel = image.pixel
+    for y, row in enumerate(image.rows):
+        i = rows_by_y.get(y)
+        if i is None:
+            continue
+        target = sums[i]
+        for j, x in columns:
+            r, g, b, a = pixel(row, x)
+            k = 5 * j
+            target[k] += r * a
+            target[k + 1] += g * a
+            target[k + 2] += b * a
+            target[k + 3] += a
+            target[k + 4] += 1
+
+    result = []
+    for target in sums:
+        row = bytearray(4 * width)
+        for j in range(width):
+            k = 5 * j
+            alpha = target[k + 3]
+            if alpha:
+                row[4 * j] = target[k] // alpha
+                row[4 * j + 1] = target[k + 1] // alpha
+                row[4 * j + 2] = target[k + 2] // alpha
+                row[4 * j + 3] = alpha // target[k + 4]
+        result.append(row)
+
+    return Image(width, height, result, rgba_pixel)
+
+
+def encode_png(image):
+    '''
+    image (Image): Image with RGBA rows, as returned by scale
+
+    returns bytes: PNG encoding of the image; RGB if all pixels are opaque.
+    '''
+
+    width = image.width
+    rows = image.rows
+    opaque = b'\xff' * width
+    alpha = any(row[3::4] != opaque for row in rows)
+
+    raw = bytearray()
+    for row in rows:
+        raw.append(0)
+        if alpha:
+            raw += row
+        else:
+            rgb = bytearray(3 * width)
+            rgb[0::3] = row[0::4]
+            rgb[1::3] = row[1::4]
+            rgb[2::3] = row[2::4]
+            raw += rgb
+
+    return png_signature + png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, image.height, 8, 6 if alpha else 2, 0, 0, 0)) \
+            + png_chunk(b'IDAT', zlib.compress(bytes(raw), 9)) + png_chunk(b'IEND', b'')
+
+
+def png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+# PNG
+png_channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+def decode_png(content, max_pixels):
+    '''
+    returns Image: The decoded image; None for interlaced images and images larger than max_pixels. Raises ValueError
+    (or zlib.error) for malformed images.
+    '''
+
+    pos = len(png_signature)
+    header = None
+    palette = None
+    transparency = None
+    data = []
+    while pos < len(content):
+        length, chunk_type = struct.unpack_from('>I4s', content, pos)
+        chunk = content[pos + 8:pos + 8 + length]
+        pos += length + 12
+        if chunk_type == b'IHDR':
+            header = struct.unpack('>IIBBBBB', chunk)
+        elif chunk_type == b'PLTE':
+            palette = chunk
+        elif chunk_type == b'tRNS':
+            transparency = chunk
+        elif chunk_type == b'IDAT':
+            data.append(chunk)
+        elif chunk_type == b'IEND':
+            break
+
+    if not header:
+        raise ValueError('Missing IHDR chunk')
+    width, height, depth, color_type, compression, filter_method, interlace = header
+    if color_type not in png_channels or depth not in (1, 2, 4, 8, 16) or compression or filter_method:
+        raise ValueError('Unsupported PNG format')
+    if interlace or width * height > max_pixels:
+        return None
+
+    channels = png_channels[color_type]
+    stride = (width * channels * depth + 7) // 8
+    bpp = max(1, channels * depth // 8)
+    # Decompressed no further than the header's dimensions need; the data may expand far beyond them.
+    raw = zlib.decompressobj().decompress(b''.join(data), (stride + 1) * height)
+    if len(raw) < (stride + 1) * height:
+        raise ValueError('Truncated image data')
+
+    return Image(width, height, png_rows(raw, height, stride, bpp),
+            png_pixel(color_type, depth, palette, transparency))
+
+
+def png_rows(raw, height, stride, bpp):
+    prev = bytearray(stride)
+    pos = 0
+    for y in range(height):
+        filter_type = raw[pos]
+        line = bytearray(raw[pos + 1:pos + 1 + stride])
+        pos += stride + 1
+        unfilter(filter_type, line, prev, bpp)
+        yield line
+        prev = line
+
+
+def unfilter(filter_type, line, prev, bpp):
+    n = len(line)
+    if filter_type == 0:
+        pass
+    elif filter_type == 1:
+        for i in range(bpp, n):
+            line[i] = (line[i] + line[i - bpp]) & 0xff
+    elif filter_type == 2:
+        line[:] = add_bytes(line, prev)
+    elif filter_type == 3:
+        for i in range(bpp):
+            line[i] = (line[i] + (prev[i] >> 1)) & 0xff
+        for i in range(bpp, n):
+            line[i] = (line[i] + ((line[i - bpp] + prev[i]) >> 1)) & 0xff
+    elif filter_type == 4:
+        for i in range(bpp):
+            line[i] = (line[i] + prev[i]) & 0xff
+        for i in range(bpp, n):
+            a = line[i - bpp]
+            b = prev[i]
+            c = prev[i - bpp]
+            pa = abs(b - c)
+            pb = abs(a - c)
+            pc = abs(a + b - 2 * c)
+            if pa <= pb and pa <= pc:
+                line[i] = (line[i] + a) & 0xff
+            elif pb <= pc:
+                line[i] = (line[i] + b) & 0xff
+            else:
+                line[i] = (line[i] + c) & 0xff
+    else:
+        raise ValueError(f'Invalid filter type: {filter_type}')
+
+
+byte_masks = {}
+
+def add_bytes(x, y):
+    '''
+    returns bytes: Bytewise sum (modulo 256) of x and y, computed on the buffers as integers rather than byte by byte.
+    '''
+
+    n = len(x)
+    masks = byte_masks.get(n)
+    if not masks:
+        masks = byte_masks[n] = (int.from_bytes(b'\x7f' * n, 'little'), int.from_bytes(b'\x80' * n, 'little'))
+    low, high = masks
+    a = int.from_bytes(x, 'little')
+    b = int.from_bytes(y, 'little')
+    return (((a & low) + (b & low)) ^ ((a ^ b) & high)).to_bytes(n, 'little')
+
+
+def png_pixel(color_type, depth, palette, transparency):
+    '''
+    returns callable: pixel(row, x) function (see Image) for unfiltered rows of the given format. Samples of 16 bits are
+    reduced to their high byte.
+    '''
+
+    if color_type == 3:
+        if not palette:
+            raise ValueError('Missing PLTE chunk')
+        alphas = transparency or b''
+        colors = [(palette[3 * i], palette[3 * i + 1], palette[3 * i + 2], alphas[i] if i < len(alphas) else 255)
+                for i in range(len(palette) // 3)]
+        colors += [(0, 0, 0, 255)] * (256 - len(colors))
+        if depth == 8:
+            return lambda row, x: colors[row[x]]
+        index = packed_sample(depth)
+        return lambda row, x: colors[index(row, x)]
+
+    if depth < 8:
+        index = packed_sample(depth)
+        maximum = (1 << depth) - 1
+        key = struct.unpack('>H', transparency[:2])[0] if transparency and color_type == 0 else None
+
+        def gray(row, x):
+            v = index(row, x)
+            return (v * 255 // maximum,) * 3 + (0 if v == key else 255,)
+        return gray
+
+    # 8 or 16 bits per sample; a color key (tRNS) is only honored for 8 bits.
+    size = depth // 8
+    step = png_channels[color_type] * size
+    key = None
+    if transparency and depth == 8:
+        key = bytes(transparency[1::2]) if color_type in (0, 2) else None
+
+    if color_type == 0:
+        def gray(row, x):
+            v = row[step * x]
+            return (v, v, v, 0 if key is not None and key[0] == v else 255)
+        return gray
+    if color_type == 4:
+        def gray_alpha(row, x):
+            v = row[step * x]
+            return (v, v, v, row[step * x + size])
+        return gray_alpha
+    if color_type == 2:
+        def rgb(row, x):
+            i = step * x
+            r, g, b = row[i], row[i + size], row[i + 2 * size]
+            return (r, g, b, 0 if key is not None and key == bytes((r, g, b)) else 255)
+        return rgb
+
+    def rgba(row, x):
+        i = step * x
+        return (row[i], row[i + size], row[i + 2 * size], row[i + 3 * size])
+    return rgba
+
+
+def packed_sample(depth):
+    per_byte = 8 // depth
+    maximum = (1 << depth) - 1
+    return lambda row, x: (row[x // per_byte] >> (8 - depth * (x % per_byte + 1))) & maximum
+
+
+# GIF
+def decode_gif(content, max_pixels):
+    '''
+    returns Image: The first frame of the GIF; None if it is larger than max_pixels. Raises ValueError (or IndexError)
+    for malformed images.
+    '''
+
+    flags = content[10]
+    pos = 13
+    palette = None
+    if flags & 0x80:
+        size = 3 * (2 << (flags & 0x07))
+        palette = content[pos:pos + size]
+        pos += size
+
+    transparent = None
+    while True:
+        block = content[pos]
+        pos += 1
+        if block == 0x21:
+            # Extension; only the graphic control extension's transparent color index is of interest.
+            label = content[pos]
+            pos += 1
+            if label == 0xf9 and content[pos] >= 4 and content[pos + 1] & 0x01:
+                transparent = content[pos + 4]
+            while content[pos]:
+                pos += content[pos] + 1
+            pos += 1
+        elif block == 0x2c:
+            width, height, frame_flags = struct.unpack_from('<4xHHB', content, pos)
+            pos += 9
+            if frame_flags & 0x80:
+                size = 3 * (2 << (frame_flags & 0x07))
+                palette = content[pos:pos + size]
+                pos += size
+            break
+        else:
+            raise ValueError('No image in GIF')
+
+    if not palette:
+        raise ValueError('Missing color table')
+    if width * height > max_pixels:
+        return None
+
+    min_code_size = content[pos]
+    pos += 1
+    data = bytearray()
+    while content[pos]:
+        data += content[pos + 1:pos + 1 + content[pos]]
+        pos += content[pos] + 1
+
+    pixels = lzw_decode(data, min_code_size, width * height)
+    pixels += bytes(width * height - len(pixels))
+    rows = [pixels[y * width:(y + 1) * width] for y in range(height)]
+    if frame_flags & 0x40:
+        rows = deinterlace(rows)
+
+    colors = [(palette[3 * i], palette[3 * i + 1], palette[3 * i + 2], 0 if i == transparent else 255)
+            for i in range(len(palette) // 3)]
+    colors += [(0, 0, 0, 0)] * (256 - len(colors))
+    return Image(width, height, rows, lambda row, x: colors[row[x]])
+
+
+def deinterlace(rows):
+    result = [None] * len(rows)
+    source = iter(rows)
+    for start, step in ((0, 8), (4, 8), (2, 4), (1, 2)):
+        for y in range(start, len(rows), step):
+            result[y] = next(source)
+    return result
+
+
+def lzw_decode(data, min_code_size, max_length):
+    '''
+    returns bytearray: Color indices of the GIF image data; at most max_length.
+    '''
+
+    if not 2 <= min_code_size <= 11:
+        raise ValueError(f'Invalid LZW code size: {min_code_size}')
+    clear = 1 << min_code_size
+    end = clear + 1
+    initial = [bytes((i,)) for i in range(clear)] + [b'', b'']
+
+    table = list(initial)
+    code_size = min_code_size + 1
+    mask = (1 << code_size) - 1
+    prev = None
+    result = bytearray()
+    buffer = 0
+    bits = 0
+    for byte in data:
+        buffer |= byte << bits
+        bits += 8
+        while bits >= code_size:
+            code = buffer & mask
+            buffer >>= code_size
+            bits -= code_size
+
+            if code == clear:
+                table = list(initial)
+                code_size = min_code_size + 1
+                mask = (1 << code_size) - 1
+                prev = None
+                continue
+            if code == end:
+                return result[:max_length]
+
+            if code < len(table):
+                entry = table[code]
+                if prev is not None and len(table) < 4096:
+                    table.append(prev + entry[:1])
+            elif code == len(table) and prev is not None and len(table) < 4096:
+                entry = prev + prev[:1]
+                table.append(entry)
+            else:
+                raise ValueError(f'Invalid LZW code: {code}')
+
+            result += entry
+            if len(result) >= max_length:
+                return result[:max_length]
+            prev = entry
+            if len(table) > mask and code_size < 12:
+                code_size += 1
+                mask = (1 << code_size) - 1
+
+    return result
+
+
+# Pillow
+def pillow_previews(content, sizes):
+    from PIL import Image as PillowImage, ImageOps
+
+    try:
+        with PillowImage.open(io.BytesIO(content)) as image:
+            # Lets JPEG decode at a reduced scale; a no-op for other formats.
+            image.draft('RGB', (max(sizes), max(sizes)))
+            image = ImageOps.exif_transpose(image)
+            alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+            image = image.convert('RGBA' if alpha else 'RGB')
+
+            result = {}
+            for size in sorted(sizes, reverse=True):
+                image.thumbnail((size, size), PillowImage.LANCZOS)
+                out = io.BytesIO()
+                if alpha:
+                    image.save(out, 'PNG', optimize=True)
+                    result[size] = ('image/png', out.getvalue())
+                else:
+                    image.save(out, 'JPEG', quality=85)
+                    result[size] = ('image/jpeg', out.getvalue())
+            return result
+    except (OSError, ValueError, SyntaxError, PillowImage.DecompressionBombError):
+        return None
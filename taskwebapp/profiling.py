@@ -0,0 +1,109 @@
+# Imports
+# Standard
+import os
+import os.path
+import sys
+import time
+import cProfile
+
+from datetime import datetime
+from threading import Thread, Lock, get_ident
+
+
+# Definitions
+class ProfilerBusyException(Exception):
+    pass
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class SamplingProfiler:
+    '''
+    Periodically samples the stacks of all threads (other than the sampling thread) via sys._current_frames and
+    aggregates them as collapsed stacks ("root;...;leaf count" lines), the input format of flame graph tools. Only one
+    profiling session can run at a time.
+    '''
+
+    def __init__(self, output_dir, interval_s=0.005, max_duration_s=60.0):
+        self.output_dir = output_dir
+        self.interval_s = interval_s
+        self.max_duration_s = max_duration_s
+        self.lock = Lock()
+
+    def profile(self, duration_s, interval_s=None):
+        '''
+        duration_s (float): Seconds to sample for (capped at max_duration_s)
+        interval_s (float): Seconds between samples; defaults to the profiler's interval
+
+        returns (str, str): Collapsed stacks and the path of the file they were written to.
+        '''
+
+        if not self.lock.acquire(blocking=False):
+            raise ProfilerBusyException()
+
+        try:
+            stacks = self.__sample(min(duration_s, self.max_duration_s), interval_s or self.interval_s)
+        finally:
+            self.lock.release()
+
+        text = ''.join(f'{stack} {count}\n' for stack, count in sorted(stacks.items(), key=lambda v: -v[1]))
+        path = self.output_path('collapsed')
+        with open(path, 'w') as f:
+            f.write(text)
+        return text, path
+
+    def profile_async(self, duration_s):
+        '''
+        Profiles in a background thread, printing the output path once done (e.g. from a signal handler).
+        '''
+
+        def run():
+            try:
+                print('Profile written:', self.profile(duration_s)[1])
+            except ProfilerBusyException:
+                print('Profiler already running.')
+
+        Thread(target=run, daemon=True).start()
+
+    def profile_call(self, label, fn, *args, **kwargs):
+        '''
+        Runs fn under cProfile, writing the stats to the output directory. Returns fn's result.
+        '''
+
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(fn, *args, **kwargs)
+        finally:
+            path = self.output_path('prof', label)
+            profiler.dump_stats(path)
+            print('Request profile written:', path)
+
+    def output_path(self, suffix, label='profile'):
+        os.makedirs(self.output_dir, exist_ok=True)
+        return os.path.join(self.output_dir, f'{label}-{datetime.now().strftime("%Y%m%d-%H%M%S-%f")}.{suffix}')
+
+    def __sample(self, duration_s, interval_s):
+        own_ident = get_ident()
+        stacks = {}
+        end = time.monotonic() + duration_s
+
+        while time.monotonic() < end:
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+
+                labels = []
+                while frame is not None:
+                    labels.append(frame_label(frame))
+                    frame = frame.f_back
+                labels.reverse()
+
+                stack = ';'.join(labels)
+                stacks[stack] = stacks.get(stack, 0) + 1
+
+            time.sleep(interval_s)
+
+        return stacks
@@ -3,7 +3,7 @@
 from urllib.parse import urlparse, parse_qsl
 
 # User
-from taskwebapp.multipart import MultipartStream, MultipartLexer, MultipartParser
+from taskwebapp.metrics import stage
 
 
 # Definitions
@@ -115,6 +115,41 @@ content_type_suffix_mapping = {
     '.7z': 'application/x-7z-compressed'
 }
 
+# Leading bytes identifying common binary formats, as content type matched to (offset, bytes) pairs; checked in order.
+content_type_signatures = [
+    ('image/png', ((0, b'\x89PNG\r\n\x1a\n'),)),
+    ('image/jpeg', ((0, b'\xff\xd8\xff'),)),
+    ('image/gif', ((0, b'GIF87a'),)),
+    ('image/gif', ((0, b'GIF89a'),)),
+    ('image/webp', ((0, b'RIFF'), (8, b'WEBP'))),
+    ('image/tiff', ((0, b'II*\x00'),)),
+    ('image/tiff', ((0, b'MM\x00*'),)),
+    ('audio/wav', ((0, b'RIFF'), (8, b'WAVE'))),
+    ('video/x-msvideo', ((0, b'RIFF'), (8, b'AVI '))),
+    ('audio/mpeg', ((0, b'ID3'),)),
+    ('video/webm', ((0, b'\x1aE\xdf\xa3'),)),
+    ('application/ogg', ((0, b'OggS'),)),
+    ('application/pdf', ((0, b'%PDF-'),)),
+    ('application/zip', ((0, b'PK\x03\x04'),)),
+    ('application/gzip', ((0, b'\x1f\x8b\x08'),)),
+    ('application/x-bzip2', ((0, b'BZh'),)),
+    ('application/x-7z-compressed', ((0, b'7z\xbc\xaf\x27\x1c'),)),
+    ('application/vnd.rar', ((0, b'Rar!\x1a\x07'),)),
+    ('font/woff', ((0, b'wOFF'),)),
+    ('font/woff2', ((0, b'wOF2'),))
+]
+
+# Bytes needed by sniff_content_type.
+sniff_length = 16
+
+# Signatures shared by several formats (e.g. docx, epub and jar files are zip archives); a declared type is kept for
+# these, unless it is generic.
+container_content_types = {
+    'application/zip',
+    'application/ogg',
+    'video/webm'
+}
+
 
 # Functions
 def get_content_type(ext, addendum=None, var_text_enc='utf-8'):
@@ -137,22 +172,47 @@ def get_content_type(ext, addendum=None, var_text_enc='utf-8'):
 def content_type_value(type, charset):
     return f'{type}; charset={charset}'
 
+def sniff_content_type(head, declared):
+    '''
+    head (bytes): Leading bytes of the content; at least sniff_length, unless the content is shorter
+    declared (str): Content type given by the client
+    
+    returns str: Content type identified by the content's signature, or declared if the content has no known signature
+    or declared is (a more specific variant of) the identified type.
+    '''
+    
+    declared_type = declared.split(';', 1)[0].strip().lower()
+    for type, signature in content_type_signatures:
+        if all(head.startswith(value, offset) for offset, value in signature):
+            if type == declared_type:
+                return declared
+            if type in container_content_types and declared_type != 'application/octet-stream' \
+                    and declared_type not in variable_text_encodings:
+                return declared
+            return type
+    
+    return declared
+
 def write_chunked(generator, wfile, charset):
     for part in generator:
         data = part.encode(charset)
+        if not data:
+            # A zero-length chunk would terminate the body.
+            continue
         wfile.write(f'{len(data):02X}\r\n'.encode(charset))
         wfile.write(data)
         wfile.write('\r\n'.encode(charset))
     
-    wfile.write('0\r\n'.encode(charset))
+    wfile.write('0\r\n\r\n'.encode(charset))
 
 
 
 # Classes
 class RequestProcessor:
 
-    def __init__(self, handler):
+    def __init__(self, handler, upload_dir=None):
         self.handler = handler
+        self.upload_dir = upload_dir
         self.multipart_parser = None
         self.parameters = None
         self.parts = None
@@ -177,13 +237,16 @@ class RequestProcessor:
         headers = handler.headers
         content_type = headers.get_content_type()
         if content_type == 'application/x-www-form-urlencoded':
-            for name, value in parse_qsl(handler.rfile.read()):
+            for name, value in parse_qsl(handler.rfile.read(int(headers.get('Content-Length') or 0)).decode('utf-8')):
                 parameters.add(name, value)
         
         elif content_type == 'multipart/form-data':
+            # Imported on first use; most requests carry no multipart body.
+            from taskwebapp.multipart import MultipartStream, MultipartLexer, MultipartParser
+            
             stream = MultipartStream(handler.rfile, int(handler.headers['Content-Length']))
             lexer = MultipartLexer(stream, handler.headers.get_boundary())
-            parser = self.multipart_parser = MultipartParser(lexer, 'utf-8')
+            parser = self.multipart_parser = MultipartParser(lexer, 'utf-8', self.upload_dir)
             parts = self.parts = RequestParameterData()
             
             for part in parser.multipart():
@@ -199,7 +262,8 @@ class RequestProcessor:
 
     
     def __enter__(self):
-        self.process_parameters()
+        with stage('parse'):
+            self.process_parameters()
         return self
     
     def __exit__(self, exc_typ, exc_value, traceback):
@@ -1,35 +1,54 @@
 # Imports
 
 # Standard
+import os
 import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
 import sqlite3
 
 from datetime import datetime, timedelta
 from enum import Enum
+from threading import Lock
 
 # User
-from taskwebapp.domain.attachment import AttachmentReference, Attachment
-from taskwebapp.domain.task import TaskReference, TaskStatus, Task, TaskNote, TaskDashboardData
+import taskwebapp.service.tracing as tracing
+import taskwebapp.domain.task.codec as codec
+
+from taskwebapp.domain.attachment import AttachmentReference, Attachment, AttachmentPreview
+from taskwebapp.domain.job import JobState, Job
+from taskwebapp.domain.task import TaskReference, TaskStatus, Task, TaskNote, TaskDashboardData, UNCHANGED, \
+    TaskModifiedException
 from taskwebapp.domain.task.search import TaskSearchLogicalOp, TaskSearchStrOp, TaskSearchNumOp, TaskSearchField, \
     TaskSearchSimpleExpr, TaskSearchIsAnyExpr, TaskSearchExpr, TaskSearchGroupExpr
+from taskwebapp.requestutils import sniff_content_type, sniff_length
 
 
 
 like_escape_pattern = re.compile('([_%+])')
+
+statuses_by_id = dict((s.value, s) for s in TaskStatus)
 def like_escape(val, case_sensitive=False):
-    result = like_escape_pattern.sub('+\1', val)
+    result = like_escape_pattern.sub(r'+\1', val)
     return result if case_sensitive else result.casefold()
 
 
 
-schema_version = 2
+schema_version = 7
 
-def sqlite3_to_date(v):
-    if v is None:
-        return None
-    if not isinstance(v, str):
-        raise ValueError(f'TO_DATE: Expected str, got {type(v)}: {v}')
-    return v[0:10]
+# Timestamps are stored as integer microseconds since 1970-01-01, in the application's (naive, local) time, and converted
+# explicitly where they are bound or read.
+epoch = datetime(1970, 1, 1)
+one_microsecond = timedelta(microseconds=1)
+
+def to_epoch(value):
+    return (value - epoch) // one_microsecond if value is not None else None
+
+def from_epoch(value):
+    return epoch + timedelta(microseconds=value) if value is not None else None
 
 def sqlite3_casefold(v):
     if v is None:
@@ -38,12 +57,30 @@ def sqlite3_casefold(v):
         return v
     return v.casefold()
 
-def get_connection(db_fname):
-    connection = sqlite3.connect(db_fname, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
-    connection.row_factory = sqlite3.Row
-    connection.create_function('TO_DATE', 1, sqlite3_to_date)
+def sqlite3_sha256(v):
+    if v is None:
+        return None
+    return hashlib.sha256(v.encode('utf-8') if isinstance(v, str) else v).hexdigest()
+
+# Database files whose schema this process has already checked (and migrated); connections to them skip the check.
+checked_schemas = set()
+
+def migrate(db_fname):
+    '''
+    Checks the schema of the given database, migrating it to the current version if needed.
+    '''
+    
+    get_connection(db_fname).close()
+
+def get_connection(db_fname, cached_statements=128, check_same_thread=True):
+    # Rows are plain tuples; callers unpack them in the order of their SELECT lists.
+    connection = sqlite3.connect(db_fname, cached_statements=cached_statements, check_same_thread=check_same_thread,
+            factory=tracing.TracingConnection if tracing.tracer else sqlite3.Connection)
     connection.create_function('CASEFOLD', 1, sqlite3_casefold)
     
+    if db_fname in checked_schemas:
+        return connection
+    
     try:
         c = connection.cursor()
         
@@ -51,8 +88,18 @@ def get_connection(db_fname):
         current_version = next(c)[0]
         if schema_version == current_version:
             c.close()
+            remember_schema(db_fname)
             return connection
         
+        # Database-level settings; must precede the first write of the migration.
+        if current_version < 1:
+            # Only takes effect before the first table is created; existing databases are converted with
+            # MaintenanceService.enable_incremental_vacuum.
+            c.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        
+        if current_version < 4:
+            c.execute('PRAGMA journal_mode = WAL')
+        
         if current_version < 1:
             # TaskStatus
             c.execute('''
@@ -176,30 +223,581 @@ def get_connection(db_fname):
               VALUES (?, ?)
             ''', [(v.value, v.name) for v in (TaskStatus.IN_PROGRESS, TaskStatus.CANCELED)])
         
+        if current_version < 3:
+            # Reverse lookups for orphan cleanup.
+            c.execute('''
+            CREATE INDEX IXTSKNT1
+              ON TASK_NOTE (NOTE_ID)
+            ''')
+            
+            c.execute('''
+            CREATE INDEX IXNTATT1
+              ON NOTE_ATTACHMENT (ATTACHMENT_ID)
+            ''')
+        
+        if current_version < 5:
+            # ISO text timestamps (as written by the sqlite3 default adapters) to integer epoch microseconds.
+            # strftime('%s') reads them as UTC, which matches the naive epoch used by to_epoch.
+            for table, column in (('TASK', 'DUE_TS'), ('TASK', 'MOD_TS'), ('NOTE', 'MOD_TS'), ('ATTACHMENT', 'CRTN_TS')):
+                c.execute(f'''
+                UPDATE {table}
+                  SET {column} = CAST(strftime('%s', {column}) AS INTEGER) * 1000000
+                        + CASE
+                            WHEN length({column}) > 20 THEN CAST(substr(substr({column}, 21) || '000000', 1, 6) AS INTEGER)
+                            ELSE 0
+                          END
+                  WHERE typeof({column}) = 'text'
+                ''')
+        
+        if current_version < 6:
+            # Rebuilds ATTACHMENT, which DDL statements alone would do outside of a transaction.
+            if not connection.in_transaction:
+                c.execute('BEGIN IMMEDIATE')
+            connection.create_function('SHA256', 1, sqlite3_sha256, deterministic=True)
+            
+            # Attachment content moves to ATTACHMENT_BLOB, stored once per distinct content (by SHA-256 hash). Attachments
+            # not yet processed by their store_attachment job have no hash, but the file they were spooled to.
+            c.execute('''
+            CREATE TABLE ATTACHMENT_V6 (
+              ATTACHMENT_ID INTEGER PRIMARY KEY
+              , ATTACHMENT_NM TEXT NOT NULL
+              , MIME_TYPE TEXT NOT NULL
+              , CONTENT_HASH TEXT
+              , CONTENT_SIZE INTEGER
+              , SPOOL_FNAME TEXT
+              , CRTN_TS TIMESTAMP NOT NULL
+            )
+            ''')
+            
+            c.execute('''
+            INSERT INTO ATTACHMENT_V6
+              (ATTACHMENT_ID, ATTACHMENT_NM, MIME_TYPE, CONTENT_HASH, CONTENT_SIZE, CRTN_TS)
+              SELECT
+                  ATTACHMENT_ID
+                  , ATTACHMENT_NM
+                  , MIME_TYPE
+                  , SHA256(CONTENT)
+                  , length(CONTENT)
+                  , CRTN_TS
+                FROM ATTACHMENT
+            ''')
+            
+            c.execute('''
+            CREATE TABLE ATTACHMENT_BLOB (
+              BLOB_ID INTEGER PRIMARY KEY
+              , CONTENT_HASH TEXT NOT NULL
+              , CONTENT BLOB NOT NULL
+              
+              , CONSTRAINT UATTBLB1
+                  UNIQUE (CONTENT_HASH)
+            )
+            ''')
+            
+            c.execute('''
+            INSERT INTO ATTACHMENT_BLOB
+              (CONTENT_HASH, CONTENT)
+              SELECT
+                  n.CONTENT_HASH
+                  , o.CONTENT
+                FROM ATTACHMENT_V6 n
+                JOIN ATTACHMENT o
+                  ON o.ATTACHMENT_ID = n.ATTACHMENT_ID
+                WHERE true
+              ON CONFLICT (CONTENT_HASH) DO NOTHING
+            ''')
+            
+            c.execute('DROP TABLE ATTACHMENT')
+            c.execute('ALTER TABLE ATTACHMENT_V6 RENAME TO ATTACHMENT')
+            
+            # Blob reference counting.
+            c.execute('''
+            CREATE INDEX IXATT1
+              ON ATTACHMENT (CONTENT_HASH)
+            ''')
+            
+            # Background jobs (see JobService)
+            c.execute('''
+            CREATE TABLE JOB (
+              JOB_ID INTEGER PRIMARY KEY
+              , JOB_TYPE TEXT NOT NULL
+              , PAYLOAD TEXT NOT NULL
+              , STATE_ID INTEGER NOT NULL
+              , ATTEMPTS INTEGER NOT NULL
+              , RUN_AFTER_TS TIMESTAMP NOT NULL
+              , LAST_ERROR TEXT
+              , CRTN_TS TIMESTAMP NOT NULL
+            )
+            ''')
+            
+            c.execute('''
+            CREATE INDEX IXJOB1
+              ON JOB (STATE_ID, RUN_AFTER_TS)
+            ''')
+        
+        if current_version < 7:
+            # Image previews (see AttachmentService.fetch_preview); rows without content record images that could not
+            # be previewed.
+            c.execute('''
+            CREATE TABLE ATTACHMENT_PREVIEW (
+              ATTACHMENT_ID INTEGER NOT NULL
+              , PREVIEW_SIZE INTEGER NOT NULL
+              , MIME_TYPE TEXT
+              , CONTENT BLOB
+              
+              , CONSTRAINT PKATTPRV
+                  PRIMARY KEY (ATTACHMENT_ID, PREVIEW_SIZE)
+              
+              , CONSTRAINT FKATTPRV1
+                  FOREIGN KEY (ATTACHMENT_ID)
+                  REFERENCES ATTACHMENT (ATTACHMENT_ID)
+            )
+            ''')
+        
         
         c.execute(f'PRAGMA user_version = {schema_version}')
         
         connection.commit()
         c.close()
+        remember_schema(db_fname)
         return connection
     except Exception as e:
         connection.rollback()
         connection.close()
         raise e
 
+def remember_schema(db_fname):
+    # In-memory databases are distinct per connection, so each needs its own check.
+    if db_fname != ':memory:' and not db_fname.startswith('file::memory:'):
+        checked_schemas.add(db_fname)
+
+
+
+
+class ConnectionPool:
+    '''
+    Keeps up to max_idle connections open between service calls, so compiled statements (up to cached_statements per
+    connection) and the schema check of get_connection carry over from one call to the next. Connections may be used
+    from any thread, but by only one at a time; statements should be canonical (e.g. IN lists bound through json_each)
+    for the statement cache to be effective.
+    '''
+    
+    def __init__(self, db_fname, max_idle=8, cached_statements=256):
+        self.db_fname = db_fname
+        self.max_idle = max_idle
+        self.cached_statements = cached_statements
+        self.idle = []
+        self.lock = Lock()
+        self.created = 0
+        self.reused = 0
+    
+    def acquire(self):
+        with self.lock:
+            if self.idle:
+                self.reused += 1
+                return self.idle.pop()
+            self.created += 1
+        
+        return get_connection(self.db_fname, self.cached_statements, check_same_thread=False)
+    
+    def release(self, connection):
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except sqlite3.Error:
+            connection.close()
+            return
+        
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(connection)
+                return
+        connection.close()
+    
+    def fill(self, count=None):
+        '''
+        count (int): Number of idle connections to have open; defaults to max_idle
+        
+        Opens connections until count are idle, e.g. to avoid connection setup on the first requests.
+        '''
+        
+        count = min(count or self.max_idle, self.max_idle)
+        with self.lock:
+            missing = count - len(self.idle)
+        
+        connections = []
+        for i in range(missing):
+            connection = get_connection(self.db_fname, self.cached_statements, check_same_thread=False)
+            # Reads the schema, which each connection otherwise does on its first statement.
+            connection.execute('SELECT count(*) FROM sqlite_master').fetchone()
+            connections.append(connection)
+        
+        with self.lock:
+            self.created += len(connections)
+        for connection in connections:
+            self.release(connection)
+    
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+    
+    def stats(self):
+        with self.lock:
+            return {'idle': len(self.idle), 'created': self.created, 'reused': self.reused}
+
+
+
+
+# RETURNING is available from SQLite 3.35; before that, IDs are derived from last_insert_rowid().
+supports_returning = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Bound parameters per statement; SQLite builds before 3.32 allow at most 999.
+max_insert_parameters = 999
+
+def insert_rows(c, table, columns, rows, max_bytes=16 * 1024 * 1024):
+    '''
+    c (Cursor): Cursor of the current (immediate) transaction
+    table (str): Table to insert into; its primary key must be a plain INTEGER PRIMARY KEY (rowid alias)
+    columns (seq[str]): Columns to insert
+    rows (iter[tuple]): Values, one tuple per row, in column order; consumed lazily, one statement's worth at a time
+    max_bytes (int): Approximate limit on the bytes of text and blob values bound to a single statement
+    
+    returns list[int]: IDs assigned to the given rows, in row order
+    
+    Inserts rows with multi-row INSERT statements; only when the parameter or byte limits are exceeded is more than one
+    statement used. Within a write transaction new rowids are allocated in ascending order (max + 1), so the returned IDs
+    are matched to rows by sorting them.
+    '''
+    
+    result = []
+    max_rows = max_insert_parameters // len(columns)
+    
+    chunk = []
+    chunk_bytes = 0
+    for row in rows:
+        row_bytes = sum(len(v) for v in row if isinstance(v, (str, bytes)))
+        if chunk and (len(chunk) >= max_rows or chunk_bytes + row_bytes > max_bytes):
+            result.extend(insert_chunk(c, table, columns, chunk))
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(row)
+        chunk_bytes += row_bytes
+    if chunk:
+        result.extend(insert_chunk(c, table, columns, chunk))
+    
+    return result
+
+def insert_chunk(c, table, columns, rows):
+    values = ', '.join(['(' + ', '.join('?' * len(columns)) + ')'] * len(rows))
+    sql = f'INSERT INTO {table} ({", ".join(columns)}) VALUES {values}'
+    params = [v for row in rows for v in row]
+    
+    if supports_returning:
+        c.execute(f'{sql} RETURNING rowid', params)
+        return sorted(r[0] for r in c)
+    
+    c.execute(sql, params)
+    c.execute('SELECT last_insert_rowid()')
+    last_id = next(c)[0]
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+def read_file(fname):
+    with open(fname, 'rb') as f:
+        return f.read()
+
+def remove_file(fname):
+    try:
+        os.unlink(fname)
+    except FileNotFoundError:
+        pass
+
+def inspect_file(fname, declared_type, chunk_size=1024 * 1024):
+    '''
+    fname (str): File to inspect
+    declared_type (str): Content type given for the file by the client
+    
+    returns (str, int, str): SHA-256 hash (hex digest) and size of the file's content, and its content type as sniffed
+    from its leading bytes (see requestutils.sniff_content_type); read in chunks of chunk_size bytes.
+    '''
+    
+    digest = hashlib.sha256()
+    size = 0
+    head = None
+    with open(fname, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if head is None:
+                head = chunk[:sniff_length]
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    
+    return digest.hexdigest(), size, sniff_content_type(head, declared_type)
+
+def store_blob(c, content_hash, fname):
+    '''
+    c (Cursor): Cursor of the current (immediate) transaction
+    content_hash (str): SHA-256 hash of the file's content, as returned by inspect_file
+    fname (str): File to store
+    
+    returns bool: Whether the content was stored; False if identical content already was.
+    '''
+    
+    c.execute('''
+    SELECT
+        EXISTS (
+            SELECT *
+              FROM ATTACHMENT_BLOB
+              WHERE CONTENT_HASH = ?
+        )
+    ''', (content_hash,))
+    if next(c)[0]:
+        return False
+    
+    c.execute('''
+    INSERT INTO ATTACHMENT_BLOB
+      (CONTENT_HASH, CONTENT)
+      VALUES (?, ?)
+    ''', (content_hash, read_file(fname)))
+    return True
+
+def insert_jobs(c, job_type, payloads):
+    '''
+    c (Cursor): Cursor of the current (immediate) transaction
+    job_type (str): Type of the jobs, as registered with JobRunner.add_handler
+    payloads (seq): JSON-compatible payloads, one per job
+    
+    returns list[int]: IDs of the queued jobs
+    
+    Queues jobs as part of the caller's transaction, so they are persisted if and only if the changes they follow up on
+    are.
+    '''
+    
+    now = to_epoch(datetime.now())
+    return insert_rows(c, 'JOB', ('JOB_TYPE', 'PAYLOAD', 'STATE_ID', 'ATTEMPTS', 'RUN_AFTER_TS', 'CRTN_TS'),
+            ((job_type, json.dumps(payload), JobState.READY.value, 0, now, now) for payload in payloads))
+
+
+def job_exists(c, job_type, payload):
+    '''
+    returns bool: Whether a job of the given type and payload is queued, running or has failed.
+    '''
+    
+    c.execute('''
+    SELECT
+        count(*)
+      FROM JOB
+      WHERE JOB_TYPE = ?
+        AND PAYLOAD = ?
+    ''', (job_type, json.dumps(payload)))
+    return next(c)[0] > 0
+
+
+def delete_orphans(c, note_ids=(), attachment_ids=()):
+    '''
+    c (Cursor): Cursor of the current transaction
+    note_ids (seq[int]): Candidate note IDs, e.g. notes detached from a task in the current transaction
+    attachment_ids (seq[int]): Candidate attachment IDs, e.g. attachments detached from a note in the current transaction
+    
+    Deletes the given notes if they no longer belong to a task, along with their attachments if those no longer belong to
+    any note. Deletes the given attachments if they no longer belong to any note, along with their previews, and their
+    content if no other attachment shares it. Only candidates are examined; orphans left behind by other means are removed by
+    MaintenanceService.sweep_orphans.
+    '''
+    
+    note_ids = json.dumps(list(note_ids))
+    attachment_ids = list(attachment_ids)
+    
+    c.execute('''
+    SELECT
+        ATTACHMENT_ID
+      FROM NOTE_ATTACHMENT
+      WHERE NOTE_ID IN (
+          SELECT value
+            FROM json_each(?)
+      )
+    ''', (note_ids,))
+    
+    attachment_ids.extend(r[0] for r in c)
+    
+    c.execute('''
+    DELETE FROM NOTE_ATTACHMENT
+      WHERE NOTE_ID IN (
+          SELECT value
+            FROM json_each(?)
+      )
+        AND NOT EXISTS (
+            SELECT *
+              FROM TASK_NOTE
+              WHERE NOTE_ID = NOTE_ATTACHMENT.NOTE_ID
+        )
+    ''', (note_ids,))
+    
+    c.execute('''
+    DELETE FROM NOTE
+      WHERE NOTE_ID IN (
+          SELECT value
+            FROM json_each(?)
+      )
+        AND NOT EXISTS (
+            SELECT *
+              FROM TASK_NOTE
+              WHERE NOTE_ID = NOTE.NOTE_ID
+        )
+    ''', (note_ids,))
+    
+    attachment_ids = json.dumps(attachment_ids)
+    
+    c.execute('''
+    SELECT DISTINCT
+        CONTENT_HASH
+      FROM ATTACHMENT
+      WHERE ATTACHMENT_ID IN (
+          SELECT value
+            FROM json_each(?)
+      )
+        AND CONTENT_HASH IS NOT NULL
+    ''', (attachment_ids,))
+    
+    content_hashes = json.dumps([r[0] for r in c])
+    
+    c.execute('''
+    DELETE FROM ATTACHMENT
+      WHERE ATTACHMENT_ID IN (
+          SELECT value
+            FROM json_each(?)
+      )
+        AND NOT EXISTS (
+            SELECT *
+              FROM NOTE_ATTACHMENT
+              WHERE ATTACHMENT_ID = ATTACHMENT.ATTACHMENT_ID
+        )
+    ''', (attachment_ids,))
+    
+    c.execute('''
+    DELETE FROM ATTACHMENT_PREVIEW
+      WHERE ATTACHMENT_ID IN (
+          SELECT value
+            FROM json_each(?)
+      )
+        AND NOT EXISTS (
+            SELECT *
+              FROM ATTACHMENT
+              WHERE ATTACHMENT_ID = ATTACHMENT_PREVIEW.ATTACHMENT_ID
+        )
+    ''', (attachment_ids,))
+    
+    c.execute('''
+    DELETE FROM ATTACHMENT_BLOB
+      WHERE CONTENT_HASH IN (
+          SELECT value
+            FROM json_each(?)
+      )
+        AND NOT EXISTS (
+            SELECT *
+              FROM ATTACHMENT
+              WHERE CONTENT_HASH = ATTACHMENT_BLOB.CONTENT_HASH
+        )
+    ''', (content_hashes,))
+
+
+
+
+def dashboard_ranges(now):
+    '''
+    returns (datetime, datetime, datetime): now, the start of tomorrow and the start of the day after the coming Sunday;
+    the boundaries of the dashboard's due date categories.
+    '''
+    
+    tomorrow = datetime(now.year, now.month, now.day) + timedelta(1)
+    return now, tomorrow, tomorrow + timedelta(6 - now.weekday())
+
+def dashboard_category(status, due_ts, ranges):
+    '''
+    returns str: Dashboard category (TaskDashboardData attribute) a task with the given status and due timestamp falls
+    into (disregarding the per-category limit), or None if it is not shown on the dashboard. Mirrors the queries of
+    TaskService.get_dashboard_data.
+    '''
+    
+    now, tomorrow, next_week = ranges
+    if due_ts is not None and due_ts < now:
+        return 'late' if status not in (TaskStatus.COMPLETE, TaskStatus.CANCELED) else None
+    if status == TaskStatus.IN_PROGRESS:
+        return 'in_progress'
+    if status == TaskStatus.PENDING:
+        return 'pending'
+    if status != TaskStatus.READY:
+        return None
+    if due_ts is None:
+        return 'backlog'
+    if due_ts < tomorrow:
+        return 'due_today'
+    if due_ts < next_week:
+        return 'due_this_week'
+    return 'due_later'
+
+def publish_task_events(event_bus, pool, task_ids, max_events=50):
+    '''
+    event_bus (EventBus): Bus to publish to; nothing is done if None or without subscribers
+    pool (ConnectionPool): Pool to read the tasks' current state with
+    task_ids (seq[int]): IDs of tasks changed by a committed transaction
+    max_events (int): Beyond this many tasks, a single reload event is published instead
+    
+    Publishes a task event per changed task, carrying its reference fields and dashboard category.
+    '''
+    
+    if event_bus is None or not event_bus.has_subscribers() or not task_ids:
+        return
+    
+    if len(task_ids) > max_events:
+        event_bus.publish('reload', {})
+        return
+    
+    connection = pool.acquire()
+    try:
+        c = connection.execute('''
+        SELECT
+            TASK_ID
+            , TASK_NM
+            , STATUS_ID
+            , DUE_TS
+            , MOD_TS
+          FROM TASK
+          WHERE TASK_ID IN (
+              SELECT value
+                FROM json_each(?)
+          )
+        ''', (json.dumps(list(task_ids)),))
+        rows = c.fetchall()
+        connection.commit()
+    finally:
+        pool.release(connection)
+    
+    ranges = dashboard_ranges(datetime.now())
+    for task_id, name, status_id, due_ts, mod_ts in rows:
+        reference = TaskReference(task_id, name, statuses_by_id[status_id], from_epoch(due_ts), from_epoch(mod_ts))
+        data = codec.reference_to_dict(reference)
+        data['category'] = dashboard_category(reference.status, reference.due_ts, ranges)
+        event_bus.publish('task', data)
 
 
 
 class TaskService:
-    def __init__(self, db_fname):
+
+    load_batch_size = 500
+    
+    def __init__(self, db_fname, task_cache=None, pool=None, event_bus=None):
         self.db_fname = db_fname
+        self.task_cache = task_cache
+        self.pool = pool or ConnectionPool(db_fname)
+        self.event_bus = event_bus
     
     def get_dashboard_data(self):
-        connection = get_connection(self.db_fname)
+        connection = self.pool.acquire()
         
-        now = datetime.now()
-        tomorrow = now + timedelta(1)
-        next_sunday = now + timedelta(6 - now.weekday())
+        now, tomorrow, next_week = (to_epoch(v) for v in dashboard_ranges(datetime.now()))
         try:
             c = connection.cursor()
             
@@ -246,12 +844,12 @@ class TaskService:
                 , DUE_TS
                 , MOD_TS
               FROM TASK
-              WHERE TO_DATE(DUE_TS) = TO_DATE(?)
-                AND DUE_TS >= ?
+              WHERE DUE_TS >= ?
+                AND DUE_TS < ?
                 AND STATUS_ID = 1
               ORDER BY DUE_TS
               LIMIT 20
-            ''', (now, now))
+            ''', (now, tomorrow))
             
             due_today = self.__reference_rs(c)
             
@@ -265,14 +863,15 @@ class TaskService:
                 , DUE_TS
                 , MOD_TS
               FROM TASK
-              WHERE TO_DATE(DUE_TS) BETWEEN TO_DATE(?) AND TO_DATE(?)
+              WHERE DUE_TS >= ?
+                AND DUE_TS < ?
                 AND STATUS_ID = 1
               ORDER BY DUE_TS
               LIMIT 20
-            ''', (tomorrow, next_sunday))
+            ''', (tomorrow, next_week))
             
             due_this_week = self.__reference_rs(c)
-        
+            
             
             # Pending
             c.execute('''
@@ -300,11 +899,11 @@ class TaskService:
                 , DUE_TS
                 , MOD_TS
               FROM TASK
-              WHERE DUE_TS > ?
+              WHERE DUE_TS >= ?
                 AND STATUS_ID = 1
               ORDER BY DUE_TS
               LIMIT 20
-            ''', (next_sunday,))
+            ''', (next_week,))
             
             due_later = self.__reference_rs(c)
             
@@ -330,7 +929,7 @@ class TaskService:
             connection.rollback()
             raise e
         finally:
-            connection.close()
+            self.pool.release(connection)
         
         
         return TaskDashboardData(late, due_today, due_this_week, pending, due_later, backlog, in_progress)
@@ -338,7 +937,7 @@ class TaskService:
     def search(self, criteria):
         if not criteria:
             return []
-    
+        
         builder = CriteriaBuilder()
         builder.add_criteria(criteria)
         
@@ -353,7 +952,7 @@ class TaskService:
           WHERE $CLAUSE$
         '''.replace('$CLAUSE$', ' '.join(builder.sql))
         
-        connection = get_connection(self.db_fname)
+        connection = self.pool.acquire()
         try:
             c = connection.cursor()
             
@@ -365,151 +964,240 @@ class TaskService:
             connection.rollback()
             raise e
         finally:
-            connection.close()
+            self.pool.release(connection)
         
         return result
     
     def get_task(self, id):
-        connection = get_connection(self.db_fname)
+        task_cache = self.task_cache
+        if task_cache is None:
+            return self.get_tasks([id]).get(id)
+        
+        connection = self.pool.acquire()
         try:
             c = connection.cursor()
-        
-            # Base-Table fields.
+            
+            # Validate cached entry (if any) against the current modification timestamp.
             c.execute('''
             SELECT
-                TASK_ID
-                , TASK_NM
-                , STATUS_ID
-                , DUE_TS
+                MOD_TS
               FROM TASK
               WHERE TASK_ID = ?
             ''', (id,))
             
             r = c.fetchone()
             if not r:
-                connection.commit()
-                return None
+                task_cache.invalidate(id)
+                task = None
             else:
-                task = Task(r['TASK_ID'], r['TASK_NM'], TaskStatus(r['STATUS_ID']), r['DUE_TS'], None, [], [])
-            
-            # Tags
-            c.execute('''
-            SELECT
-                tg.TAG_TEXT
-              FROM TASK_TAG tt
-              JOIN TAG tg
-                ON tg.TAG_ID = tt.TAG_ID
-              WHERE tt.TASK_ID = ?
-            ''', (id,))
-            
-            task.tags = [r['TAG_TEXT'] for r in c]
-            
-            # Notes
-            c.execute('''
-            SELECT
-                n.NOTE_ID
-                , n.TEXT
-                , tn.PINNED_IND
-                , n.MOD_TS
-              FROM TASK_NOTE tn
-              JOIN NOTE n
-                ON n.NOTE_ID = tn.NOTE_ID
-              WHERE tn.TASK_ID = ?
-            ''', (id,))
-            
-            notes = {}
-            for r in c:
-                notes[r['NOTE_ID']] = (TaskNote(r['NOTE_ID'], r['TEXT'], [], r['MOD_TS']), r['PINNED_IND'])
-            
-            # Attachments
-            c.execute('''
-            SELECT
-                na.NOTE_ID
-                , a.ATTACHMENT_ID
-                , a.ATTACHMENT_NM
-                , a.MIME_TYPE
-                , a.CRTN_TS
-              FROM NOTE_ATTACHMENT na
-              JOIN ATTACHMENT a
-                ON a.ATTACHMENT_ID = na.ATTACHMENT_ID
-              WHERE na.NOTE_ID IN (
-                  SELECT NOTE_ID
-                    FROM TASK_NOTE
-                    WHERE TASK_ID = ?
-              )
-            ''', (id,))
-            
-            for r in c:
-                notes[r['NOTE_ID']][0].attachment_references.append(AttachmentReference(r['ATTACHMENT_ID'], r['ATTACHMENT_NM'], r['MIME_TYPE'], r['CRTN_TS']))
-            
+                task = task_cache.get(id, from_epoch(r[0]))
+                if not task:
+                    task = self.__load_tasks(c, [id]).get(id)
+                    if task:
+                        task_cache.put(task)
             
             connection.commit()
         except Exception as e:
             connection.rollback()
             raise e
         finally:
-            connection.close()
+            self.pool.release(connection)
         
+        return task
+    
+    def get_tasks(self, ids):
+        '''
+        ids (seq[int]): IDs of the tasks to fetch
         
-        for note, pinned in notes.values():
-            if pinned:
-                task.pinned_notes.append(note)
-            else:
-                task.notes.append(note)
+        returns dict[int] = Task: Fully populated tasks mapped to their IDs. IDs that do not exist are omitted.
+        Unpinned notes are ordered by most recent modification first.
+        '''
         
-        task.notes.sort(key=lambda v: -1 * v.mod_ts.timestamp())
+        connection = self.pool.acquire()
+        try:
+            c = connection.cursor()
+            
+            result = self.__load_tasks(c, ids)
+            
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            self.pool.release(connection)
         
-        return task
+        return result
     
-    def create_task(self, task):
+    
+    def export_tasks(self, criteria=None):
         '''
-        task (Task): Task to create
+        criteria (TaskSearchExpr): Optional filter; all tasks are exported if not given
         
-        Creates task. Sets task_id on task. Also cleans up all orphaned notes/attachments. Attachment and note
-        IDs are expected to be already assigned. Adds all tags that don't exist to storage. Ties note attachments
-        to notes.
+        Generates fully populated tasks in ID order. IDs are read from a single open cursor and tasks are loaded in
+        batches of load_batch_size on the same connection, within one read transaction, so memory use is bounded by the
+        batch size and the output is a consistent snapshot. The connection is held until the generator is exhausted or
+        closed.
         '''
         
-        now = datetime.now()
-        connection = get_connection(self.db_fname)
+        if criteria:
+            builder = CriteriaBuilder()
+            builder.add_criteria(criteria)
+            where = f'WHERE {" ".join(builder.sql)}'
+            params = builder.params
+        else:
+            where = ''
+            params = []
+        
+        connection = self.pool.acquire()
         try:
+            id_cursor = connection.cursor()
             c = connection.cursor()
             
-            # Base fields.
-            c.execute('''
-            INSERT INTO TASK
-              (TASK_NM, STATUS_ID, DUE_TS, MOD_TS)
-              VALUES (?, ?, ?, ?)
-            ''', (task.name, task.status.value, task.due_ts, now))
+            id_cursor.execute('BEGIN')
+            id_cursor.execute(f'''
+            SELECT
+                TASK_ID
+              FROM TASK
+              {where}
+              ORDER BY TASK_ID
+            ''', params)
+            
+            while True:
+                ids = [r[0] for r in id_cursor.fetchmany(TaskService.load_batch_size)]
+                if not ids:
+                    break
+                
+                tasks = self.__load_tasks(c, ids)
+                for id in ids:
+                    yield tasks[id]
             
-            c.execute('SELECT last_insert_rowid()')
-            task.task_id = task_id = next(c)[0]
+            connection.commit()
+        except BaseException as e:
+            connection.rollback()
+            raise e
+        finally:
+            self.pool.release(connection)
+    
+    
+    def __load_tasks(self, c, ids):
+        result = {}
+        ids = list(ids)
+        for i in range(0, len(ids), TaskService.load_batch_size):
+            batch = (json.dumps(ids[i:i + TaskService.load_batch_size]),)
+            
+            # Base-Table fields.
+            c.execute('''
+            SELECT
+                TASK_ID
+                , TASK_NM
+                , STATUS_ID
+                , DUE_TS
+                , MOD_TS
+              FROM TASK
+              WHERE TASK_ID IN (
+                  SELECT value
+                    FROM json_each(?)
+              )
+            ''', batch)
             
+            for task_id, name, status_id, due_ts, mod_ts in c:
+                result[task_id] = Task(task_id, name, statuses_by_id[status_id], from_epoch(due_ts), [], [], [], from_epoch(mod_ts))
             
             # Tags
             c.execute('''
-            CREATE TEMPORARY TABLE TT_TAG (
-              TAG_TEXT TEXT
-            )
-            ''')
+            SELECT
+                tt.TASK_ID
+                , tg.TAG_TEXT
+              FROM TASK_TAG tt
+              JOIN TAG tg
+                ON tg.TAG_ID = tt.TAG_ID
+              WHERE tt.TASK_ID IN (
+                  SELECT value
+                    FROM json_each(?)
+              )
+              ORDER BY tt.TASK_ID, tt.TAG_ID
+            ''', batch)
             
-            c.executemany('''
-            INSERT INTO TT_TAG
-              (TAG_TEXT)
-              VALUES (?)
-            ''', [(v,) for v in task.tags])
+            for task_id, tag_text in c:
+                result[task_id].tags.append(tag_text)
+            
+            # Notes/Attachments
+            c.execute('''
+            SELECT
+                tn.TASK_ID
+                , n.NOTE_ID
+                , n.TEXT
+                , tn.PINNED_IND
+                , n.MOD_TS
+                , a.ATTACHMENT_ID
+                , a.ATTACHMENT_NM
+                , a.MIME_TYPE
+                , a.CRTN_TS
+              FROM TASK_NOTE tn
+              JOIN NOTE n
+                ON n.NOTE_ID = tn.NOTE_ID
+              LEFT JOIN NOTE_ATTACHMENT na
+                ON na.NOTE_ID = n.NOTE_ID
+              LEFT JOIN ATTACHMENT a
+                ON a.ATTACHMENT_ID = na.ATTACHMENT_ID
+              WHERE tn.TASK_ID IN (
+                  SELECT value
+                    FROM json_each(?)
+              )
+              ORDER BY tn.TASK_ID, n.MOD_TS DESC, n.NOTE_ID, a.ATTACHMENT_ID
+            ''', batch)
+            
+            note = None
+            for task_id, note_id, text, pinned_ind, note_mod_ts, attachment_id, attachment_name, mime_type, creation_ts in c:
+                if not note or note.note_id != note_id:
+                    note = TaskNote(note_id, text, [], from_epoch(note_mod_ts))
+                    task = result[task_id]
+                    (task.pinned_notes if pinned_ind else task.notes).append(note)
+                
+                if attachment_id is not None:
+                    note.attachment_references.append(AttachmentReference(attachment_id, attachment_name, mime_type, from_epoch(creation_ts)))
+        
+        return result
+    
+    def create_task(self, task):
+        '''
+        task (Task): Task to create
+        
+        Creates task. Sets task_id on task. Attachment and note IDs are expected to be already assigned. Adds all
+        tags that don't exist to storage. Ties note attachments to notes.
+        '''
+        
+        now = datetime.now()
+        connection = self.pool.acquire()
+        try:
+            c = connection.cursor()
+            # Take the write lock up front: upgrading a deferred transaction after reading fails immediately (rather
+            # than waiting on the busy timeout) if another connection wrote in between.
+            c.execute('BEGIN IMMEDIATE')
+            
+            # Base fields.
+            c.execute('''
+            INSERT INTO TASK
+              (TASK_NM, STATUS_ID, DUE_TS, MOD_TS)
+              VALUES (?, ?, ?, ?)
+            ''', (task.name, task.status.value, to_epoch(task.due_ts), to_epoch(now)))
+            
+            c.execute('SELECT last_insert_rowid()')
+            task.task_id = task_id = next(c)[0]
+            task.mod_ts = now
             
+            
+            # Tags
+            tags = json.dumps(task.tags)
             c.execute('''
             INSERT INTO TAG
               (TAG_TEXT)
-              SELECT
-                  TAG_TEXT
-                FROM TT_TAG
-                WHERE TAG_TEXT NOT IN (
-                    SELECT TAG_TEXT
-                      FROM TAG
-                )
-            ''')
+              SELECT DISTINCT
+                  value
+                FROM json_each(?)
+                WHERE true
+              ON CONFLICT (TAG_TEXT) DO NOTHING
+            ''', (tags,))
             
             c.execute('''
             INSERT INTO TASK_TAG
@@ -519,10 +1207,10 @@ class TaskService:
                   , TAG_ID
                 FROM TAG
                 WHERE TAG_TEXT IN (
-                    SELECT TAG_TEXT
-                      FROM TT_TAG
+                    SELECT value
+                      FROM json_each(?)
                 )
-            ''', (task_id,))
+            ''', (task_id, tags))
             
             # Notes
             c.executemany('''
@@ -531,31 +1219,28 @@ class TaskService:
               VALUES (?, ?, ?)
             ''', [(task_id, v.note_id, 0) for v in task.notes] + [(task_id, v.note_id, 1) for v in task.pinned_notes])
             
-            
-            
-            
-            # Cleanup
-            self.__cleanup(c)
-            
             connection.commit()
         except Exception as e:
             connection.rollback()
             raise e
         finally:
-            connection.close()
+            self.pool.release(connection)
+        
+        publish_task_events(self.event_bus, self.pool, [task_id])
     
     def update_task(self, task):
         '''
         task (Task): Task to update
         
-        Updates task, cleans up orphaned notes/attachments. Attachment and note
+        Updates task, cleans up notes (and their attachments) detached from the task by this update. Attachment and note
         IDs are expected to be already assigned. Adds all tags that don't exist to storage. Ties note attachments
         to notes.
         '''
         now = datetime.now()
-        connection = get_connection(self.db_fname)
+        connection = self.pool.acquire()
         try:
             c = connection.cursor()
+            c.execute('BEGIN IMMEDIATE')
             
             # Check if task exists
             c.execute('''
@@ -565,7 +1250,7 @@ class TaskService:
             ''', (task.task_id,))
             
             if next(c)[0] == 0:
-                raise ValueError(f'Task does not exist: {task_id}')
+                raise ValueError(f'Task does not exist: {task.task_id}')
             
             # Basic Fields
             c.execute('''
@@ -575,35 +1260,22 @@ class TaskService:
                     , DUE_TS = ?
                     , MOD_TS = ?
                 WHERE TASK_ID = ?
-            ''', (task.name, task.status.value, task.due_ts, now, task.task_id))
+            ''', (task.name, task.status.value, to_epoch(task.due_ts), to_epoch(now), task.task_id))
+            task.mod_ts = now
             
             
             
             # Tags
-            c.execute('''
-            CREATE TEMPORARY TABLE TT_TAG (
-              TAG_TEXT TEXT
-            )
-            ''')
-            
-            c.executemany('''
-            INSERT INTO TT_TAG
-              (TAG_TEXT)
-              VALUES (?)
-            ''', [(v,) for v in task.tags])
-            
-            
+            tags = json.dumps(task.tags)
             c.execute('''
             INSERT INTO TAG
               (TAG_TEXT)
-              SELECT
-                  TAG_TEXT
-                FROM TT_TAG
-                WHERE TAG_TEXT NOT IN (
-                    SELECT TAG_TEXT
-                      FROM TAG
-                )
-            ''')
+              SELECT DISTINCT
+                  value
+                FROM json_each(?)
+                WHERE true
+              ON CONFLICT (TAG_TEXT) DO NOTHING
+            ''', (tags,))
             
             
             c.execute('''
@@ -613,11 +1285,11 @@ class TaskService:
                     SELECT TAG_ID
                       FROM TAG
                       WHERE TAG_TEXT IN (
-                          SELECT TAG_TEXT
-                            FROM TT_TAG
+                          SELECT value
+                            FROM json_each(?)
                       )
                 )
-            ''', (task.task_id,))
+            ''', (task.task_id, tags))
             
             c.execute('''
             INSERT INTO TASK_TAG
@@ -627,394 +1299,1558 @@ class TaskService:
                   , TAG_ID
                 FROM TAG
                 WHERE TAG_TEXT IN (
-                    SELECT TAG_TEXT
-                      FROM TT_TAG
+                    SELECT value
+                      FROM json_each(?)
                 )
               ON CONFLICT DO NOTHING
-            ''', (task.task_id,))
+            ''', (task.task_id, tags))
             
             
             
             # Notes
+            note_ids = json.dumps([n.note_id for n in task.pinned_notes + task.notes])
             c.execute('''
-            CREATE TEMPORARY TABLE TT_NOTE (
-              NOTE_ID INTEGER
-              , PINNED_IND INTEGER
-            )
-            ''')
+            SELECT
+                NOTE_ID
+              FROM TASK_NOTE
+              WHERE TASK_ID = ?
+                AND NOTE_ID NOT IN (
+                    SELECT value
+                      FROM json_each(?)
+                )
+            ''', (task.task_id, note_ids))
             
-            c.executemany('''
-            INSERT INTO TT_NOTE
-              (NOTE_ID, PINNED_IND)
-              VALUES (?, ?)
-            ''', [(n.note_id, 1) for n in task.pinned_notes] + [(n.note_id, 0) for n in task.notes])
+            detached_note_ids = [r[0] for r in c]
             
             c.execute('''
             DELETE FROM TASK_NOTE
               WHERE TASK_ID = ?
                 AND NOTE_ID NOT IN (
-                    SELECT NOTE_ID
-                      FROM TT_NOTE
+                    SELECT value
+                      FROM json_each(?)
                 )
-            ''', (task.task_id,))
+            ''', (task.task_id, note_ids))
             
-            c.execute('''
+            c.executemany('''
             INSERT INTO TASK_NOTE
               (TASK_ID, NOTE_ID, PINNED_IND)
-              SELECT
-                  ?
-                  , NOTE_ID
-                  , PINNED_IND
-                FROM TT_NOTE
-                WHERE true
+              VALUES (?, ?, ?)
               ON CONFLICT (TASK_ID, NOTE_ID) DO UPDATE
                 SET PINNED_IND = excluded.PINNED_IND
-            ''', (task.task_id,))
+            ''', [(task.task_id, n.note_id, 1) for n in task.pinned_notes] + [(task.task_id, n.note_id, 0) for n in task.notes])
+            
+            
+            
+            # Cleanup
+            delete_orphans(c, note_ids=detached_note_ids)
+            
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            self.pool.release(connection)
+            if self.task_cache is not None:
+                self.task_cache.invalidate(task.task_id)
+        
+        publish_task_events(self.event_bus, self.pool, [task.task_id])
+    
+    
+    def batch_update(self, ids=None, criteria=None, status=None, add_tags=(), remove_tags=(), due_shift=None):
+        '''
+        ids (seq[int]): IDs of the tasks to update
+        criteria (TaskSearchExpr): Alternatively (if ids is None), criteria selecting the tasks to update
+        status (TaskStatus): New status, if changing
+        add_tags (seq[str]): Tags to add (created if they don't exist)
+        remove_tags (seq[str]): Tags to remove
+        due_shift (timedelta): Amount to move due dates by; tasks without a due date are unaffected
+        
+        Applies the given changes to all selected tasks with set-based statements in a single transaction, bumping their
+        modification timestamps. Notes are untouched, so no orphan cleanup is required. Returns the number of tasks
+        updated.
+        '''
+        
+        if ids is None and not criteria:
+            raise ValueError('Either ids or criteria is required.')
+        
+        now = datetime.now()
+        connection = self.pool.acquire()
+        task_ids = []
+        try:
+            c = connection.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            
+            # Resolve targets.
+            if ids is not None:
+                c.execute('''
+                SELECT
+                    TASK_ID
+                  FROM TASK
+                  WHERE TASK_ID IN (
+                      SELECT value
+                        FROM json_each(?)
+                  )
+                ''', (json.dumps(list(ids)),))
+            else:
+                builder = CriteriaBuilder()
+                builder.add_criteria(criteria)
+                c.execute(f'''
+                SELECT
+                    TASK_ID
+                  FROM TASK
+                  WHERE {" ".join(builder.sql)}
+                ''', builder.params)
+            
+            task_ids = [r[0] for r in c]
+            if not task_ids:
+                connection.commit()
+                return 0
+            
+            target_ids = json.dumps(task_ids)
+            due_shift = due_shift // one_microsecond if due_shift else None
+            
+            # Base fields.
+            c.execute('''
+            UPDATE TASK
+              SET STATUS_ID = COALESCE(?, STATUS_ID)
+                    , DUE_TS = DUE_TS + COALESCE(?, 0)
+                    , MOD_TS = ?
+                WHERE TASK_ID IN (
+                    SELECT value
+                      FROM json_each(?)
+                )
+            ''', (status.value if status else None, due_shift, to_epoch(now), target_ids))
+            
+            # Tags
+            if remove_tags:
+                c.execute('''
+                DELETE FROM TASK_TAG
+                  WHERE TASK_ID IN (
+                      SELECT value
+                        FROM json_each(?)
+                  )
+                    AND TAG_ID IN (
+                        SELECT TAG_ID
+                          FROM TAG
+                          WHERE TAG_TEXT IN (
+                              SELECT value
+                                FROM json_each(?)
+                          )
+                    )
+                ''', (target_ids, json.dumps(list(remove_tags))))
+            
+            if add_tags:
+                add_tags = json.dumps(list(add_tags))
+                c.execute('''
+                INSERT INTO TAG
+                  (TAG_TEXT)
+                  SELECT DISTINCT
+                      value
+                    FROM json_each(?)
+                    WHERE true
+                  ON CONFLICT (TAG_TEXT) DO NOTHING
+                ''', (add_tags,))
+                
+                c.execute('''
+                INSERT INTO TASK_TAG
+                  (TASK_ID, TAG_ID)
+                  SELECT
+                      t.value
+                      , tg.TAG_ID
+                    FROM json_each(?) t
+                    JOIN TAG tg
+                      ON tg.TAG_TEXT IN (
+                          SELECT value
+                            FROM json_each(?)
+                      )
+                    WHERE true
+                  ON CONFLICT DO NOTHING
+                ''', (target_ids, add_tags))
+            
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            self.pool.release(connection)
+            if self.task_cache is not None:
+                for task_id in task_ids:
+                    self.task_cache.invalidate(task_id)
+        
+        publish_task_events(self.event_bus, self.pool, task_ids)
+        return len(task_ids)
+    
+    def list_tasks(self, criteria=None, after_id=None, limit=50):
+        '''
+        criteria (TaskSearchExpr): Optional filter
+        after_id (int): If given, only tasks with a greater ID are listed
+        limit (int): Maximum number of tasks to list
+        
+        returns list[TaskReference]: Matching tasks in ID order. Paging by the last ID seen (rather than by offset) keeps
+        each page an index range scan, regardless of how deep it is.
+        '''
+        
+        clauses = []
+        params = []
+        if criteria:
+            builder = CriteriaBuilder()
+            builder.add_criteria(criteria)
+            clauses.append(f'({" ".join(builder.sql)})')
+            params.extend(builder.params)
+        if after_id is not None:
+            clauses.append('TASK_ID > ?')
+            params.append(after_id)
+        params.append(limit)
+        
+        connection = self.pool.acquire()
+        try:
+            c = connection.cursor()
+            
+            c.execute(f'''
+            SELECT
+                TASK_ID
+                , TASK_NM
+                , STATUS_ID
+                , DUE_TS
+                , MOD_TS
+              FROM TASK
+              {"WHERE " + " AND ".join(clauses) if clauses else ""}
+              ORDER BY TASK_ID
+              LIMIT ?
+            ''', params)
+            result = self.__reference_rs(c)
+            
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            self.pool.release(connection)
+        
+        return result
+    
+    def patch_task(self, task_id, changes, expected_mod_ts=None):
+        '''
+        task_id (int): ID of the task to change
+        changes (TaskChangeSet): Changes to apply
+        expected_mod_ts (datetime): If given, the modification timestamp the task must still have
+        
+        Applies only the given changes; unlike update_task, tags and notes that are not changed are not rewritten, and
+        only removed notes are checked for orphaned storage. Returns the task's new modification timestamp, or None if the task does not exist. Raises
+        TaskModifiedException if expected_mod_ts is given and the task has been modified since.
+        '''
+        
+        now = datetime.now()
+        connection = self.pool.acquire()
+        try:
+            c = connection.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            
+            c.execute('''
+            SELECT
+                MOD_TS
+              FROM TASK
+              WHERE TASK_ID = ?
+            ''', (task_id,))
+            
+            r = c.fetchone()
+            if not r:
+                connection.commit()
+                return None
+            mod_ts = from_epoch(r[0])
+            if expected_mod_ts is not None and mod_ts != expected_mod_ts:
+                raise TaskModifiedException(task_id, mod_ts)
+            
+            if changes.is_empty():
+                connection.commit()
+                return mod_ts
+            
+            # Base fields
+            assignments = ['MOD_TS = ?']
+            params = [to_epoch(now)]
+            for column, value in (('TASK_NM', changes.name), ('STATUS_ID', changes.status), ('DUE_TS', changes.due_ts)):
+                if value is not UNCHANGED:
+                    assignments.append(f'{column} = ?')
+                    if isinstance(value, TaskStatus):
+                        value = value.value
+                    elif isinstance(value, datetime):
+                        value = to_epoch(value)
+                    params.append(value)
+            params.append(task_id)
+            
+            c.execute(f'''
+            UPDATE TASK
+              SET {", ".join(assignments)}
+              WHERE TASK_ID = ?
+            ''', params)
+            
+            # Tags
+            if changes.remove_tags:
+                c.execute('''
+                DELETE FROM TASK_TAG
+                  WHERE TASK_ID = ?
+                    AND TAG_ID IN (
+                        SELECT TAG_ID
+                          FROM TAG
+                          WHERE TAG_TEXT IN (
+                              SELECT value
+                                FROM json_each(?)
+                          )
+                    )
+                ''', (task_id, json.dumps(list(changes.remove_tags))))
+            
+            if changes.add_tags:
+                add_tags = json.dumps(list(changes.add_tags))
+                c.execute('''
+                INSERT INTO TAG
+                  (TAG_TEXT)
+                  SELECT DISTINCT
+                      value
+                    FROM json_each(?)
+                    WHERE true
+                  ON CONFLICT (TAG_TEXT) DO NOTHING
+                ''', (add_tags,))
+                
+                c.execute('''
+                INSERT INTO TASK_TAG
+                  (TASK_ID, TAG_ID)
+                  SELECT
+                      ?
+                      , TAG_ID
+                    FROM TAG
+                    WHERE TAG_TEXT IN (
+                        SELECT value
+                          FROM json_each(?)
+                    )
+                  ON CONFLICT DO NOTHING
+                ''', (task_id, add_tags))
+            
+            # Notes
+            if changes.remove_notes:
+                remove_notes = json.dumps(list(changes.remove_notes))
+                c.execute('''
+                DELETE FROM TASK_NOTE
+                  WHERE TASK_ID = ?
+                    AND NOTE_ID IN (
+                        SELECT value
+                          FROM json_each(?)
+                    )
+                ''', (task_id, remove_notes))
+                
+                delete_orphans(c, note_ids=changes.remove_notes)
+            
+            if changes.add_notes or changes.pin_notes:
+                c.executemany('''
+                INSERT INTO TASK_NOTE
+                  (TASK_ID, NOTE_ID, PINNED_IND)
+                  VALUES (?, ?, ?)
+                  ON CONFLICT (TASK_ID, NOTE_ID) DO UPDATE
+                    SET PINNED_IND = excluded.PINNED_IND
+                ''', [(task_id, note_id, 1 if pinned else 0) for note_id, pinned in
+                        list(changes.add_notes.items()) + list(changes.pin_notes.items())])
+            
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            self.pool.release(connection)
+            if self.task_cache is not None:
+                self.task_cache.invalidate(task_id)
+        
+        publish_task_events(self.event_bus, self.pool, [task_id])
+        return now
+    
+    def import_tasks(self, tasks, batch_size=5000, progress=None):
+        '''
+        tasks (iter[Task]): Tasks to create; notes are created along with them (note IDs are ignored)
+        batch_size (int): Tasks written per transaction
+        progress (callable): Called with the number of tasks imported so far after each batch
+        
+        Bulk-creates tasks. Each batch is written in a single transaction: task and note IDs are assigned explicitly
+        following the current maxima, rows are inserted with executemany, and tags are resolved with one set-based upsert
+        per batch. Sets task_id (and note_id) on the given tasks. Returns the number of tasks imported; batches already
+        written remain if tasks raises.
+        '''
+        
+        count = 0
+        batch = []
+        for task in tasks:
+            batch.append(task)
+            if len(batch) >= batch_size:
+                count += self.__import_batch(batch)
+                batch = []
+                if progress:
+                    progress(count)
+        
+        if batch:
+            count += self.__import_batch(batch)
+            if progress:
+                progress(count)
+        
+        if count and self.event_bus is not None:
+            self.event_bus.publish('reload', {})
+        return count
+    
+    def __import_batch(self, tasks):
+        now = datetime.now()
+        connection = self.pool.acquire()
+        try:
+            c = connection.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            
+            c.execute('''
+            SELECT
+                (SELECT COALESCE(MAX(TASK_ID), 0) FROM TASK)
+                , (SELECT COALESCE(MAX(NOTE_ID), 0) FROM NOTE)
+            ''')
+            task_id, note_id = next(c)
+            
+            task_rows = []
+            note_rows = []
+            task_note_rows = []
+            task_tags = []
+            for task in tasks:
+                task_id += 1
+                task.task_id = task_id
+                task.mod_ts = task.mod_ts or now
+                task_rows.append((task_id, task.name, task.status.value, to_epoch(task.due_ts), to_epoch(task.mod_ts)))
+                
+                for pinned, notes in ((1, task.pinned_notes), (0, task.notes)):
+                    for note in notes:
+                        note_id += 1
+                        note.note_id = note_id
+                        note.mod_ts = note.mod_ts or now
+                        note_rows.append((note_id, note.text, to_epoch(note.mod_ts)))
+                        task_note_rows.append((task_id, note_id, pinned))
+                
+                task_tags.extend([task_id, tag] for tag in set(task.tags))
+            
+            c.executemany('''
+            INSERT INTO TASK
+              (TASK_ID, TASK_NM, STATUS_ID, DUE_TS, MOD_TS)
+              VALUES (?, ?, ?, ?, ?)
+            ''', task_rows)
+            
+            c.executemany('''
+            INSERT INTO NOTE
+              (NOTE_ID, TEXT, MOD_TS)
+              VALUES (?, ?, ?)
+            ''', note_rows)
             
+            c.executemany('''
+            INSERT INTO TASK_NOTE
+              (TASK_ID, NOTE_ID, PINNED_IND)
+              VALUES (?, ?, ?)
+            ''', task_note_rows)
+            
+            # Tags
+            task_tags = json.dumps(task_tags)
+            c.execute('''
+            INSERT INTO TAG
+              (TAG_TEXT)
+              SELECT DISTINCT
+                  json_extract(value, '$[1]')
+                FROM json_each(?)
+                WHERE true
+              ON CONFLICT (TAG_TEXT) DO NOTHING
+            ''', (task_tags,))
+            
+            c.execute('''
+            INSERT INTO TASK_TAG
+              (TASK_ID, TAG_ID)
+              SELECT
+                  json_extract(tt.value, '$[0]')
+                  , tg.TAG_ID
+                FROM json_each(?) tt
+                JOIN TAG tg
+                  ON tg.TAG_TEXT = json_extract(tt.value, '$[1]')
+            ''', (task_tags,))
+            
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            self.pool.release(connection)
+        
+        return len(tasks)
+    
+    
+    def __reference_rs(self, c):
+        # Rows are (TASK_ID, TASK_NM, STATUS_ID, DUE_TS, MOD_TS).
+        return [TaskReference(task_id, name, statuses_by_id[status_id], from_epoch(due_ts), from_epoch(mod_ts))
+                for task_id, name, status_id, due_ts, mod_ts in c]
+
+
+class NoteService:
+    def __init__(self, db_fname, task_cache=None, pool=None, event_bus=None):
+        self.db_fname = db_fname
+        self.task_cache = task_cache
+        self.pool = pool or ConnectionPool(db_fname)
+        self.event_bus = event_bus
+    
+    def create_notes(self, notes):
+        '''
+        notes dict[int] = TaskNote: list of TaskNotes to create by reference number
+        
+        Creates notes in notes, assigning permanent IDs. Updates note_id on given TaskNotes.
+        '''
+        
+        if not notes:
+            return
+        
+        now = datetime.now()
+        connection = self.pool.acquire()
+        try:
+            c = connection.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            
+            note_ids = insert_rows(c, 'NOTE', ('TEXT', 'MOD_TS'), [(n.text, to_epoch(now)) for n in notes.values()])
+            for note, note_id in zip(notes.values(), note_ids):
+                note.note_id = note_id
+            
+            c.executemany('''
+            INSERT INTO NOTE_ATTACHMENT
+              (NOTE_ID, ATTACHMENT_ID)
+              VALUES (?, ?)
+            ''', [(n.note_id, a.attachment_id) for n in notes.values() for a in n.attachment_references])
+            
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            self.pool.release(connection)
+    
+    
+    def update_notes(self, notes):
+        '''
+        notes (TaskNote[]): TaskNotes to update
+        
+        Updates the text and attachments of the given notes, bumping the modification timestamps of the tasks they
+        belong to. Only notes that were actually edited should be given.
+        '''
+        
+        if not notes:
+            return
+        
+        now = datetime.now()
+        connection = self.pool.acquire()
+        try:
+            c = connection.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            
+            # Validation
+            note_ids = json.dumps([n.note_id for n in notes])
+            c.execute('''
+            SELECT
+                value
+              FROM json_each(?)
+              WHERE value NOT IN (
+                  SELECT NOTE_ID
+                    FROM NOTE
+              )
+            ''', (note_ids,))
+            
+            invalid_ids = [r[0] for r in c]
+            if invalid_ids:
+                raise ValueError(f'Invalid IDs in given notes: {invalid_ids}')
+            
+            # Owning tasks (for cache invalidation)
+            c.execute('''
+            SELECT DISTINCT
+                TASK_ID
+              FROM TASK_NOTE
+              WHERE NOTE_ID IN (
+                  SELECT value
+                    FROM json_each(?)
+              )
+            ''', (note_ids,))
+            
+            task_ids = [r[0] for r in c]
+            
+            # Note edits count as modifications of their tasks (e.g. for conditional requests).
+            c.execute('''
+            UPDATE TASK
+              SET MOD_TS = ?
+              WHERE TASK_ID IN (
+                  SELECT value
+                    FROM json_each(?)
+              )
+            ''', (to_epoch(now), json.dumps(task_ids)))
+            
+            
+            # Update Note Text
+            update_params = []
+            for note in notes:
+                update_params.append((note.text, to_epoch(now), note.note_id, note.text))
+            
+            c.executemany('''
+            UPDATE NOTE
+              SET TEXT = ?, MOD_TS = ?
+              WHERE NOTE_ID = ?
+                AND TEXT <> ?
+            ''', update_params)
+            
+            
+            # Update Note Attachments; pairs are passed as [note ID, attachment ID] arrays.
+            note_attachments = json.dumps([(n.note_id, a.attachment_id) for n in notes for a in n.attachment_references])
+            c.execute('''
+            SELECT
+                ATTACHMENT_ID
+              FROM NOTE_ATTACHMENT AS t
+              WHERE NOTE_ID IN (
+                  SELECT value
+                    FROM json_each(?)
+              )
+                AND NOT EXISTS (
+                    SELECT *
+                      FROM json_each(?)
+                      WHERE json_extract(value, '$[0]') = t.NOTE_ID
+                        AND json_extract(value, '$[1]') = t.ATTACHMENT_ID
+                )
+            ''', (note_ids, note_attachments))
+            
+            detached_attachment_ids = [r[0] for r in c]
+            
+            c.execute('''
+            DELETE FROM NOTE_ATTACHMENT AS t
+              WHERE NOTE_ID IN (
+                  SELECT value
+                    FROM json_each(?)
+              )
+                AND NOT EXISTS (
+                    SELECT *
+                      FROM json_each(?)
+                      WHERE json_extract(value, '$[0]') = t.NOTE_ID
+                        AND json_extract(value, '$[1]') = t.ATTACHMENT_ID
+                )
+            ''', (note_ids, note_attachments))
+            
+            c.execute('''
+            INSERT INTO NOTE_ATTACHMENT
+              (NOTE_ID, ATTACHMENT_ID)
+              SELECT
+                  json_extract(value, '$[0]')
+                  , json_extract(value, '$[1]')
+                FROM json_each(?)
+                WHERE true
+              ON CONFLICT DO NOTHING
+            ''', (note_attachments,))
+            
+            # Cleanup
+            delete_orphans(c, attachment_ids=detached_attachment_ids)
+            
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            self.pool.release(connection)
+        
+        task_cache = self.task_cache
+        if task_cache is not None:
+            for task_id in task_ids:
+                task_cache.invalidate(task_id)
+        
+        publish_task_events(self.event_bus, self.pool, task_ids)
+
+
+# Job types of the deferred processing of uploaded attachments; see AttachmentService.process_upload and
+# AttachmentService.process_previews.
+store_attachment_job = 'store_attachment'
+generate_previews_job = 'generate_previews'
+
+class AttachmentService:
+    '''
+    With a job_runner, uploads are stored in two steps: create_attachments only moves the uploaded files to spool_dir
+    and records them, along with a store_attachment job each, and process_upload (run by the job runner) later hashes
+    the files, sniffs their content type and stores their content, once per distinct content. Without one,
+    create_attachments does all of this itself.
+    
+    Previews of image attachments are made by the preview_generator (a taskwebapp.preview.PreviewGenerator) and stored
+    per attachment and size. With a job_runner they are generated by a job, queued by process_upload, otherwise on
+    first request.
+    '''
+    
+    def __init__(self, db_fname, pool=None, task_cache=None, job_runner=None, spool_dir=None, preview_generator=None):
+        self.db_fname = db_fname
+        self.pool = pool or ConnectionPool(db_fname)
+        self.task_cache = task_cache
+        self.job_runner = job_runner
+        self.spool_dir = spool_dir
+        self.preview_generator = preview_generator
+        
+        if job_runner:
+            if not spool_dir:
+                raise ValueError('spool_dir is required with a job_runner')
+            os.makedirs(spool_dir, exist_ok=True)
+    
+    def create_attachments(self, attachments):
+        '''
+        attachments (dict[int] = seq[MultipartWrapper]): Attachments
+        
+        returns seq[AttachmentReference]
+        '''
+        
+        result = {}
+        if not attachments:
+            return result
+        
+        now = datetime.now()
+        all_parts = [(id, part) for id, parts in attachments.items() for part in parts]
+        if self.job_runner:
+            attachment_ids = self.__create_deferred(all_parts, now)
+            self.job_runner.wake()
+        else:
+            attachment_ids = self.__create_stored(all_parts, now)
+        
+        for id in attachments:
+            result[id] = []
+        for (id, part), attachment_id in zip(all_parts, attachment_ids):
+            result[id].append(AttachmentReference(attachment_id, part.filename, part.mime_type, now))
+        
+        return result
+    
+    def __create_deferred(self, all_parts, now):
+        spool_fnames = []
+        try:
+            for id, part in all_parts:
+                spool_fnames.append(self.__spool(part.value))
+            
+            connection = self.pool.acquire()
+            try:
+                c = connection.cursor()
+                c.execute('BEGIN IMMEDIATE')
+                
+                attachment_ids = insert_rows(c, 'ATTACHMENT', ('ATTACHMENT_NM', 'MIME_TYPE', 'SPOOL_FNAME', 'CRTN_TS'),
+                        ((part.filename, part.mime_type, spool_fname, to_epoch(now))
+                            for (id, part), spool_fname in zip(all_parts, spool_fnames)))
+                insert_jobs(c, store_attachment_job, ({'attachment_id': attachment_id, 'spool_fname': spool_fname}
+                        for attachment_id, spool_fname in zip(attachment_ids, spool_fnames)))
+                
+                connection.commit()
+            except Exception as e:
+                connection.rollback()
+                raise e
+            finally:
+                self.pool.release(connection)
+        except Exception as e:
+            for spool_fname in spool_fnames:
+                remove_file(spool_fname)
+            raise e
+        
+        return attachment_ids
+    
+    def __spool(self, fname):
+        # Uploads are written to spool_dir by the request processor (see create_app), so this normally only links the file;
+        # it is copied if it resides on another file system.
+        spool_fname = os.path.join(self.spool_dir, uuid.uuid4().hex)
+        try:
+            os.link(fname, spool_fname)
+        except OSError:
+            shutil.copyfile(fname, spool_fname)
+        return spool_fname
+    
+    def __create_stored(self, all_parts, now):
+        inspected = [inspect_file(part.value, part.mime_type) for id, part in all_parts]
+        
+        connection = self.pool.acquire()
+        try:
+            c = connection.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            
+            for (id, part), (content_hash, size, mime_type) in zip(all_parts, inspected):
+                store_blob(c, content_hash, part.value)
+            
+            attachment_ids = insert_rows(c, 'ATTACHMENT',
+                    ('ATTACHMENT_NM', 'MIME_TYPE', 'CONTENT_HASH', 'CONTENT_SIZE', 'CRTN_TS'),
+                    ((part.filename, mime_type, content_hash, size, to_epoch(now))
+                        for (id, part), (content_hash, size, mime_type) in zip(all_parts, inspected)))
+            
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            self.pool.release(connection)
+        
+        return attachment_ids
+    
+    def process_upload(self, payload):
+        '''
+        payload (dict): Payload of a store_attachment job; the attachment's ID and the file its upload was spooled to
+        
+        Stores the content of the spooled file (unless identical content already is) and sets the attachment's hash, size
+        and sniffed content type, then removes the file. Attachments deleted in the meantime are skipped. Queues the
+        generation of previews for images.
+        '''
+        
+        attachment_id = payload['attachment_id']
+        spool_fname = payload['spool_fname']
+        
+        connection = self.pool.acquire()
+        try:
+            c = connection.cursor()
+            c.execute('''
+            SELECT
+                MIME_TYPE
+              FROM ATTACHMENT
+              WHERE ATTACHMENT_ID = ?
+                AND SPOOL_FNAME = ?
+            ''', (attachment_id, spool_fname))
+            r = c.fetchone()
+            connection.commit()
+            
+            if not r:
+                remove_file(spool_fname)
+                return
+            declared_type = r[0]
+            
+            content_hash, size, mime_type = inspect_file(spool_fname, declared_type)
+            
+            c.execute('BEGIN IMMEDIATE')
+            c.execute('''
+            UPDATE ATTACHMENT
+              SET CONTENT_HASH = ?
+                  , CONTENT_SIZE = ?
+                  , MIME_TYPE = ?
+                  , SPOOL_FNAME = NULL
+              WHERE ATTACHMENT_ID = ?
+                AND SPOOL_FNAME = ?
+            ''', (content_hash, size, mime_type, attachment_id, spool_fname))
+            if c.rowcount:
+                store_blob(c, content_hash, spool_fname)
+                
+                preview_generator = self.preview_generator
+                if preview_generator and preview_generator.supports(mime_type):
+                    insert_jobs(c, generate_previews_job, [{'attachment_id': attachment_id}])
+            
+            task_ids = ()
+            if mime_type != declared_type and self.task_cache:
+                c.execute('''
+                SELECT DISTINCT
+                    tn.TASK_ID
+                  FROM NOTE_ATTACHMENT na
+                  JOIN TASK_NOTE tn
+                    ON tn.NOTE_ID = na.NOTE_ID
+                  WHERE na.ATTACHMENT_ID = ?
+                ''', (attachment_id,))
+                task_ids = [r[0] for r in c]
+            
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            self.pool.release(connection)
+        
+        # Readers fall back to the spooled file until the content is committed; see fetch_attachment.
+        remove_file(spool_fname)
+        
+        for task_id in task_ids:
+            self.task_cache.invalidate(task_id)
+    
+    
+    def resolve_attachments(self, attachment_mapping):
+        '''
+        attachment_ids (dict[int] = seq[int]): reference numbers matched to sequences of attachment IDs to resolve
+        
+        returns dict[int] = seq[AttachmentReference]: resolved AttachmentReferences mapped to given reference numbers
+        '''
+        
+        result = {}
+        if not attachment_mapping:
+            return result
+        
+        connection = self.pool.acquire()
+        try:
+            c = connection.cursor()
+            
+            # References are passed as [reference number, attachment ID] arrays.
+            c.execute('''
+            SELECT
+                json_extract(r.value, '$[0]')
+                , a.ATTACHMENT_ID
+                , a.ATTACHMENT_NM
+                , a.MIME_TYPE
+                , a.CRTN_TS
+              FROM json_each(?) r
+              JOIN ATTACHMENT a
+                ON a.ATTACHMENT_ID = json_extract(r.value, '$[1]')
+            ''', (json.dumps([(ref_id, attachment_id) for ref_id, attachment_ids in attachment_mapping.items()
+                    for attachment_id in attachment_ids]),))
+            
+            for ref_id, attachment_id, name, mime_type, creation_ts in c:
+                if ref_id in result:
+                    attachment_references = result[ref_id]
+                else:
+                    attachment_references = result[ref_id] = []
+                attachment_references.append(AttachmentReference(attachment_id, name, mime_type, from_epoch(creation_ts)))
+            
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            self.pool.release(connection)
+        
+        return result
+    
+    
+    def fetch_attachment(self, attachment_id):
+        '''
+        attachment_id (int): ID of the attachment to fetch.
+        
+        returns Attachment: Attachment matching the given ID if it exists, otherwise None.
+        '''
+        
+        # An attachment still being processed is read from its spooled file; if that is removed between the query and
+        # reading it, the content has been stored in the meantime.
+        for attempt in range(2):
+            r = self.__fetch_row(attachment_id)
+            if not r:
+                return None
+            
+            name, mime_type, spool_fname, content = r
+            if content is not None:
+                return Attachment(name, content, mime_type)
+            if not spool_fname:
+                return None
+            
+            try:
+                return Attachment(name, read_file(spool_fname), mime_type)
+            except FileNotFoundError:
+                if attempt:
+                    raise
+    
+    def fetch_preview(self, attachment_id, size):
+        '''
+        attachment_id (int): ID of the attachment
+        size (int): Preview size, one of the preview_generator's sizes
+        
+        returns AttachmentPreview: Stored preview of the given attachment; None if the attachment does not exist, cannot
+        be previewed or has no preview yet. Without a job_runner, a missing preview is generated (and stored) for
+        processed attachments; with one, its generation is queued, unless already done.
+        '''
+        
+        connection = self.pool.acquire()
+        try:
+            c = connection.cursor()
+            
+            c.execute('''
+            SELECT
+                a.MIME_TYPE
+                , a.SPOOL_FNAME IS NOT NULL
+                , p.ATTACHMENT_ID IS NOT NULL
+                , p.MIME_TYPE
+                , p.CONTENT
+              FROM ATTACHMENT a
+              LEFT JOIN ATTACHMENT_PREVIEW p
+                ON p.ATTACHMENT_ID = a.ATTACHMENT_ID
+                  AND p.PREVIEW_SIZE = ?
+              WHERE a.ATTACHMENT_ID = ?
+            ''', (size, attachment_id))
+            
+            r = c.fetchone()
+            
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            self.pool.release(connection)
+        
+        if not r:
+            return None
+        
+        mime_type, pending, stored, preview_type, preview_content = r
+        if stored:
+            return AttachmentPreview(preview_type, preview_content) if preview_content is not None else None
+        
+        # Pending attachments are previewed once processed (see process_upload).
+        preview_generator = self.preview_generator
+        if pending or not preview_generator or size not in preview_generator.sizes \
+                or not preview_generator.supports(mime_type):
+            return None
+        
+        if self.job_runner:
+            # Kept off request threads; only attachments stored before previews were introduced get here.
+            self.__queue_previews(attachment_id)
+            return None
+        return self.__generate_previews(attachment_id).get(size)
+    
+    def process_previews(self, payload):
+        '''
+        payload (dict): Payload of a generate_previews job; the attachment's ID
+        
+        Generates and stores the previews of the attachment, unless already done (e.g. on request).
+        '''
+        
+        attachment_id = payload['attachment_id']
+        
+        connection = self.pool.acquire()
+        try:
+            c = connection.cursor()
+            c.execute('''
+            SELECT
+                count(*)
+              FROM ATTACHMENT_PREVIEW
+              WHERE ATTACHMENT_ID = ?
+            ''', (attachment_id,))
+            count = next(c)[0]
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            self.pool.release(connection)
+        
+        if count < len(self.preview_generator.sizes):
+            self.__generate_previews(attachment_id)
+    
+    def __queue_previews(self, attachment_id):
+        payload = {'attachment_id': attachment_id}
+        
+        # Checked without the write lock first; previews are requested far more often than jobs need queueing.
+        connection = self.pool.acquire()
+        try:
+            c = connection.cursor()
+            
+            queued = job_exists(c, generate_previews_job, payload)
+            if not queued:
+                c.execute('BEGIN IMMEDIATE')
+                if not job_exists(c, generate_previews_job, payload):
+                    insert_jobs(c, generate_previews_job, [payload])
+            
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            self.pool.release(connection)
+        
+        if not queued:
+            self.job_runner.wake()
+    
+    def __generate_previews(self, attachment_id):
+        '''
+        returns dict[int] = AttachmentPreview: Previews of the attachment by size; None for sizes without a preview.
+        '''
+        
+        attachment = self.fetch_attachment(attachment_id)
+        if not attachment:
+            return {}
+        
+        sizes = self.preview_generator.sizes
+        generated = self.preview_generator.generate(attachment.content, attachment.mime_type) or {}
+        result = dict((size, AttachmentPreview(*generated[size]) if size in generated else None) for size in sizes)
+        
+        # Only stored for processed attachments: the content type of a pending attachment may yet change with sniffing.
+        connection = self.pool.acquire()
+        try:
+            c = connection.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            
+            c.executemany('''
+            INSERT INTO ATTACHMENT_PREVIEW
+              (ATTACHMENT_ID, PREVIEW_SIZE, MIME_TYPE, CONTENT)
+              SELECT
+                  ?, ?, ?, ?
+                WHERE EXISTS (
+                    SELECT *
+                      FROM ATTACHMENT
+                      WHERE ATTACHMENT_ID = ?
+                        AND SPOOL_FNAME IS NULL
+                )
+              ON CONFLICT (ATTACHMENT_ID, PREVIEW_SIZE) DO NOTHING
+            ''', [(attachment_id, size, preview.mime_type if preview else None, preview.content if preview else None,
+                    attachment_id) for size, preview in result.items()])
+            
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            self.pool.release(connection)
+        
+        return result
+    
+    def __fetch_row(self, attachment_id):
+        connection = self.pool.acquire()
+        try:
+            c = connection.cursor()
             
+            c.execute('''
+            SELECT
+                a.ATTACHMENT_NM
+                , a.MIME_TYPE
+                , a.SPOOL_FNAME
+                , b.CONTENT
+              FROM ATTACHMENT a
+              LEFT JOIN ATTACHMENT_BLOB b
+                ON b.CONTENT_HASH = a.CONTENT_HASH
+              WHERE a.ATTACHMENT_ID = ?
+            ''', (attachment_id,))
             
-            # Cleanup
-            self.__cleanup(c)
+            r = c.fetchone()
             
             connection.commit()
         except Exception as e:
             connection.rollback()
             raise e
         finally:
-            connection.close()
-    
-    
-    def __cleanup(self, c):
-        c.execute('''
-        DELETE FROM NOTE_ATTACHMENT
-          WHERE NOTE_ID NOT IN (
-              SELECT NOTE_ID
-                FROM TASK_NOTE
-          )
-        ''')
-        
-        c.execute('''
-        DELETE FROM ATTACHMENT
-          WHERE ATTACHMENT_ID NOT IN (
-              SELECT ATTACHMENT_ID
-                FROM NOTE_ATTACHMENT
-          )
-        ''')
+            self.pool.release(connection)
         
-        c.execute('''
-        DELETE FROM NOTE
-          WHERE NOTE_ID NOT IN (
-              SELECT NOTE_ID
-                FROM TASK_NOTE
-          )
-        ''')
-    
-    
-    def __reference_rs(self, c):
-        return [TaskReference(r['TASK_ID'], r['TASK_NM'], TaskStatus(r['STATUS_ID']), r['DUE_TS'], r['MOD_TS']) for r in c]
+        return r
 
 
-class NoteService:
-    def __init__(self, db_fname):
+
+class JobService:
+    '''
+    Persistent queue of background jobs, run by taskwebapp.jobs.JobRunner. Jobs are queued READY (see insert_jobs),
+    claimed by marking them RUNNING and deleted once complete. Failed jobs are retried after an exponentially growing
+    delay (retry_delay_s, doubling up to max_retry_delay_s) until max_attempts is reached, then kept as FAILED along with
+    their last error.
+    '''
+    
+    def __init__(self, db_fname, pool=None, max_attempts=5, retry_delay_s=2.0, max_retry_delay_s=600.0):
         self.db_fname = db_fname
+        self.pool = pool or ConnectionPool(db_fname)
+        self.max_attempts = max_attempts
+        self.retry_delay_s = retry_delay_s
+        self.max_retry_delay_s = max_retry_delay_s
     
-    def create_notes(self, notes):
+    def enqueue(self, job_type, payloads):
         '''
-        notes dict[int] = TaskNote: list of TaskNotes to create by reference number
+        job_type (str): Type of the jobs, as registered with JobRunner.add_handler
+        payloads (seq): JSON-compatible payloads, one per job
         
-        Creates notes in notes, assigning permanent IDs. Updates note_id on given TaskNotes.
+        returns list[int]: IDs of the queued jobs
         '''
         
-        if not notes:
-            return
+        connection = self.pool.acquire()
+        try:
+            c = connection.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            
+            result = insert_jobs(c, job_type, payloads)
+            
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            self.pool.release(connection)
         
-        now = datetime.now()
-        connection = get_connection(self.db_fname)
+        return result
+    
+    def claim(self):
+        '''
+        returns Job: The longest waiting job that is due, now RUNNING; None if no job is due.
+        '''
+        
+        connection = self.pool.acquire()
         try:
             c = connection.cursor()
             
-            for local_id, note in notes.items():
+            # Looked up before taking the write lock, so polling an empty queue does not block writers. The update only
+            # succeeds for one of several workers finding the same job; ATTEMPTS tells a job claimed (and failed) since
+            # the lookup from one still waiting.
+            while True:
                 c.execute('''
-                INSERT INTO NOTE
-                  (TEXT, MOD_TS)
-                  VALUES (?, ?)
-                ''', (note.text, now))
+                SELECT
+                    JOB_ID
+                    , JOB_TYPE
+                    , PAYLOAD
+                    , ATTEMPTS
+                  FROM JOB
+                  WHERE STATE_ID = ?
+                    AND RUN_AFTER_TS <= ?
+                  ORDER BY RUN_AFTER_TS, JOB_ID
+                  LIMIT 1
+                ''', (JobState.READY.value, to_epoch(datetime.now())))
+                r = c.fetchone()
+                connection.commit()
+                if not r:
+                    return None
                 
-                c.execute('SELECT last_insert_rowid()')
-                note.note_id = next(c)[0]
+                job_id, job_type, payload, attempts = r
+                c.execute('BEGIN IMMEDIATE')
+                c.execute('''
+                UPDATE JOB
+                  SET STATE_ID = ?
+                      , ATTEMPTS = ATTEMPTS + 1
+                  WHERE JOB_ID = ?
+                    AND STATE_ID = ?
+                    AND ATTEMPTS = ?
+                ''', (JobState.RUNNING.value, job_id, JobState.READY.value, attempts))
+                claimed = c.rowcount
+                connection.commit()
                 
-            
-            c.executemany('''
-            INSERT INTO NOTE_ATTACHMENT
-              (NOTE_ID, ATTACHMENT_ID)
-              VALUES (?, ?)
-            ''', [(n.note_id, a.attachment_id) for n in notes.values() for a in n.attachment_references])
-            
-            connection.commit()
+                if claimed:
+                    return Job(job_id, job_type, json.loads(payload), attempts + 1)
         except Exception as e:
             connection.rollback()
             raise e
         finally:
-            connection.close()
+            self.pool.release(connection)
+    
+    def complete(self, job):
+        self.__execute('''
+        DELETE FROM JOB
+          WHERE JOB_ID = ?
+        ''', (job.job_id,))
+    
+    def fail(self, job, error):
+        '''
+        job (Job): Claimed job
+        error (str): Description of the failure
+        
+        returns JobState: READY if the job will be retried, otherwise FAILED
+        '''
         
+        if job.attempts >= self.max_attempts:
+            state = JobState.FAILED
+            run_after = datetime.now()
+        else:
+            state = JobState.READY
+            run_after = datetime.now() + timedelta(seconds=min(self.retry_delay_s * 2 ** (job.attempts - 1),
+                    self.max_retry_delay_s))
+        
+        self.__execute('''
+        UPDATE JOB
+          SET STATE_ID = ?
+              , RUN_AFTER_TS = ?
+              , LAST_ERROR = ?
+          WHERE JOB_ID = ?
+        ''', (state.value, to_epoch(run_after), error, job.job_id))
+        return state
     
-    def update_notes(self, notes):
+    def recover(self):
         '''
-        notes (TaskNote[]): TaskNotes to update
+        returns int: Number of jobs reset from RUNNING to READY; intended to be called before any worker starts, when
+        RUNNING jobs are those interrupted by a previous shutdown.
         '''
         
-        if not notes:
-            return
+        return self.__execute('''
+        UPDATE JOB
+          SET STATE_ID = ?
+          WHERE STATE_ID = ?
+        ''', (JobState.READY.value, JobState.RUNNING.value))
+    
+    def stats(self):
+        '''
+        returns dict[str] = int: Number of jobs by state name.
+        '''
         
-        now = datetime.now()
-        connection = get_connection(self.db_fname)
+        result = dict((s.name, 0) for s in JobState)
+        connection = self.pool.acquire()
         try:
             c = connection.cursor()
             
-            # Validation
-            c.execute('''
-            CREATE TEMPORARY TABLE TT_NOTE (
-              NOTE_ID INTEGER
-            )
-            ''')
-            
-            
-            c.executemany('''
-            INSERT INTO TT_NOTE
-              (NOTE_ID)
-              VALUES (?)
-            ''', [(n.note_id,) for n in notes])
-            
             c.execute('''
             SELECT
-                NOTE_ID
-              FROM TT_NOTE
-              WHERE NOTE_ID NOT IN (
-                  SELECT NOTE_ID
-                    FROM NOTE
-              )
-            ''')
-            
-            invalid_ids = [r[0] for r in c]
-            if invalid_ids:
-                raise ValueError(f'Invalid IDs in given notes: {invalid_ids}')
-            
-            
-            # Update Note Text
-            update_params = []
-            for note in notes:
-                update_params.append((note.text, now, note.note_id, note.text))
-                
-            c.executemany('''
-            UPDATE NOTE
-              SET TEXT = ?, MOD_TS = ?
-              WHERE NOTE_ID = ?
-                AND TEXT <> ?
-            ''', update_params)
-            
-            
-            # Update Note Attachments
-            c.execute('''
-            CREATE TEMPORARY TABLE TT_NOTE_ATT (
-              NOTE_ID INTEGER
-              , ATTACHMENT_ID INTEGER
-            )
-            ''')
-            
-            c.executemany('''
-            INSERT INTO TT_NOTE_ATT
-              (NOTE_ID, ATTACHMENT_ID)
-              VALUES (?, ?)
-            ''', [(n.note_id, a.attachment_id) for n in notes for a in n.attachment_references])
-            
-            c.execute('''
-            DELETE FROM NOTE_ATTACHMENT AS t
-              WHERE NOTE_ID IN (
-                  SELECT NOTE_ID
-                    FROM TT_NOTE_ATT
-              )
-                AND NOT EXISTS (
-                    SELECT *
-                      FROM TT_NOTE_ATT
-                      WHERE NOTE_ID = t.NOTE_ID
-                        AND ATTACHMENT_ID = t.ATTACHMENT_ID
-                )
+                STATE_ID
+                , count(*)
+              FROM JOB
+              GROUP BY STATE_ID
             ''')
+            for state_id, count in c:
+                result[JobState(state_id).name] = count
             
-            c.execute('''
-            INSERT INTO NOTE_ATTACHMENT
-              (NOTE_ID, ATTACHMENT_ID)
-              SELECT
-                  NOTE_ID
-                  , ATTACHMENT_ID
-                FROM TT_NOTE_ATT
-                WHERE true
-              ON CONFLICT DO NOTHING
-            ''')
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            self.pool.release(connection)
+        
+        return result
+    
+    def __execute(self, sql, params):
+        connection = self.pool.acquire()
+        try:
+            c = connection.cursor()
+            c.execute('BEGIN IMMEDIATE')
             
+            c.execute(sql, params)
+            result = c.rowcount
             
             connection.commit()
         except Exception as e:
             connection.rollback()
             raise e
         finally:
-            connection.close()
+            self.pool.release(connection)
+        
+        return result
 
 
-class AttachmentService:
-    def __init__(self, db_fname):
+
+class MaintenanceService:
+
+    def __init__(self, db_fname, orphan_grace_period=timedelta(hours=1), analysis_limit=1000):
         self.db_fname = db_fname
+        self.orphan_grace_period = orphan_grace_period
+        self.analysis_limit = analysis_limit
     
-    def create_attachments(self, attachments):
+    def optimize(self, budget_s=None):
         '''
-        attachments (dict[int] = seq[MultipartWrapper]): Attachments
+        budget_s (float): Maximum run time in seconds; None for no limit
         
-        returns seq[AttachmentReference]
+        Runs PRAGMA optimize, which re-analyzes tables whose statistics are likely out of date.
         '''
         
-        result = {}
-        if not attachments:
-            return result
+        result = self.__run_budgeted(budget_s, f'PRAGMA analysis_limit = {self.analysis_limit}', 'PRAGMA optimize')
+        result.pop('rows', None)
+        return result
+    
+    def analyze(self, budget_s=None):
+        '''
+        budget_s (float): Maximum run time in seconds; None for no limit
+        
+        Runs ANALYZE on all tables (with approximate statistics, per analysis_limit).
+        '''
+        
+        result = self.__run_budgeted(budget_s, f'PRAGMA analysis_limit = {self.analysis_limit}', 'ANALYZE')
+        result.pop('rows', None)
+        return result
+    
+    def checkpoint(self, budget_s=None):
+        '''
+        budget_s (float): Maximum run time in seconds; None for no limit
+        
+        Runs a passive WAL checkpoint, i.e. copies as much of the WAL into the database as possible without waiting on
+        readers or writers.
+        '''
+        
+        result = self.__run_budgeted(budget_s, 'PRAGMA wal_checkpoint(PASSIVE)')
+        if 'rows' in result:
+            busy, log_pages, checkpointed_pages = result.pop('rows')[0]
+            result['busy'] = busy
+            result['wal_pages'] = log_pages
+            result['checkpointed_pages'] = checkpointed_pages
+        return result
+    
+    def incremental_vacuum(self, max_pages=None, budget_s=None):
+        '''
+        max_pages (int): Maximum number of free pages to reclaim; None for all
+        budget_s (float): Maximum run time in seconds; None for no limit
+        
+        Returns free pages to the file system. Requires auto_vacuum = INCREMENTAL (see enable_incremental_vacuum); a no-op
+        otherwise.
+        '''
         
-        now = datetime.now()
         connection = get_connection(self.db_fname)
         try:
             c = connection.cursor()
             
-            for id, parts in attachments.items():
-                attachment_references = []
-                for part in parts:
-                    with open(part.value, 'rb') as f:
-                        c.execute('''
-                        INSERT INTO ATTACHMENT
-                          (ATTACHMENT_NM, MIME_TYPE, CONTENT, CRTN_TS)
-                          VALUES (?, ?, ?, ?)
-                        ''', (part.filename, part.mime_type, f.read(), now))
-                        
-                        c.execute('SELECT last_insert_rowid()')
-                        attachment_id = next(c)[0]
-                        
-                        attachment_references.append(AttachmentReference(attachment_id, part.filename, part.mime_type, now))
-                result[id] = attachment_references
+            c.execute('PRAGMA auto_vacuum')
+            if next(c)[0] != 2:
+                return {'skipped': 'auto_vacuum is not INCREMENTAL'}
             
-            connection.commit()
-        except Exception as e:
-            connection.rollback()
-            raise e
+            c.execute('PRAGMA freelist_count')
+            free_before = next(c)[0]
         finally:
             connection.close()
         
+        result = self.__run_budgeted(budget_s, f'PRAGMA incremental_vacuum({int(max_pages) if max_pages else 0})', 'PRAGMA freelist_count')
+        if 'rows' in result:
+            free_after = result.pop('rows')[0][0]
+            result['reclaimed_pages'] = free_before - free_after
+            result['free_pages'] = free_after
         return result
     
-    
-    def resolve_attachments(self, attachment_mapping):
+    def enable_incremental_vacuum(self):
         '''
-        attachment_ids (dict[int] = seq[int]): reference numbers matched to sequences of attachment IDs to resolve
-        
-        returns dict[int] = seq[AttachmentReference]: resolved AttachmentReferences mapped to given reference numbers
+        Switches the database to auto_vacuum = INCREMENTAL. Existing databases require a full VACUUM for this, which
+        rewrites the entire file; intended to be run once, before the server accepts requests.
         '''
         
-        result = {}
-        if not attachment_mapping:
-            return result
-        
         connection = get_connection(self.db_fname)
         try:
             c = connection.cursor()
             
-            c.execute('''
-            CREATE TEMPORARY TABLE TT_ATTACHMENT_REF (
-              REF_ID INTEGER
-              , ATTACHMENT_ID INTEGER
-            )
-            ''')
-            
-            c.executemany('''
-            INSERT INTO TT_ATTACHMENT_REF
-              (REF_ID, ATTACHMENT_ID)
-              VALUES (?, ?)
-            ''', [(ref_id, attachment_id) for ref_id, attachment_ids in attachment_mapping.items() for attachment_id in attachment_ids])
-            
-            c.execute('''
-            SELECT
-                r.REF_ID
-                , a.ATTACHMENT_ID
-                , a.ATTACHMENT_NM
-                , a.MIME_TYPE
-                , a.CRTN_TS
-              FROM TT_ATTACHMENT_REF r
-              JOIN ATTACHMENT a
-                ON a.ATTACHMENT_ID = r.ATTACHMENT_ID
-            ''')
+            c.execute('PRAGMA auto_vacuum')
+            if next(c)[0] == 2:
+                return False
             
-            for r in c:
-                ref_id = r['REF_ID']
-                if ref_id in result:
-                    attachment_references = result[ref_id]
-                else:
-                    attachment_references = result[ref_id] = []
-                attachment_references.append(AttachmentReference(r['ATTACHMENT_ID'], r['ATTACHMENT_NM'], r['MIME_TYPE'], r['CRTN_TS']))
+            c.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            c.execute('VACUUM')
+        finally:
+            connection.close()
+        
+        return True
+    
+    def __run_budgeted(self, budget_s, *statements):
+        '''
+        Executes the given statements, aborting them once budget_s has elapsed. Rows of the last statement are returned
+        under 'rows', unless interrupted.
+        '''
+        
+        connection = get_connection(self.db_fname)
+        if budget_s is not None:
+            deadline = time.monotonic() + budget_s
+            connection.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+        
+        try:
+            c = connection.cursor()
+            for statement in statements:
+                c.execute(statement)
+                rows = c.fetchall()
             
             connection.commit()
+        except sqlite3.OperationalError as e:
+            connection.rollback()
+            if str(e) != 'interrupted':
+                raise e
+            return {'interrupted': True}
         except Exception as e:
             connection.rollback()
             raise e
         finally:
             connection.close()
         
-        return result
+        return {'rows': rows}
     
-    
-    def fetch_attachment(self, attachment_id):
+    def sweep_orphans(self, budget_s=None, batch_size=1000):
         '''
-        attachment_id (int): ID of the attachment to fetch.
+        budget_s (float): Maximum run time in seconds; None for no limit
+        batch_size (int): Maximum number of notes, attachments or content rows deleted per transaction
         
-        returns Attachment: Attachment matching the given ID if it exists, otherwise None.
+        Deletes notes not belonging to any task, note/attachment relationships of such notes, attachments not belonging to
+        any note, and attachment previews and content no attachment refers to. Rows created within the grace period are
+        left alone, as they may belong to a write still in progress (notes and attachments are created before the task that
+        references them); content is stored and referenced in one transaction, so needs no grace period.
+        
+        Rows are deleted in batches, each in its own transaction, so writers are held up for one batch at most. Once
+        budget_s has elapsed, the current batch is abandoned and the remaining orphans are left to the next run.
+        
+        returns dict[str] = int: Number of rows deleted, by table name; with 'interrupted' if the budget ran out.
         '''
         
+        cutoff = to_epoch(datetime.now() - self.orphan_grace_period)
+        steps = [
+            ('NOTE_ATTACHMENT', '''
+            DELETE FROM NOTE_ATTACHMENT
+              WHERE NOTE_ID IN (
+                  SELECT NOTE_ID
+                    FROM NOTE n
+                    WHERE MOD_TS < ?
+                      AND NOT EXISTS (
+                          SELECT *
+                            FROM TASK_NOTE
+                            WHERE NOTE_ID = n.NOTE_ID
+                      )
+                      AND EXISTS (
+                          SELECT *
+                            FROM NOTE_ATTACHMENT
+                            WHERE NOTE_ID = n.NOTE_ID
+                      )
+                    LIMIT ?
+              )
+            ''', (cutoff, batch_size)),
+            ('NOTE', '''
+            DELETE FROM NOTE
+              WHERE NOTE_ID IN (
+                  SELECT NOTE_ID
+                    FROM NOTE n
+                    WHERE MOD_TS < ?
+                      AND NOT EXISTS (
+                          SELECT *
+                            FROM TASK_NOTE
+                            WHERE NOTE_ID = n.NOTE_ID
+                      )
+                    LIMIT ?
+              )
+            ''', (cutoff, batch_size)),
+            ('ATTACHMENT', '''
+            DELETE FROM ATTACHMENT
+              WHERE ATTACHMENT_ID IN (
+                  SELECT ATTACHMENT_ID
+                    FROM ATTACHMENT a
+                    WHERE CRTN_TS < ?
+                      AND NOT EXISTS (
+                          SELECT *
+                            FROM NOTE_ATTACHMENT
+                            WHERE ATTACHMENT_ID = a.ATTACHMENT_ID
+                      )
+                    LIMIT ?
+              )
+            ''', (cutoff, batch_size)),
+            ('ATTACHMENT_PREVIEW', '''
+            DELETE FROM ATTACHMENT_PREVIEW
+              WHERE ATTACHMENT_ID IN (
+                  SELECT DISTINCT ATTACHMENT_ID
+                    FROM ATTACHMENT_PREVIEW p
+                    WHERE NOT EXISTS (
+                        SELECT *
+                          FROM ATTACHMENT
+                          WHERE ATTACHMENT_ID = p.ATTACHMENT_ID
+                    )
+                    LIMIT ?
+              )
+            ''', (batch_size,)),
+            ('ATTACHMENT_BLOB', '''
+            DELETE FROM ATTACHMENT_BLOB
+              WHERE BLOB_ID IN (
+                  SELECT BLOB_ID
+                    FROM ATTACHMENT_BLOB b
+                    WHERE NOT EXISTS (
+                        SELECT *
+                          FROM ATTACHMENT
+                          WHERE CONTENT_HASH = b.CONTENT_HASH
+                    )
+                    LIMIT ?
+              )
+            ''', (batch_size,))
+        ]
+        
         connection = get_connection(self.db_fname)
+        if budget_s is not None:
+            deadline = time.monotonic() + budget_s
+            connection.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+        
+        result = dict((table, 0) for table, sql, parameters in steps)
         try:
             c = connection.cursor()
-            
-            c.execute('''
-            SELECT
-                ATTACHMENT_NM
-                , MIME_TYPE
-                , CONTENT
-                , CRTN_TS
-              FROM ATTACHMENT
-              WHERE ATTACHMENT_ID = ?
-            ''', (attachment_id,))
-            
-            r = c.fetchone()
-            if not r:
-                connection.commit()
-                return None
-            
-            result = Attachment(r['ATTACHMENT_NM'], r['CONTENT'], r['MIME_TYPE'])
-            
-            connection.commit()
+            for table, sql, parameters in steps:
+                # A batch selects fewer than batch_size keys (each with at least one row) only once none are left.
+                rowcount = batch_size
+                while rowcount >= batch_size:
+                    c.execute('BEGIN IMMEDIATE')
+                    c.execute(sql, parameters)
+                    rowcount = c.rowcount
+                    connection.commit()
+                    result[table] += rowcount
+        except sqlite3.OperationalError as e:
+            connection.rollback()
+            if str(e) != 'interrupted':
+                raise e
+            result['interrupted'] = True
         except Exception as e:
             connection.rollback()
             raise e
         finally:
             connection.close()
         
-        
         return result
 
 
 
 class TagService:
-    
-    def __init__(self, db_fname):
+
+    def __init__(self, db_fname, pool=None):
         self.db_fname = db_fname
+        self.pool = pool or ConnectionPool(db_fname)
     
     def get_matches(self, q):
         if not q:
             return []
         
-        connection = get_connection(self.db_fname)
+        connection = self.pool.acquire()
         try:
             c = connection.cursor()
             
@@ -1025,14 +2861,14 @@ class TagService:
               WHERE CASEFOLD(TAG_TEXT) LIKE ? ESCAPE '+'
             ''', (f'%{like_escape(q)}%',))
             
-            result = [r['TAG_TEXT'] for r in c]
+            result = [r[0] for r in c]
             
             connection.commit()
         except Exception as e:
             connection.rollback()
             raise e
         finally:
-            connection.close()
+            self.pool.release(connection)
         
         return result
 
@@ -1059,32 +2895,39 @@ class CriteriaBuilder:
             if field == TaskSearchField.NAME and isinstance(op, TaskSearchStrOp):
                 self.__str_op('TASK_NM', op, criteria.value)
             elif field == TaskSearchField.DUE and isinstance(op, TaskSearchNumOp):
-                self.__num_op('DUE_TS', op, criteria.value)
+                self.__num_op('DUE_TS', op, to_epoch(criteria.value))
             else:
                 raise InvalidCriteriaException(field, op)
         elif isinstance(criteria, TaskSearchIsAnyExpr):
             field = criteria.field
             params = self.params
             
+            # Value lists are bound as a single JSON array, so the statement text does not vary with their length.
             if field == TaskSearchField.STATUS:
-                self.sql.append(f'STATUS_ID IN ({", ".join("?" for c in criteria.values)})')
-                for val in criteria.values:
-                    params.append(val.value)
-                
+                self.sql.append('''
+                STATUS_ID IN (
+                    SELECT value
+                      FROM json_each(?)
+                )
+                ''')
+                params.append(json.dumps([val.value for val in criteria.values]))
+            
             elif field == TaskSearchField.TAGS:
-                self.sql.append(f'''
+                self.sql.append('''
                 TASK_ID IN (
                     SELECT TASK_ID
                       FROM TASK_TAG
                       WHERE TAG_ID IN (
                           SELECT TAG_ID
                             FROM TAG
-                            WHERE TAG_TEXT IN ($CLAUSE$)
+                            WHERE TAG_TEXT IN (
+                                SELECT value
+                                  FROM json_each(?)
+                            )
                       )
                 )
-                '''.replace('$CLAUSE$', ", ".join("?" for c in criteria.values)))
-                for val in criteria.values:
-                    params.append(val)
+                ''')
+                params.append(json.dumps(list(criteria.values)))
             else:
                 raise InvalidCriteriaException(field, 'IS ANY')
         elif isinstance(criteria, TaskSearchExpr):
@@ -1095,7 +2938,7 @@ class CriteriaBuilder:
                 sql_op = 'OR'
             else:
                 raise ValueError(op)
-                
+            
             self.add_criteria(criteria.left_expr)
             self.sql.append(sql_op)
             self.add_criteria(criteria.right_expr)
@@ -0,0 +1,238 @@
+# Imports
+# Standard
+import re
+import sys
+import time
+import sqlite3
+
+from datetime import datetime
+from threading import Lock
+from weakref import WeakSet
+
+
+# Definitions
+whitespace_pattern = re.compile(r'\s+')
+param_list_pattern = re.compile(r'\?(?:\s*,\s*\?)+')
+
+def normalize_sql(sql):
+    '''
+    Collapses whitespace and runs of positional parameters ("?, ?, ?" becomes "?, ..."), so statements that only
+    differ in formatting or IN-list length aggregate together.
+    '''
+    return param_list_pattern.sub('?, ...', whitespace_pattern.sub(' ', sql).strip())
+
+
+# Tracer
+tracer = None
+
+def set_tracer(value):
+    '''
+    value (SqlTracer): Tracer for connections subsequently created by get_connection; None disables tracing.
+    '''
+    global tracer
+    tracer = value
+
+
+class StatementStats:
+    def __init__(self):
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.rows = 0
+        self.params = 0
+        self.slow = 0
+
+
+class SqlTracer:
+    '''
+    Aggregates statement statistics (by normalized text) and writes statements slower than slow_threshold_s, along with
+    their query plans, to the slow-query log (stdout if not given).
+    '''
+
+    def __init__(self, slow_threshold_s=0.1, slow_log=None):
+        self.slow_threshold_s = slow_threshold_s
+        self.slow_log = slow_log
+        self.stats = {}
+        self.lock = Lock()
+
+    def record(self, connection, sql, parameters, param_count, rows, elapsed_s):
+        normalized = normalize_sql(sql)
+        slow = self.slow_threshold_s is not None and elapsed_s >= self.slow_threshold_s
+
+        with self.lock:
+            stats = self.stats.get(normalized)
+            if stats is None:
+                stats = self.stats[normalized] = StatementStats()
+            stats.count += 1
+            stats.total_s += elapsed_s
+            stats.max_s = max(stats.max_s, elapsed_s)
+            stats.rows += rows
+            stats.params += param_count
+            if slow:
+                stats.slow += 1
+
+        if slow:
+            self.__log_slow(connection, sql, normalized, parameters, param_count, rows, elapsed_s)
+
+    def snapshot(self):
+        with self.lock:
+            return dict((k, (v.count, v.total_s, v.max_s, v.rows, v.params, v.slow)) for k, v in self.stats.items())
+
+    def __log_slow(self, connection, sql, normalized, parameters, param_count, rows, elapsed_s):
+        lines = [f'{datetime.now().isoformat(" ", "seconds")} Slow query ({elapsed_s * 1000:.1f}ms, {param_count} params, {rows} rows): {normalized}']
+
+        if parameters is not None and normalized.split(' ', 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+            try:
+                c = sqlite3.Cursor(connection)
+                c.execute(f'EXPLAIN QUERY PLAN {sql}', parameters)
+                for r in c:
+                    lines.append(f'    {r[3]}')
+                c.close()
+            except sqlite3.Error as e:
+                lines.append(f'    (query plan unavailable: {e})')
+
+        text = '\n'.join(lines) + '\n'
+        with self.lock:
+            if self.slow_log:
+                with open(self.slow_log, 'a') as f:
+                    f.write(text)
+            else:
+                sys.stdout.write(text)
+
+
+
+# Connection/Cursor
+class TracingConnection(sqlite3.Connection):
+    '''
+    Connection whose cursors report every statement to the tracer that was active when the connection was created.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tracer = tracer
+        self.open_cursors = WeakSet()
+
+    def cursor(self, factory=None):
+        c = super().cursor(factory or TracingCursor)
+        if isinstance(c, TracingCursor):
+            self.open_cursors.add(c)
+        return c
+
+    def close(self):
+        for c in list(self.open_cursors):
+            c.finish_statement()
+        super().close()
+
+
+class TracingCursor(sqlite3.Cursor):
+    '''
+    Cursor timing each statement from execution until its results are exhausted (or the next statement is executed, or
+    the cursor/connection is closed), counting rows returned (or affected).
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.trace_sql = None
+
+    def execute(self, sql, parameters=()):
+        self.finish_statement()
+        self.__begin(sql, parameters, len(parameters))
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.trace_elapsed += time.perf_counter() - start
+
+    def executemany(self, sql, seq_of_parameters):
+        self.finish_statement()
+        seq_of_parameters = list(seq_of_parameters)
+        self.__begin(sql, None, sum(len(p) for p in seq_of_parameters))
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.trace_elapsed += time.perf_counter() - start
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self.trace_elapsed += time.perf_counter() - start
+            self.finish_statement()
+            raise
+        self.trace_elapsed += time.perf_counter() - start
+        self.trace_rows += 1
+        return row
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self.trace_elapsed += time.perf_counter() - start
+        if row is None:
+            self.finish_statement()
+        else:
+            self.trace_rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self.trace_elapsed += time.perf_counter() - start
+        if rows:
+            self.trace_rows += len(rows)
+        else:
+            self.finish_statement()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self.trace_elapsed += time.perf_counter() - start
+        self.trace_rows += len(rows)
+        self.finish_statement()
+        return rows
+
+    def close(self):
+        self.finish_statement()
+        super().close()
+
+    def finish_statement(self):
+        sql = self.trace_sql
+        if sql is None:
+            return
+        self.trace_sql = None
+
+        rows = self.trace_rows or max(self.rowcount, 0)
+        self.connection.tracer.record(self.connection, sql, self.trace_parameters, self.trace_param_count, rows, self.trace_elapsed)
+
+    def __begin(self, sql, parameters, param_count):
+        self.trace_sql = sql
+        self.trace_parameters = parameters
+        self.trace_param_count = param_count
+        self.trace_rows = 0
+        self.trace_elapsed = 0.0
+
+
+
+# Metrics
+def add_sql_collector(registry, sql_tracer):
+    '''
+    Exports per-statement aggregates of the given tracer, labelled by normalized statement text.
+    '''
+
+    label_names = ('statement',)
+    executions = registry.collected_counter('taskwebapp_sql_executions_total', 'Statement executions.', label_names)
+    seconds = registry.collected_counter('taskwebapp_sql_seconds_total', 'Total statement wall time (execution and fetching).', label_names)
+    max_seconds = registry.gauge('taskwebapp_sql_max_seconds', 'Slowest single execution of the statement.', label_names)
+    rows = registry.collected_counter('taskwebapp_sql_rows_total', 'Rows returned (or affected) by the statement.', label_names)
+    params = registry.collected_counter('taskwebapp_sql_parameters_total', 'Parameters bound to the statement.', label_names)
+    slow = registry.collected_counter('taskwebapp_sql_slow_total', 'Executions over the slow query threshold.', label_names)
+
+    def collect():
+        for statement, values in sql_tracer.snapshot().items():
+            label_values = (statement,)
+            for metric, value in zip((executions, seconds, max_seconds, rows, params, slow), values):
+                metric.set(label_values, value)
+
+    registry.add_collector(collect)
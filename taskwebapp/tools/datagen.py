@@ -0,0 +1,349 @@
+'''
+Synthetic dataset generator for scale testing.
+
+Bulk-inserts tasks, tags, notes and attachments (along with their relationships) into a database created through
+get_connection, so the result has the real schema. Rows are inserted with batched executemany calls inside a single
+transaction; IDs continue from the existing maximum, so an existing database can be extended:
+
+    python -m taskwebapp.tools.datagen --sqlite-db /tmp/scale.sqlite --tasks 1000000
+    python -m taskwebapp.tools.datagen --sqlite-db /tmp/scale.sqlite --tasks 10000 --tags-per-task poisson:4 \\
+        --attachments-per-task uniform:0:3 --attachment-size lognormal:10:1.5
+
+Count and size distributions are given as <kind>:<params>: const:N, uniform:A:B, poisson:MEAN, lognormal:MU:SIGMA.
+'''
+
+# Imports
+# Standard
+import os
+import math
+import hashlib
+import time
+import random
+
+from argparse import ArgumentParser, ArgumentTypeError
+from datetime import datetime, timedelta
+
+# User
+from taskwebapp.domain.task import TaskStatus
+from taskwebapp.service.sqlite import get_connection, to_epoch
+
+
+# Definitions
+words = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet', 'kilo', 'lima',
+         'mike', 'november', 'oscar', 'papa', 'quebec', 'romeo', 'sierra', 'tango', 'uniform', 'victor', 'whiskey',
+         'review', 'deploy', 'invoice', 'meeting', 'report', 'release', 'budget', 'backup', 'migrate', 'renew']
+
+mime_types = ['application/pdf', 'image/png', 'image/jpeg', 'text/plain', 'application/octet-stream']
+
+
+# Distributions
+class Distribution:
+    '''
+    Non-negative integer distribution parsed from a <kind>:<params> spec.
+    '''
+
+    kinds = {
+        'const': 1,
+        'uniform': 2,
+        'poisson': 1,
+        'lognormal': 2,
+    }
+
+    def __init__(self, spec):
+        kind, *params = spec.split(':')
+        if kind not in Distribution.kinds or len(params) != Distribution.kinds[kind]:
+            raise ArgumentTypeError(f'Invalid distribution: {spec}')
+        try:
+            params = [float(p) for p in params]
+        except ValueError:
+            raise ArgumentTypeError(f'Invalid distribution: {spec}')
+
+        self.spec = spec
+        self.kind = kind
+        self.params = params
+
+    def sample(self, rnd):
+        params = self.params
+        kind = self.kind
+        if kind == 'const':
+            return int(params[0])
+        elif kind == 'uniform':
+            return rnd.randint(int(params[0]), int(params[1]))
+        elif kind == 'poisson':
+            # Knuth's method; adequate for the small means used for per-task counts.
+            limit = math.exp(-params[0])
+            k = 0
+            p = rnd.random()
+            while p > limit:
+                k += 1
+                p *= rnd.random()
+            return k
+        else:
+            return int(rnd.lognormvariate(params[0], params[1]))
+
+    def __str__(self):
+        return self.spec
+
+
+def parse_weights(spec):
+    '''
+    Parses "READY=4,COMPLETE=10,..." into {TaskStatus: weight}.
+    '''
+
+    result = {}
+    try:
+        for item in spec.split(','):
+            name, weight = item.split('=')
+            result[TaskStatus[name.strip().upper()]] = float(weight)
+    except (KeyError, ValueError):
+        raise ArgumentTypeError(f'Invalid status weights: {spec}')
+    return result
+
+
+
+# Generation
+class Generator:
+    '''
+    Generates rows for the given connection. Tag popularity follows a Zipf-like distribution (tag_skew 0 makes all tags
+    equally likely), task and note modification times are spread over the preceding history_days, and due dates over
+    [-due_past_days, due_future_days] days from now.
+    '''
+
+    def __init__(self, connection, rnd, status_weights, tag_count, tag_skew, tags_per_task, notes_per_task,
+                 attachments_per_task, attachment_size, max_attachment_size, due_null_ratio, due_past_days,
+                 due_future_days, history_days, batch_size):
+        self.connection = connection
+        self.rnd = rnd
+        self.statuses = list(status_weights)
+        self.status_cum_weights = cumulative(status_weights.values())
+        self.tag_count = tag_count
+        self.tag_skew = tag_skew
+        self.tags_per_task = tags_per_task
+        self.notes_per_task = notes_per_task
+        self.attachments_per_task = attachments_per_task
+        self.attachment_size = attachment_size
+        self.max_attachment_size = max_attachment_size
+        self.due_null_ratio = due_null_ratio
+        self.due_past_days = due_past_days
+        self.due_future_days = due_future_days
+        self.history_days = history_days
+        self.batch_size = batch_size
+
+        self.now = datetime.now()
+        # Attachment contents are slices of a single random block.
+        self.content_block = rnd.randbytes(min(max_attachment_size, 1024 * 1024)) * (max_attachment_size // (1024 * 1024) + 1)
+
+        self.counts = dict((t, 0) for t in ('TASK', 'TAG', 'TASK_TAG', 'NOTE', 'TASK_NOTE', 'ATTACHMENT', 'ATTACHMENT_BLOB', 'NOTE_ATTACHMENT'))
+
+    def run(self, task_count, orphan_notes=0, orphan_attachments=0, progress=print):
+        c = self.connection.cursor()
+        c.execute('BEGIN IMMEDIATE')
+        try:
+            tag_ids, tag_cum_weights = self.__create_tags(c)
+
+            next_task_id = self.__next_id(c, 'TASK', 'TASK_ID')
+            next_note_id = self.__next_id(c, 'NOTE', 'NOTE_ID')
+            next_attachment_id = self.__next_id(c, 'ATTACHMENT', 'ATTACHMENT_ID')
+
+            start = time.monotonic()
+            for batch_start in range(0, task_count, self.batch_size):
+                batch_count = min(self.batch_size, task_count - batch_start)
+                next_note_id, next_attachment_id = self.__create_batch(c, next_task_id + batch_start, batch_count,
+                        next_note_id, next_attachment_id, tag_ids, tag_cum_weights)
+
+                done = batch_start + batch_count
+                elapsed_s = time.monotonic() - start
+                progress(f'{done}/{task_count} tasks ({done / elapsed_s if elapsed_s else 0:.0f}/s)')
+
+            self.__create_orphans(c, orphan_notes, orphan_attachments, next_note_id, next_attachment_id)
+
+            self.connection.commit()
+        except:
+            self.connection.rollback()
+            raise
+        finally:
+            c.close()
+
+        return self.counts
+
+    def __create_tags(self, c):
+        c.executemany('''
+        INSERT OR IGNORE INTO TAG
+          (TAG_TEXT)
+          VALUES (?)
+        ''', [(tag_text(i),) for i in range(self.tag_count)])
+        self.counts['TAG'] += max(c.rowcount, 0)
+
+        texts = dict((tag_text(i), i) for i in range(self.tag_count))
+        tag_ids = [None] * self.tag_count
+        c.execute('''
+        SELECT
+            TAG_ID
+            , TAG_TEXT
+          FROM TAG
+        ''')
+        for r in c:
+            rank = texts.get(r[1])
+            if rank is not None:
+                tag_ids[rank] = r[0]
+
+        return tag_ids, cumulative(1 / (rank + 1) ** self.tag_skew for rank in range(self.tag_count))
+
+    def __create_batch(self, c, first_task_id, task_count, next_note_id, next_attachment_id, tag_ids, tag_cum_weights):
+        rnd = self.rnd
+        now = self.now
+
+        task_rows = []
+        task_tag_rows = []
+        note_rows = []
+        task_note_rows = []
+        attachment_rows = []
+        blob_rows = []
+        note_attachment_rows = []
+
+        for task_id in range(first_task_id, first_task_id + task_count):
+            mod_ts = now - timedelta(seconds=rnd.randint(0, self.history_days * 86400))
+            status = rnd.choices(self.statuses, cum_weights=self.status_cum_weights)[0]
+            if rnd.random() < self.due_null_ratio:
+                due_ts = None
+            else:
+                due_ts = (now + timedelta(days=rnd.randint(-self.due_past_days, self.due_future_days))).replace(
+                        hour=rnd.choice((0, 9, 12, 17)), minute=0, second=0, microsecond=0)
+            task_rows.append((task_id, f'{rnd.choice(words)} {rnd.choice(words)} {task_id}', status.value, to_epoch(due_ts),
+                    to_epoch(mod_ts)))
+
+            tag_total = min(self.tags_per_task.sample(rnd), len(tag_ids))
+            if tag_total:
+                task_tags = set()
+                while len(task_tags) < tag_total:
+                    task_tags.update(rnd.choices(tag_ids, cum_weights=tag_cum_weights, k=tag_total - len(task_tags)))
+                task_tag_rows.extend((task_id, tag_id) for tag_id in task_tags)
+
+            note_ids = []
+            for i in range(self.notes_per_task.sample(rnd)):
+                note_ts = mod_ts - timedelta(seconds=rnd.randint(0, 30 * 86400))
+                note_rows.append((next_note_id, ' '.join(rnd.choices(words, k=rnd.randint(3, 40))), to_epoch(note_ts)))
+                task_note_rows.append((task_id, next_note_id, 1 if i == 0 and rnd.random() < 0.1 else 0))
+                note_ids.append((next_note_id, note_ts))
+                next_note_id += 1
+
+            if note_ids:
+                for i in range(self.attachments_per_task.sample(rnd)):
+                    note_id, note_ts = rnd.choice(note_ids)
+                    attachment_row, blob_row = self.__attachment_rows(next_attachment_id, to_epoch(note_ts))
+                    attachment_rows.append(attachment_row)
+                    blob_rows.append(blob_row)
+                    note_attachment_rows.append((note_id, next_attachment_id))
+                    next_attachment_id += 1
+
+        self.__insert(c, 'TASK', '(TASK_ID, TASK_NM, STATUS_ID, DUE_TS, MOD_TS) VALUES (?, ?, ?, ?, ?)', task_rows)
+        self.__insert(c, 'TASK_TAG', '(TASK_ID, TAG_ID) VALUES (?, ?)', task_tag_rows)
+        self.__insert(c, 'NOTE', '(NOTE_ID, TEXT, MOD_TS) VALUES (?, ?, ?)', note_rows)
+        self.__insert(c, 'TASK_NOTE', '(TASK_ID, NOTE_ID, PINNED_IND) VALUES (?, ?, ?)', task_note_rows)
+        self.__insert_attachments(c, attachment_rows, blob_rows)
+        self.__insert(c, 'NOTE_ATTACHMENT', '(NOTE_ID, ATTACHMENT_ID) VALUES (?, ?)', note_attachment_rows)
+
+        return next_note_id, next_attachment_id
+
+    def __create_orphans(self, c, note_count, attachment_count, next_note_id, next_attachment_id):
+        '''
+        Notes without a task and attachments without a note, as left behind for MaintenanceService.sweep_orphans.
+        '''
+
+        rnd = self.rnd
+        ts = to_epoch(self.now - timedelta(days=1))
+        self.__insert(c, 'NOTE', '(NOTE_ID, TEXT, MOD_TS) VALUES (?, ?, ?)',
+                [(next_note_id + i, ' '.join(rnd.choices(words, k=10)), ts) for i in range(note_count)])
+        rows = [self.__attachment_rows(next_attachment_id + i, ts) for i in range(attachment_count)]
+        self.__insert_attachments(c, [r[0] for r in rows], [r[1] for r in rows])
+
+    def __attachment_rows(self, attachment_id, ts):
+        '''
+        returns (tuple, tuple): ATTACHMENT row and ATTACHMENT_BLOB row of a new attachment
+        '''
+
+        rnd = self.rnd
+        size = max(1, min(self.attachment_size.sample(rnd), self.max_attachment_size))
+        offset = rnd.randint(0, len(self.content_block) - size)
+        mime_type = rnd.choice(mime_types)
+        content = self.content_block[offset:offset + size]
+        content_hash = hashlib.sha256(content).hexdigest()
+        return ((attachment_id, f'{rnd.choice(words)}-{attachment_id}.{mime_type.rsplit("/", 1)[1]}', mime_type,
+                content_hash, size, ts), (content_hash, content))
+
+    def __insert_attachments(self, c, attachment_rows, blob_rows):
+        self.__insert(c, 'ATTACHMENT_BLOB', '(CONTENT_HASH, CONTENT) VALUES (?, ?) ON CONFLICT (CONTENT_HASH) DO NOTHING',
+                blob_rows)
+        self.__insert(c, 'ATTACHMENT', '(ATTACHMENT_ID, ATTACHMENT_NM, MIME_TYPE, CONTENT_HASH, CONTENT_SIZE, CRTN_TS) '
+                'VALUES (?, ?, ?, ?, ?, ?)', attachment_rows)
+
+    def __insert(self, c, table, columns_values, rows):
+        if not rows:
+            return
+        c.executemany(f'INSERT INTO {table} {columns_values}', rows)
+        # Excludes rows skipped by ON CONFLICT clauses.
+        self.counts[table] += max(c.rowcount, 0)
+
+    def __next_id(self, c, table, column):
+        c.execute(f'SELECT COALESCE(MAX({column}), 0) + 1 FROM {table}')
+        return next(c)[0]
+
+
+def tag_text(rank):
+    return f'{words[rank % len(words)]}-{rank}'
+
+def cumulative(weights):
+    result = []
+    total = 0
+    for w in weights:
+        total += w
+        result.append(total)
+    return result
+
+
+
+def main(argv=None):
+    arg_parser = ArgumentParser(description='Generates a synthetic task database for scale testing.')
+    arg_parser.add_argument('--sqlite-db', required=True, help='Database to create or extend.')
+    arg_parser.add_argument('--tasks', type=int, default=100000)
+    arg_parser.add_argument('--status', type=parse_weights, default='READY=4,PENDING=2,IN_PROGRESS=2,COMPLETE=10,CANCELED=1',
+            help='Relative status weights (default: %(default)s).')
+    arg_parser.add_argument('--due-null-ratio', type=float, default=0.3, help='Fraction of tasks without a due date.')
+    arg_parser.add_argument('--due-past-days', type=int, default=60, help='Earliest due date, in days before today.')
+    arg_parser.add_argument('--due-future-days', type=int, default=120, help='Latest due date, in days after today.')
+    arg_parser.add_argument('--history-days', type=int, default=730, help='Modification times are spread over this many days.')
+    arg_parser.add_argument('--tags', type=int, default=500, help='Tag vocabulary size.')
+    arg_parser.add_argument('--tag-skew', type=float, default=1.0, help='Zipf exponent of tag popularity (0: uniform).')
+    arg_parser.add_argument('--tags-per-task', type=Distribution, default='poisson:2')
+    arg_parser.add_argument('--notes-per-task', type=Distribution, default='poisson:1.5')
+    arg_parser.add_argument('--attachments-per-task', type=Distribution, default='poisson:0.3',
+            help='Attachments per task (added to its notes; tasks without notes get none).')
+    arg_parser.add_argument('--attachment-size', type=Distribution, default='lognormal:9:1.2', help='Attachment size in bytes.')
+    arg_parser.add_argument('--max-attachment-size', type=int, default=8 * 1024 * 1024)
+    arg_parser.add_argument('--orphan-notes', type=int, default=0, help='Notes to create without a task.')
+    arg_parser.add_argument('--orphan-attachments', type=int, default=0, help='Attachments to create without a note.')
+    arg_parser.add_argument('--batch-size', type=int, default=10000, help='Tasks generated per executemany batch.')
+    arg_parser.add_argument('--seed', type=int, default=1838)
+    args = arg_parser.parse_args(argv)
+
+    rnd = random.Random(args.seed)
+    connection = get_connection(args.sqlite_db)
+    try:
+        generator = Generator(connection, rnd, args.status, args.tags, args.tag_skew, args.tags_per_task,
+                args.notes_per_task, args.attachments_per_task, args.attachment_size, args.max_attachment_size,
+                args.due_null_ratio, args.due_past_days, args.due_future_days, args.history_days, args.batch_size)
+
+        start = time.monotonic()
+        counts = generator.run(args.tasks, args.orphan_notes, args.orphan_attachments)
+        elapsed_s = time.monotonic() - start
+    finally:
+        connection.close()
+
+    print(f'Generated in {elapsed_s:.1f}s:')
+    for table, count in counts.items():
+        print(f'  {table:16} {count:>10}')
+    print(f'Database size: {os.path.getsize(args.sqlite_db) / 1024 / 1024:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
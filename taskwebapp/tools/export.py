@@ -0,0 +1,81 @@
+'''
+Exports tasks (with tags, notes and attachment references) as NDJSON or JSON, streaming from the database so memory
+use stays flat regardless of its size:
+
+    python -m taskwebapp.tools.export --sqlite-db ~/.taskwebapp.sqlite --output tasks.ndjson
+    python -m taskwebapp.tools.export --status READY --status PENDING --tag work --name report --name-op CONTAINS
+
+Filters correspond to those of the task search page, and are combined with AND.
+'''
+
+# Imports
+# Standard
+import os
+import sys
+import time
+
+from argparse import ArgumentParser
+from datetime import datetime
+
+# User
+import taskwebapp.domain.task.codec as codec
+
+from taskwebapp.controller.task import TaskSearchCriteria
+from taskwebapp.domain.task import TaskStatus
+from taskwebapp.domain.task.search import TaskSearchStrOp, TaskSearchNumOp, TaskSearchSimpleExpr, TaskSearchIsAnyExpr, \
+        TaskSearchField
+from taskwebapp.service.sqlite import TaskService
+
+
+# Definitions
+def build_criteria(args):
+    criteria = TaskSearchCriteria()
+    if args.name:
+        criteria.i_and(TaskSearchSimpleExpr(TaskSearchField.NAME, TaskSearchStrOp[args.name_op], args.name))
+    if args.due:
+        criteria.i_and(TaskSearchSimpleExpr(TaskSearchField.DUE, TaskSearchNumOp[args.due_op], args.due))
+    if args.status:
+        criteria.i_and(TaskSearchIsAnyExpr(TaskSearchField.STATUS, [TaskStatus[s] for s in args.status]))
+    if args.tag:
+        criteria.i_and(TaskSearchIsAnyExpr(TaskSearchField.TAGS, args.tag))
+    return criteria
+
+
+def main(argv=None):
+    arg_parser = ArgumentParser(description='Exports tasks as NDJSON or JSON.')
+    arg_parser.add_argument('--sqlite-db', default=os.path.join(os.path.expanduser('~'), '.taskwebapp.sqlite'))
+    arg_parser.add_argument('--output', default=None, help='Output file (default: stdout).')
+    arg_parser.add_argument('--format', choices=('ndjson', 'json'), default='ndjson')
+    arg_parser.add_argument('--encoding', default='utf-8')
+    arg_parser.add_argument('--name', default=None, help='Task name filter.')
+    arg_parser.add_argument('--name-op', choices=[op.name for op in TaskSearchStrOp], default='CONTAINS')
+    arg_parser.add_argument('--due', type=datetime.fromisoformat, default=None, help='Due date filter (ISO format).')
+    arg_parser.add_argument('--due-op', choices=[op.name for op in TaskSearchNumOp], default='LTE')
+    arg_parser.add_argument('--status', action='append', choices=[s.name for s in TaskStatus], help='Status filter (repeatable; any of).')
+    arg_parser.add_argument('--tag', action='append', help='Tag filter (repeatable; any of).')
+    args = arg_parser.parse_args(argv)
+
+    criteria = build_criteria(args)
+    tasks = TaskService(args.sqlite_db).export_tasks(criteria.expr)
+
+    count = 0
+    def counted(tasks):
+        nonlocal count
+        for task in tasks:
+            count += 1
+            yield task
+
+    start = time.monotonic()
+    f = open(args.output, 'w', encoding=args.encoding) if args.output else sys.stdout
+    try:
+        for part in codec.export_parts(counted(tasks), args.format):
+            f.write(part)
+    finally:
+        if args.output:
+            f.close()
+
+    print(f'Exported {count} tasks in {time.monotonic() - start:.1f}s.', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
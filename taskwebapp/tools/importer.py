@@ -0,0 +1,64 @@
+'''
+Bulk-imports tasks (with tags and notes) from NDJSON, JSON or CSV, such as files produced by taskwebapp.tools.export or
+converted from another tool:
+
+    python -m taskwebapp.tools.importer --sqlite-db ~/.taskwebapp.sqlite tasks.ndjson
+    python -m taskwebapp.tools.importer --format csv tasks.csv
+
+Imported tasks are assigned new IDs; attachment references are not imported. CSV files need a header row with a name
+column, and may have status, due_ts, tags (comma-separated), note and pinned_note columns (the latter two repeatable).
+Tasks are written in batches, one transaction each; if the input is malformed, batches already written are kept.
+'''
+
+# Imports
+# Standard
+import os
+import sys
+import time
+
+from argparse import ArgumentParser
+
+# User
+import taskwebapp.domain.task.codec as codec
+
+from taskwebapp.service.sqlite import TaskService
+
+
+# Definitions
+def main(argv=None):
+    arg_parser = ArgumentParser(description='Bulk-imports tasks from NDJSON, JSON or CSV.')
+    arg_parser.add_argument('input', help='Input file; - for stdin.')
+    arg_parser.add_argument('--sqlite-db', default=os.path.join(os.path.expanduser('~'), '.taskwebapp.sqlite'))
+    arg_parser.add_argument('--format', choices=list(codec.readers), default=None, help='Input format (default: from the file extension).')
+    arg_parser.add_argument('--encoding', default='utf-8')
+    arg_parser.add_argument('--batch-size', type=int, default=5000, help='Tasks written per transaction.')
+    args = arg_parser.parse_args(argv)
+
+    import_format = args.format or os.path.splitext(args.input)[1][1:].casefold()
+    if import_format not in codec.readers:
+        arg_parser.error(f'Cannot determine the format of {args.input}; use --format.')
+
+    start = time.monotonic()
+    imported = 0
+    def progress(count):
+        nonlocal imported
+        imported = count
+        elapsed_s = time.monotonic() - start
+        print(f'{count} tasks imported ({count / elapsed_s if elapsed_s else 0:.0f}/s)', file=sys.stderr)
+
+    f = open(args.input, encoding=args.encoding, newline='') if args.input != '-' else sys.stdin
+    try:
+        TaskService(args.sqlite_db).import_tasks(codec.readers[import_format](f), args.batch_size, progress)
+    except codec.TaskDecodeException as e:
+        print(f'Import stopped: {e} ({imported} tasks imported before the error)', file=sys.stderr)
+        return 1
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+    print(f'Imported {imported} tasks in {time.monotonic() - start:.1f}s.', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,16 @@
 
 # Imports
 # Standard
-from threading import Thread
+import json
+
+from threading import Thread, Lock
+from http.server import ThreadingHTTPServer
 
 # User
 import taskwebapp.requestutils as requestutils
 
+from taskwebapp.metrics import stage
+
 
 # Definitions
 class RequestContext:
@@ -57,6 +62,37 @@ class RequestContext:
         
     
     
+    def write_json(self, value, status=200, headers=None):
+        handler = self.handler
+        
+        resp = json.dumps(value).encode(self.encoding)
+        
+        handler.send_response(status)
+        handler.send_header('Content-Type', requestutils.content_type_value('application/json', self.encoding))
+        handler.send_header('Content-Length', len(resp))
+        if headers:
+            for name, value in headers.items():
+                handler.send_header(name, value)
+        handler.end_headers()
+        
+        handler.wfile.write(resp)
+    
+    def write_chunked(self, content_type, parts, headers=None):
+        '''
+        Streams the given parts (str) with chunked transfer encoding, so the response need not be held in memory.
+        '''
+        
+        handler = self.handler
+        handler.send_response(200)
+        handler.send_header('Content-Type', requestutils.content_type_value(content_type, self.encoding))
+        handler.send_header('Transfer-Encoding', 'chunked')
+        if headers:
+            for name, value in headers.items():
+                handler.send_header(name, value)
+        handler.end_headers()
+        
+        requestutils.write_chunked(parts, handler.wfile, self.encoding)
+    
     def redirect(self, location, message='Redirecting...'):
         resp = bytes(f'<!DOCTYPE html><html><body><p>{message}</p>'
                      f'<p>If your browser does not do this automatically, click <a href="{location}">here</a>.</p></body></html>', self.encoding)
@@ -72,6 +108,29 @@ class RequestContext:
 
 
 
+class DetachableHTTPServer(ThreadingHTTPServer):
+    '''
+    ThreadingHTTPServer whose request handlers can take over their connection: once detach_request is called for a
+    request's socket, the server neither shuts down nor closes it after the handler returns.
+    '''
+    
+    def __init__(self, server_address, request_handler_class):
+        super().__init__(server_address, request_handler_class)
+        self.detached = set()
+        self.detached_lock = Lock()
+    
+    def detach_request(self, request):
+        with self.detached_lock:
+            self.detached.add(request)
+    
+    def shutdown_request(self, request):
+        with self.detached_lock:
+            if request in self.detached:
+                self.detached.remove(request)
+                return
+        super().shutdown_request(request)
+
+
 class ServerThread(Thread):
     def __init__(self, server):
         super().__init__()
@@ -91,6 +150,7 @@ class JinjaRenderer:
         requestutils.write_chunked(template.generate(variables) if variables else template.generate(), wfile, self.encoding)
     
     def render(self, template_name, variables=None):
-        template = self.env.get_template(template_name)
-        return (template.render(variables) if variables else template.render()).encode(self.encoding)
+        with stage('render'):
+            template = self.env.get_template(template_name)
+            return (template.render(variables) if variables else template.render()).encode(self.encoding)
     